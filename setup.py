@@ -2,12 +2,15 @@
     Setup file.
 """
 import os
+import time
 import shutil
+import hashlib
 import fnmatch
 import htmlmin
 from jsmin import jsmin
 import ujson
 import json
+from multiprocessing import Pool
 
 from setuptools import setup, find_packages
 from distutils.command.clean import clean
@@ -59,57 +62,62 @@ class cleandev(clean):
                            .format(dir_, err))
 
 
-class compileJSON(_build_py):
+def find_files(path, pattern):
+    return sorted([os.path.join(dirpath, f)
+                   for dirpath, dirnames, files in os.walk(path)
+                   for f in fnmatch.filter(files, pattern)])
 
-    def run(self):
-        paths = [os.path.join(here, 'location_files')]
-        file_patterns = ['*wizard.json']
-
-        with open(os.path.join(here, 'location_files/style.css'), "r") as css_file:
-            for path in paths:
-                for pattern in file_patterns:
-                    file_list = [os.path.join(dirpath, f)
-                                 for dirpath, dirnames, files in os.walk(path)
-                                 for f in fnmatch.filter(files, pattern)]
-
-                    for f in file_list:
-                        try:
-                            self.parse(self, f, css_file)
-                        except OSError as err:
-                            print ("Failed to find {0}. Error {1}".format(f, err))
-
-            print ("Compiled {0} location(s)".format(len(file_list)))
-
-    def parse(self, obj, path, css):
-        if not hasattr(self, 'paths'):
-            self.paths = set()
-        with open(path, "r") as wizard_json:
+
+class LocationCompiler(object):
+    '''
+        Compiles the wizard of one location, with the HTML bodies and JS
+        functions of its custom steps minified and filled in, into the
+        location's compiled.json.
+    '''
+    # change this to make the next build recompile every location.
+    version = 1
+
+    def __init__(self, wizard_path, css):
+        self.wizard_path = wizard_path
+        self.path = os.path.dirname(wizard_path)
+        self.css = css
+
+    def input_files(self):
+        return ([self.wizard_path] +
+                find_files(self.path, "*.html") +
+                find_files(self.path, "*.js"))
+
+    def input_hash(self):
+        '''
+            The hash of everything that goes into our compiled.json.
+        '''
+        hasher = hashlib.sha1(str(self.version))
+        hasher.update(self.css.encode('utf-8'))
+
+        for file_path in self.input_files():
+            hasher.update(os.path.relpath(file_path, self.path))
+
+            with open(file_path, "rb") as f:
+                hasher.update(f.read())
+
+        return hasher.hexdigest()
+
+    def compile(self):
+        with open(self.wizard_path, "r") as wizard_json:
             data = unicode(wizard_json.read(), "utf-8")
             data_obj = ujson.loads(data)
-            for key in data_obj:
-                print ("Compiling {0} location wizard".format(data_obj["name"]))
-                for step in data_obj["steps"]:
-                    dirpath = os.path.dirname(path)
-                    if dirpath not in self.paths:
-                        if step["type"] == "custom":
-                            self.fill_html_body(data_obj, dirpath, css)
-                            self.fill_js_functions(data_obj, dirpath)
-                            self.paths.add(dirpath)
-                        else:
-                            self.write_compiled_json(data_obj, dirpath)
-
-    def findHTML(self, obj, path):
-        html_files = [os.path.join(dirpath, f) for dirpath, dirnames, files in os.walk(path) for f in fnmatch.filter(files, "*.html")]
-        return html_files
-
-    def findJS(self, obj, path):
-        js_files = [os.path.join(dirpath, f) for dirpath, dirnames, files in os.walk(path) for f in fnmatch.filter(files, "*.js")]
-        return js_files
-
-    def fill_js_functions(self, obj, path):
+
+        print ("Compiling {0} location wizard".format(data_obj["name"]))
+
+        if any([step["type"] == "custom" for step in data_obj["steps"]]):
+            self.fill_html_body(data_obj)
+            self.fill_js_functions(data_obj)
+
+        self.write_compiled_json(data_obj)
+
+    def fill_js_functions(self, obj):
         steps = obj["steps"]
-        js_file_list = self.findJS(obj, path)
-        for file_path in js_file_list:
+        for file_path in find_files(self.path, "*.js"):
             filename = os.path.basename(os.path.dirname(file_path).split("/js")[0])
             js_file_name = self.grab_filename(file_path)
 
@@ -118,28 +126,22 @@ class compileJSON(_build_py):
                     print("    Processing {0}".format(os.path.sep.join(file_path.split(os.path.sep)[-5:-1]) + os.path.sep + js_file_name + '.js'))
                     step["functions"][js_file_name] = self.jsMinify(file_path)
 
-        self.write_compiled_json(obj, path)
-
-    def fill_html_body(self, obj, path, css):
+    def fill_html_body(self, obj):
         steps = obj["steps"]
-        html_file_list = self.findHTML(obj, path)
-        for file_path in html_file_list:
+        for file_path in find_files(self.path, "*.html"):
             filename = self.grab_filename(file_path)
 
             for step in steps:
                 if step["type"] == "custom" and step["name"] == filename:
                     print("    Processing {0}".format(os.path.sep.join(file_path.split(os.path.sep)[-5:-1]) + os.path.sep + filename + '.html'))
-                    step["body"] = self.htmlMinify(file_path, css)
-        self.write_compiled_json(obj, path)
+                    step["body"] = self.htmlMinify(file_path)
 
     def grab_filename(self, path):
         return os.path.basename(path).split(".")[0]
 
-    def htmlMinify(self, path, css):
+    def htmlMinify(self, path):
         with open(path, "r") as myfile:
-            css.seek(0)
-            css_read = unicode(css.read(), "utf-8")
-            data = u"<style>" + css_read + u"</style>" + unicode(myfile.read(), "utf-8")
+            data = u"<style>" + self.css + u"</style>" + unicode(myfile.read(), "utf-8")
             return htmlmin.minify(data)
 
     # def remove_head_tags(self, string):
@@ -152,11 +154,128 @@ class compileJSON(_build_py):
             data = unicode(myfile.read(), "utf-8")
             return jsmin(data)
 
-    def write_compiled_json(self, obj, path):
-        with open(path + "/compiled.json", 'w+') as f:
+    def write_compiled_json(self, obj):
+        with open(self.path + "/compiled.json", 'w+') as f:
             json.dump(obj, f, indent=4)
 
 
+def compile_location(args):
+    '''
+        Compiles a location in one of our build processes.
+        Returns the location folder, the compile time and any error.
+    '''
+    wizard_path, css = args
+    begin = time.time()
+
+    try:
+        LocationCompiler(wizard_path, css).compile()
+    except Exception as err:
+        return (os.path.dirname(wizard_path), time.time() - begin, str(err))
+
+    return (os.path.dirname(wizard_path), time.time() - begin, None)
+
+
+class compileJSON(_build_py):
+    description = 'compiles the location wizards into compiled.json files'
+
+    user_options = _build_py.user_options + [
+        ('jobs=', 'j', 'number of locations to compile in parallel'),
+    ]
+
+    # the input hash of each location as of its last compile
+    cache_file = os.path.join(here, 'location_files', '.compile_cache.json')
+
+    def initialize_options(self):
+        _build_py.initialize_options(self)
+        self.jobs = None
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_cache(self, cache):
+        with open(self.cache_file, "w") as f:
+            json.dump(cache, f, indent=4, sort_keys=True)
+
+    def run(self):
+        path = os.path.join(here, 'location_files')
+
+        with open(os.path.join(path, 'style.css'), "r") as css_file:
+            css = unicode(css_file.read(), "utf-8")
+
+        force = getattr(self, 'force', False)
+        jobs = getattr(self, 'jobs', None)
+
+        cache = {} if force else self.load_cache()
+        hashes = {}
+        todo = []
+
+        for wizard_path in find_files(path, '*wizard.json'):
+            location = os.path.relpath(os.path.dirname(wizard_path), path)
+            compiler = LocationCompiler(wizard_path, css)
+
+            hashes[location] = compiler.input_hash()
+
+            if (cache.get(location) == hashes[location] and
+                    os.path.exists(os.path.join(compiler.path,
+                                                'compiled.json'))):
+                continue
+
+            todo.append(wizard_path)
+
+        results = []
+
+        if todo:
+            pool = Pool(int(jobs) if jobs else None)
+            try:
+                results = pool.map(compile_location,
+                                   [(w, css) for w in todo])
+            finally:
+                pool.close()
+                pool.join()
+
+        for location_path, compile_time, error in sorted(results):
+            location = os.path.relpath(location_path, path)
+
+            if error is None:
+                cache[location] = hashes[location]
+                print ("    {0:<40} {1:.2f}s".format(location, compile_time))
+            else:
+                cache.pop(location, None)
+                print ("    {0:<40} failed: {1}".format(location, error))
+
+        self.save_cache(cache)
+
+        print ("Compiled {0} location(s), {1} unchanged"
+               .format(len(todo), len(hashes) - len(todo)))
+
+
+class compileSnapshots(_build_py):
+    description = 'writes a binary snapshot of each location model'
+
+    def run(self):
+        # this needs py_gnome, which the other commands don't
+        from webgnome_api.common.location_snapshot import write_snapshot
+
+        path = os.path.join(here, 'location_files')
+        save_dirs = [os.path.join(path, d, d + '_save')
+                     for d in sorted(os.listdir(path))
+                     if os.path.isdir(os.path.join(path, d, d + '_save'))]
+
+        for save_dir in save_dirs:
+            try:
+                snapshot = write_snapshot(save_dir)
+                print "Wrote snapshot {0}".format(snapshot)
+            except Exception as err:
+                print ("Failed to snapshot {0}. Error: {1}"
+                       .format(save_dir, err))
+
+        print ("Compiled {0} location snapshot(s)".format(len(save_dirs)))
+
+
 class developall(base_develop, compileJSON):
     description = ''
 
@@ -180,12 +299,16 @@ setup(name='webgnome_api',
       url='',
       cmdclass={'cleandev': cleandev,
                 'developall': developall,
-                'compilejson': compileJSON
+                'compilejson': compileJSON,
+                'compilesnapshots': compileSnapshots
                 },
       packages=find_packages(),
       include_package_data=True,
       zip_safe=False,
       test_suite='webgnome_api',
       entry_points=('[paste.app_factory]\n'
-                    '  main = webgnome_api:main\n'),
+                    '  main = webgnome_api:main\n'
+                    '[paste.filter_factory]\n'
+                    '  gzip = webgnome_api.common.gzip_filter:'
+                    'make_gzip_filter\n'),
 )
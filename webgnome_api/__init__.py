@@ -2,15 +2,32 @@
     Main entry point
 """
 import os
-from threading import BoundedSemaphore
+import pkgutil
+import importlib
+from threading import Thread, Lock
 
 import logging
 
 import ujson
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 from pyramid.renderers import JSON as JSONRenderer
 
 from webgnome_api.common.views import cors_policy
+from webgnome_api.common.helpers import class_registry
+from webgnome_api.common.locks import SessionLockManager
+from webgnome_api.common.uncertainty_pool import UncertaintyWorkerPool
+from webgnome_api.common.session_eviction import SessionEvictor
+from webgnome_api.common.reaper import SessionReaper
+from webgnome_api.common.location_cache import LocationModelCache
+from webgnome_api.common.file_store import DataFileStore
+from webgnome_api.common.location_index import LocationIndex
+from webgnome_api.common.session_management import (known_session_ids,
+                                                    live_session_ids,
+                                                    reap_session,
+                                                    evict_idle_sessions,
+                                                    update_object_sizes,
+                                                    memory_caps)
 
 logging.basicConfig()
 
@@ -42,16 +59,152 @@ def load_cors_origins(settings, key):
         cors_policy['origins'] = origins
 
 
+def make_uncertainty_pool(settings):
+    pool_size = int(settings.get('uncertainty.pool_size', 0))
+
+    if pool_size > 0:
+        return UncertaintyWorkerPool(pool_size, 'ipc_files')
+    else:
+        return None
+
+
+def make_session_evictor(settings):
+    idle_time = float(settings.get('session_eviction.idle_time', 0))
+    max_resident = int(settings.get('session_eviction.max_resident', 0))
+
+    if idle_time <= 0 and max_resident <= 0:
+        return None
+
+    snapshot_dir = settings['session_eviction.dir']
+    if not os.path.exists(snapshot_dir):
+        print 'Creating folder {0}'.format(snapshot_dir)
+        os.mkdir(snapshot_dir)
+
+    check_interval = float(settings.get('session_eviction.check_interval',
+                                        60))
+
+    return SessionEvictor(settings['objects'], snapshot_dir,
+                          idle_time, max_resident, check_interval,
+                          settings['session_locks'])
+
+
+def start_location_warm_up(settings):
+    '''
+        Loads the models of all our locations into the location cache in
+        the background, so that the server can take requests meanwhile.
+    '''
+    location_files = [save_dir for _content, save_dir
+                      in settings['location_index'].locations.values()
+                      if os.path.isdir(save_dir)]
+    num_processes = int(settings.get('location_cache.warm_up_processes', 0))
+
+    thread = Thread(target=settings['location_models'].warm_up,
+                    args=(location_files, num_processes or None,
+                          settings['py_gnome_shared_lock']))
+    thread.daemon = True
+    thread.start()
+
+
+def make_data_file_store(settings):
+    store_dir = settings.get('data_file_store.dir', '')
+
+    if store_dir == '':
+        return None
+
+    if not os.path.exists(store_dir):
+        print 'Creating folder {0}'.format(store_dir)
+        os.makedirs(store_dir)
+
+    gc_interval = float(settings.get('data_file_store.gc_interval', 3600))
+
+    return DataFileStore(store_dir, gc_interval)
+
+
+def make_session_reaper(registry):
+    '''
+        Starts the background thread that reaps expired sessions, if that
+        is enabled.  The thread also does our other background work, like
+        evicting idle sessions, estimating the size of the sessions'
+        objects and collecting the garbage of the data file store, and is
+        started for any of it even if reaping is off.  This work is done
+        here rather than on the request path, so that no request pays for
+        another session's.
+    '''
+    settings = registry.settings
+    evictor = settings['session_evictor']
+    file_store = settings['data_file_store']
+    interval = float(settings.get('session_reaper.interval', 0))
+    session_cap = memory_caps(settings)[0]
+
+    # how often each of our other background tasks wants a round
+    intervals = []
+    if evictor is not None:
+        intervals.append(evictor.check_interval)
+    if session_cap > 0:
+        intervals.append(float(settings.get('memory.check_interval', 60)))
+    if file_store is not None:
+        intervals.append(file_store.gc_interval)
+
+    if interval > 0:
+        reap = lambda session_id: reap_session(settings, session_id)
+    elif intervals:
+        reap = None
+        interval = min(intervals)
+    else:
+        return None
+
+    def between_rounds():
+        if evictor is not None and evictor.check_due():
+            evict_idle_sessions(settings)
+
+        if session_cap > 0:
+            update_object_sizes(settings)
+
+        if file_store is not None and file_store.gc_due():
+            file_store.collect_garbage()
+
+    reaper = SessionReaper(interval,
+                           lambda: known_session_ids(settings),
+                           lambda ids: live_session_ids(registry, ids),
+                           reap,
+                           between_rounds)
+    reaper.start()
+
+    return reaper
+
+
+def register_implemented_types(package_name):
+    '''
+        Registers the implemented types of every view module in a package
+        with our class registry.
+    '''
+    package = importlib.import_module(package_name)
+
+    for _loader, name, _is_pkg in pkgutil.iter_modules(package.__path__):
+        module = importlib.import_module('{0}.{1}'.format(package_name, name))
+        implemented_types = getattr(module, 'implemented_types', None)
+
+        if implemented_types is not None:
+            class_registry.register(implemented_types)
+
+
 def get_json(request):
     return ujson.loads(request.text)
 
 
 def main(global_config, **settings):
     settings['package_root'] = os.path.abspath(os.path.dirname(__file__))
-    settings['py_gnome_semaphore'] = BoundedSemaphore(value=1)
+    settings['session_locks'] = SessionLockManager()
+    settings['py_gnome_shared_lock'] = Lock()
     settings['objects'] = {}
 
     settings['uncertain_models'] = {}
+    settings['uncertain_model_configs'] = {}
+    settings['model_hosts'] = {}
+    settings['step_prefetchers'] = {}
+    settings['run_jobs'] = {}
+    settings['serialized_objects'] = {}
+    settings['object_sizes'] = {}
     try:
         os.mkdir('ipc_files')
     except OSError, e:
@@ -59,9 +212,34 @@ def main(global_config, **settings):
         if e.errno != 17:
             raise
 
+    # The pool is forked before we have any models, so that the workers
+    # start out small.
+    settings['uncertainty_pool'] = make_uncertainty_pool(settings)
+
+    settings['session_evictor'] = make_session_evictor(settings)
+
+    settings['data_file_store'] = make_data_file_store(settings)
+
+    if asbool(settings.get('location_cache.enabled', False)):
+        check_interval = float(settings.get('location_cache.check_interval',
+                                            60))
+        settings['location_models'] = LocationModelCache(
+            check_interval=check_interval
+        )
+    else:
+        settings['location_models'] = None
+
     reconcile_directory_settings(settings)
     load_cors_origins(settings, 'cors_policy.origins')
 
+    check_interval = float(settings.get('location_index.check_interval', 60))
+    settings['location_index'] = LocationIndex(settings['locations_dir'],
+                                               check_interval)
+
+    if (settings['location_models'] is not None and
+            asbool(settings.get('location_cache.warm_up', False))):
+        start_location_warm_up(settings)
+
     config = Configurator(settings=settings)
 
     config.add_request_method(get_json, 'json', reify=True)
@@ -77,4 +255,11 @@ def main(global_config, **settings):
 
     config.scan('webgnome_api.views')
 
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+
+    register_implemented_types('webgnome_api.views')
+
+    registry = config.registry
+    registry.settings['session_reaper'] = make_session_reaper(registry)
+
+    return app
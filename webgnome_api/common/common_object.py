@@ -2,20 +2,24 @@
 Common Gnome object request handlers.
 """
 import os
+import time
 import shutil
 import urllib2
+import logging
 import ujson
 
 from types import MethodType, FunctionType, BuiltinFunctionType, NoneType
 from logging import Logger
 
-from .helpers import FQNamesToDict, PyClassFromName
+from .helpers import class_registry
 
 from gnome.utilities.orderedcollection import OrderedCollection
 from gnome.spill_container import SpillContainerPair
 from gnome.utilities.geometry.BBox import BBox
 
-from webgnome_api.common.session_management import set_session_object
+from webgnome_api.common.session_management import get_session_objects
+
+log = logging.getLogger(__name__)
 
 
 def CreateObject(json_obj, all_objects, deserialize_obj=True):
@@ -27,10 +31,7 @@ def CreateObject(json_obj, all_objects, deserialize_obj=True):
     '''
     json_obj = _DeserializeObject(json_obj)
 
-    for o in ProcessJsonObjectTree(_CreateObject, json_obj, all_objects):
-        pass
-
-    return o
+    return ProcessJsonObjectTree(_CreateObject, json_obj, all_objects)
 
 
 def UpdateObject(obj, json_obj, all_objects, deserialize_obj=True):
@@ -42,33 +43,231 @@ def UpdateObject(obj, json_obj, all_objects, deserialize_obj=True):
     '''
     json_obj = _DeserializeObject(json_obj)
 
-    [o for o in ProcessJsonObjectTree(_UpdateObject, json_obj, all_objects)]
+    ProcessJsonObjectTree(_UpdateObject, json_obj, all_objects)
+
+
+class PatchFieldError(ValueError):
+    '''
+        A partial payload names fields that can't be updated.
+    '''
+    pass
+
+
+def PatchObject(obj, json_obj, all_objects):
+    '''
+        Prepares a partial payload to be applied to an object.  Only the
+        fields in the payload are deserialized and updated; the rest of
+        the object, and the objects it contains, are left alone.
+
+        A nested payload that refers to an object we have is a patch of
+        that object.  Any other nested payload is a new object.
+
+        The whole payload, including its nested payloads, is checked and
+        deserialized here, and nothing is changed until the returned
+        function is called.  That function applies the payload, and
+        returns the names of the fields that were updated.
+
+        A PatchFieldError is raised if the payload names a field that
+        isn't one of the updatable fields of its object.
+    '''
+    bad_fields = _PatchFieldErrors(obj, json_obj, all_objects)
+    if bad_fields:
+        raise PatchFieldError('cannot update fields: {0}'
+                              .format(', '.join(sorted(bad_fields))))
+
+    apply_patch = _PatchObject(obj, json_obj, all_objects)
+    field_names = [n for n, _v in _PatchFields(json_obj)]
+
+    def apply_and_name_fields():
+        apply_patch()
+
+        return field_names
+
+    return apply_and_name_fields
+
+
+def _PatchFields(json_obj):
+    return [(n, v) for n, v in json_obj.items()
+            if n not in ('id', 'obj_type', 'json_')]
+
+
+def _PatchFieldErrors(obj, json_obj, all_objects):
+    state = getattr(obj, '_state', None)
+    updatable = state.get_names('update') if state is not None else None
+
+    bad_fields = []
+    for name, value in _PatchFields(json_obj):
+        if updatable is not None and name not in updatable:
+            bad_fields.append('{0}.{1}'.format(obj.__class__.__name__,
+                                               name))
+
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+
+        for v in value:
+            if isinstance(v, dict) and ObjectExists(v, all_objects):
+                bad_fields.extend(_PatchFieldErrors(all_objects[ObjectId(v)],
+                                                    v, all_objects))
+
+    return bad_fields
+
+
+def _PatchObject(obj, json_obj, all_objects):
+    '''
+        Deserializes a partial payload for an object, and returns a
+        function that applies it and returns the object.
+    '''
+    nested = {}
+    fields = []
+
+    for name, value in _PatchFields(json_obj):
+        if _ValueIsNested(value, all_objects):
+            nested[name] = _PatchNestedValue(value, all_objects)
+        else:
+            fields.append((name, value))
+
+    changes = _DeserializeFields(obj, json_obj, fields)
+
+    def apply_patch():
+        for name, apply_value in nested.items():
+            changes[name] = apply_value()
+
+        obj.update_from_dict(changes)
+
+        return obj
+
+    return apply_patch
+
+
+def _ValueIsNested(value, all_objects):
+    if isinstance(value, dict):
+        return ObjectExists(value, all_objects) or ValueIsJsonObject(value)
+    else:
+        return (isinstance(value, (list, tuple)) and
+                any([isinstance(v, dict) for v in value]))
+
+
+def _PatchNestedValue(value, all_objects):
+    '''
+        Deserializes a nested payload, and returns a function that applies
+        it and returns the value to assign to the parent's field.
+    '''
+    if isinstance(value, dict) and ObjectExists(value, all_objects):
+        return _PatchObject(all_objects[ObjectId(value)], value, all_objects)
+    elif ValueIsJsonObject(value):
+        payload = _DeserializeObject(value)
+
+        return lambda: ProcessJsonObjectTree(_CreateObject, payload,
+                                             all_objects)
+    elif isinstance(value, (list, tuple)):
+        apply_values = [_PatchNestedValue(v, all_objects) for v in value]
+
+        return lambda: [apply_value() for apply_value in apply_values]
+    else:
+        return lambda: value
+
+
+def _DeserializeFields(obj, json_obj, fields):
+    '''
+        Deserializes some of the fields of an object the way a full
+        payload would be, with the deserialize method of its class, so
+        that any conversions it makes, like the units of a wind
+        timeseries, are made for a partial payload as well.
+
+        The schema's required fields that aren't in the payload are
+        filled in with the object's current values.
+    '''
+    py_class = obj.__class__
+
+    if not fields or not hasattr(py_class, 'deserialize'):
+        return dict(fields)
+
+    schema = py_class._schema()
+    names = set([n for n, _v in fields])
+    required = [c.name for c in schema.children
+                if c.required and c.name not in names and
+                c.name not in ('id', 'obj_type', 'json_')]
+
+    payload = SerializeFields(obj, required)
+    payload.update(fields)
+    payload['json_'] = json_obj.get('json_', 'webapi')
+
+    deserialized = py_class.deserialize(payload)
+
+    return dict([(n, deserialized[n]) for n in names])
+
+
+def SerializeFields(obj, field_names):
+    '''
+        Serializes only some of the fields of an object, along with its
+        id and obj_type.  Contained objects are serialized in full.
+    '''
+    schema = obj._schema() if hasattr(obj, '_schema') else None
+    json_obj = {'id': obj.id,
+                'obj_type': '{0}.{1}'.format(obj.__class__.__module__,
+                                             obj.__class__.__name__)}
+
+    for name in field_names:
+        to_dict = getattr(obj, '{0}_to_dict'.format(name), None)
+        value = to_dict() if to_dict is not None else getattr(obj, name)
+
+        node = schema.get(name) if schema is not None else None
+        json_obj[name] = _SerializeValue(node, value)
+
+    return json_obj
+
+
+def _SerializeValue(node, value):
+    if hasattr(value, 'serialize'):
+        return value.serialize()
+    elif (isinstance(value, (list, tuple, OrderedCollection)) and
+            any([hasattr(v, 'serialize') for v in value])):
+        return [_SerializeValue(None, v) for v in value]
+    elif node is not None:
+        return node.serialize(value)
+    else:
+        return value
 
 
 def _DeserializeObject(json_obj):
     '''
         The py_gnome deserialize method can handle nested payloads
     '''
-    py_class = PyClassFromName(json_obj['obj_type'])
+    py_class = class_registry.get_class(json_obj['obj_type'])
 
     return py_class.deserialize(json_obj)
 
 
-def ProcessJsonObjectTree(function, payload, all_objects,
-                          parent=None, attr_name=None):
-    if (isinstance(payload, dict)):
-        for k, v in payload.items():
-            for o in ProcessJsonObjectTree(function, v, all_objects,
-                                           payload, k):
-                yield o
+def ProcessJsonObjectTree(function, payload, all_objects):
+    '''
+        Walks a deserialized payload once, calling function on every
+        dict in it, children before their parents, so that by the time
+        a parent is processed its child payloads have been replaced by
+        their objects.
+
+        Returns the result of the function for the top payload.
+    '''
+    obj = None
+    todo = [(payload, None, None, False)]
+
+    while todo:
+        node, parent, attr_name, children_done = todo.pop()
+
+        if isinstance(node, dict):
+            if children_done:
+                obj = function(node, parent, attr_name, all_objects)
+                continue
+
+            todo.append((node, parent, attr_name, True))
+            items = node.items()
+        else:
+            items = enumerate(node)
 
-        obj = function(payload, parent, attr_name, all_objects)
-        yield obj
-    elif (isinstance(payload, (list, tuple))):
-        for i, v in enumerate(payload):
-            for o in ProcessJsonObjectTree(function, v, all_objects,
-                                           payload, i):
-                yield o
+        # pushed in reverse, so that they are processed in order
+        todo.extend(reversed([(v, node, k, False) for k, v in items
+                              if isinstance(v, (dict, list, tuple))]))
+
+    return obj
 
 
 def _CreateObject(payload, parent, attr_name, all_objects):
@@ -82,7 +281,7 @@ def _CreateObject(payload, parent, attr_name, all_objects):
     elif ObjectExists(payload, all_objects):
         obj = all_objects[ObjectId(payload)]
     else:
-        py_class = PyClassFromName(payload['obj_type'])
+        py_class = class_registry.get_class(payload['obj_type'])
         obj = py_class.new_from_dict(payload)
         all_objects[obj.id] = obj
 
@@ -146,40 +345,130 @@ def ObjectImplementsOneOf(model_object, obj_types):
         :param model_obj: python object
         :param obj_types: list of fully qualified object names.
     '''
-    if model_object.__class__.__name__ in FQNamesToDict(obj_types):
+    if (model_object.__class__.__name__ in
+            class_registry.class_names(obj_types)):
         return True
 
     return False
 
 
+# attribute values that can never be, or contain, a Gnome object
+_leaf_types = (MethodType, FunctionType, BuiltinFunctionType,
+               int, float, str, unicode, NoneType,
+               Logger, BBox)
+
+_container_types = (list, tuple, OrderedCollection, SpillContainerPair)
+
+# the attribute plan of each class we have registered objects of
+_attribute_plans = {}
+
+
+def AttributePlan(py_class):
+    '''
+        The names of the class attributes that can hold the child objects
+        of an instance of a class, worked out once per class.
+
+        These are the public names dir() finds on the class, minus its
+        methods and constants.  What is left are mostly properties, which
+        we need to look up on each instance.  Attributes set on the
+        instance itself are in its __dict__, and are added by
+        ChildObjects(), so together we see the same attributes that dir()
+        would have shown us for the instance.
+    '''
+    try:
+        return _attribute_plans[py_class]
+    except KeyError:
+        pass
+
+    names = []
+    for k in dir(py_class):
+        if k.startswith('_'):
+            continue
+
+        try:
+            attr = getattr(py_class, k)
+        except AttributeError:
+            # a descriptor that only works on instances
+            names.append(k)
+            continue
+
+        if not isinstance(attr, _leaf_types):
+            names.append(k)
+
+    plan = frozenset(names)
+    _attribute_plans[py_class] = plan
+
+    return plan
+
+
+def ChildObjects(obj):
+    '''
+        The objects directly contained in an object, that might be,
+        or contain, Gnome objects.
+    '''
+    if isinstance(obj, _container_types):
+        return list(obj)
+    elif not hasattr(obj, '__dict__'):
+        return []
+
+    class_names = AttributePlan(obj.__class__)
+    attr_names = [k for k in obj.__dict__
+                  if not (k.startswith('_') or k in class_names)]
+    attr_names.extend(class_names)
+
+    children = []
+    for k in attr_names:
+        try:
+            attr = getattr(obj, k)
+        except AttributeError:
+            continue
+
+        if not isinstance(attr, _leaf_types):
+            children.append(attr)
+
+    return children
+
+
 def RegisterObject(obj, request):
     '''
-        Recursively register an object plus all contained child objects.
+        Register an object plus all contained child objects.
         Registering means we put the object somewhere it can be looked up
         in the Web API.
         We would mainly like to register PyGnome objects.  Others
         we probably don't care about.
+
+        Objects that are shared, or that refer back to their parents,
+        are only visited once.
+
+        Returns the number of objects registered.
     '''
-    if (hasattr(obj, 'id') and
-            not obj.__class__.__name__ == 'type'):
-        # print 'RegisterObject(): registering:', (obj.__class__.__name__,
-        #                                           obj.id)
-        set_session_object(obj, request)
-    if isinstance(obj, (list, tuple, OrderedCollection,
-                        SpillContainerPair)):
-        for i in obj:
-            RegisterObject(i, request)
-    elif hasattr(obj, '__dict__'):
-        for k in dir(obj):
-            attr = getattr(obj, k)
-            if not (k.find('_') == 0 or
-                    isinstance(attr, (MethodType, FunctionType,
-                                      BuiltinFunctionType,
-                                      int, float, str, unicode, NoneType,
-                                      Logger, BBox)
-                               )):
-                # print 'RegisterObject(): recursing attr:', (k, type(attr))
-                RegisterObject(attr, request)
+    begin = time.time()
+
+    objects = get_session_objects(request)
+    visited = set()
+    registered = 0
+    todo = [obj]
+
+    while todo:
+        o = todo.pop()
+
+        if id(o) in visited:
+            continue
+
+        visited.add(id(o))
+
+        if hasattr(o, 'id') and not isinstance(o, type):
+            objects[o.id] = o
+            registered += 1
+
+        todo.extend(ChildObjects(o))
+
+    log.info('req({0}): RegisterObject(): registered {1} objects '
+             '({2} visited) in {3:.3f}s'
+             .format(id(request), registered, len(visited),
+                     time.time() - begin))
+
+    return registered
 
 
 def obj_id_from_url(request):
@@ -270,15 +559,19 @@ def get_file_path(request, json_request=None):
         resp = urllib2.urlopen(json_request['filename'])
 
         (remote_dir, fname) = os.path.split(json_request['filename'])
-
-        with open(os.path.join(session_dir, fname), 'wb') as fh:
-            while True:
-                data = resp.read(1024 * 1024)
-
-                if len(data) == 0:
-                    break
-                else:
-                    fh.write(data)
+        file_store = request.registry.settings['data_file_store']
+
+        if file_store is not None:
+            file_store.add_stream(resp, os.path.join(session_dir, fname))
+        else:
+            with open(os.path.join(session_dir, fname), 'wb') as fh:
+                while True:
+                    data = resp.read(1024 * 1024)
+
+                    if len(data) == 0:
+                        break
+                    else:
+                        fh.write(data)
 
         json_request['filename'] = fname
 
@@ -0,0 +1,131 @@
+"""
+A content-addressed store for the data files of all sessions.
+
+The same data file (a large netCDF current, say) is often uploaded by
+several sessions.  Each file is stored once, under the hash of its
+contents, and the session folders get hard links to the stored copy,
+so everything that expects the file in the session folder keeps working.
+
+A hard link shares its contents with the stored copy and with every other
+session's link, so the data files must never be written to in place.
+The stored copies are made read-only to make sure of that.  Replacing a
+session's file (removing the link and writing a new file) is fine.
+"""
+import os
+import stat
+import errno
+import shutil
+import time
+import hashlib
+import logging
+import tempfile
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+
+class DataFileStore(object):
+    chunk_size = 1024 * 1024
+
+    def __init__(self, store_dir, gc_interval=3600):
+        '''
+            :param store_dir: The folder for our stored files.
+            :param gc_interval: The minimum number of seconds between
+                                two garbage collections.
+        '''
+        self.store_dir = store_dir
+        self.gc_interval = gc_interval
+
+        self._lock = Lock()
+        self._last_gc = time.time()
+
+    def stored_path(self, digest):
+        return os.path.join(self.store_dir, digest)
+
+    def add_stream(self, input_file, link_path):
+        '''
+            Reads a file-like object to its end, and makes its contents
+            available at link_path.
+
+            Returns the hash of the contents.
+        '''
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                while True:
+                    data = input_file.read(self.chunk_size)
+
+                    if len(data) == 0:
+                        break
+
+                    hasher.update(data)
+                    fh.write(data)
+
+            digest = hasher.hexdigest()
+            stored_path = self.stored_path(digest)
+
+            with self._lock:
+                if os.path.exists(stored_path):
+                    log.info('data file store: reusing {0}'.format(digest))
+                else:
+                    os.rename(tmp_path, stored_path)
+                    os.chmod(stored_path,
+                             stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+                self._link(stored_path, link_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return digest
+
+    def _link(self, stored_path, link_path):
+        if os.path.exists(link_path):
+            os.remove(link_path)
+
+        try:
+            os.link(stored_path, link_path)
+        except OSError, e:
+            # the session folders are on a different file system,
+            # or it doesn't do hard links.
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+
+            shutil.copyfile(stored_path, link_path)
+
+    def gc_due(self, now=None):
+        '''
+            Returns True if it is time to collect our garbage.
+            Only one caller per interval gets True.
+        '''
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if now - self._last_gc < self.gc_interval:
+                return False
+
+            self._last_gc = now
+            return True
+
+    def collect_garbage(self):
+        '''
+            Removes the stored files that no session folder links to
+            anymore.  Returns the number of files removed.
+        '''
+        removed = 0
+
+        with self._lock:
+            for f in os.listdir(self.store_dir):
+                path = os.path.join(self.store_dir, f)
+
+                if f.endswith('.tmp') or not os.path.isfile(path):
+                    continue
+
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+                    removed += 1
+
+        return removed
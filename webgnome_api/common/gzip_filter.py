@@ -0,0 +1,37 @@
+"""
+Gzip compression of our responses.
+"""
+from paste.gzipper import middleware
+
+
+def make_gzip_filter(global_conf, compress_level=6, unbuffered_paths=''):
+    '''
+        Paste filter factory for the Paste gzip middleware, with a way
+        around it for our streaming responses.
+
+        The Paste middleware reads the whole response before it sends
+        any of it, so a response that is meant to be read while it is
+        being generated, like the full run stream, would only arrive
+        once the run is done.  Requests for a path that starts with one
+        of the unbuffered_paths go straight to the application.
+
+        :param compress_level: The gzip compression level.
+        :param unbuffered_paths: Whitespace separated path prefixes.
+    '''
+    compress_level = int(compress_level)
+    unbuffered_paths = tuple(unbuffered_paths.split())
+
+    def gzip_filter(app):
+        gzip_app = middleware(app, compress_level=compress_level)
+
+        def filter_app(environ, start_response):
+            path = environ.get('PATH_INFO', '')
+
+            if unbuffered_paths and path.startswith(unbuffered_paths):
+                return app(environ, start_response)
+            else:
+                return gzip_app(environ, start_response)
+
+        return filter_app
+
+    return gzip_filter
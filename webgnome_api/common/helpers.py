@@ -1,6 +1,12 @@
 '''
 Helper functions to be used by views.
 '''
+import logging
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+
 def FQNameToNameAndScope(fully_qualified_name):
     fqn = fully_qualified_name
     return (list(reversed(fqn.rsplit('.', 1)))
@@ -69,8 +75,8 @@ def JSONImplementedType(json_obj, obj_types):
         raise ValueError('JSON object needs to contain an obj_type')
 
     name = FQNameToNameAndScope(json_obj['obj_type'])[0]
-    if name in FQNamesToDict(obj_types):
-        return PyClassFromName(json_obj['obj_type'])
+    if name in class_registry.class_names(obj_types):
+        return class_registry.get_class(json_obj['obj_type'])
 
     return None
 
@@ -79,3 +85,67 @@ def PyClassFromName(fully_qualified_name):
     name, scope = FQNameToNameAndScope(fully_qualified_name)
     my_module = __import__(scope, globals(), locals(), [str(name)], -1)
     return getattr(my_module, name)
+
+
+class ClassRegistry(object):
+    '''
+        Maps the fully qualified names of the classes our views implement
+        to the classes themselves.
+
+        It is filled in from the implemented_types of our views at startup,
+        so that on the request path, the class of an obj_type is a dict
+        lookup instead of an import.  Classes that aren't implemented by
+        any view (the nested objects of a payload, say) are imported the
+        first time they are asked for, and kept.
+    '''
+    def __init__(self):
+        self._lock = Lock()
+        self._classes = {}
+        self._class_names = {}
+
+    def register(self, obj_types):
+        for t in obj_types:
+            try:
+                self.get_class(t)
+            except (ImportError, AttributeError, ValueError):
+                log.warning('class registry: could not import {0}'
+                            .format(t))
+
+        self.class_names(obj_types)
+
+    def get_class(self, obj_type):
+        try:
+            return self._classes[obj_type]
+        except KeyError:
+            pass
+
+        py_class = PyClassFromName(obj_type)
+
+        with self._lock:
+            self._classes[obj_type] = py_class
+
+        return py_class
+
+    def class_names(self, obj_types):
+        '''
+            The set of class names in a list of fully qualified names.
+        '''
+        key = tuple(obj_types)
+
+        try:
+            return self._class_names[key]
+        except KeyError:
+            pass
+
+        names = frozenset([FQNameToNameAndScope(t)[0] for t in obj_types])
+
+        with self._lock:
+            self._class_names[key] = names
+
+        return names
+
+    def obj_types(self):
+        return self._classes.keys()
+
+
+class_registry = ClassRegistry()
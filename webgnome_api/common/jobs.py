@@ -0,0 +1,101 @@
+"""
+Model runs that are performed in the background, outside of any request.
+"""
+import sys
+import time
+import uuid
+import logging
+import traceback
+from threading import Thread, Event
+
+log = logging.getLogger(__name__)
+
+
+class ModelRunJob(object):
+    '''
+        Consumes the step outputs of a model run in a background thread,
+        keeping track of its progress.
+
+        The job keeps only the output of the final step.  It can be
+        cancelled, which takes effect after the current step, since a
+        step that is being computed can't be interrupted.
+    '''
+    def __init__(self, run_steps, num_steps):
+        '''
+            :param run_steps: A generator of step outputs.  It is closed
+                              when the job finishes or is cancelled.
+            :param num_steps: The number of steps the run is expected
+                              to produce.
+        '''
+        self.id = str(uuid.uuid4())
+        self.run_steps = run_steps
+        self.num_steps = num_steps
+
+        self.status = 'pending'
+        self.step = 0
+        self.result = None
+        self.error = None
+
+        self.begin = None
+        self.end = None
+
+        self._cancelled = Event()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_finished(self):
+        return self.status in ('done', 'cancelled', 'failed')
+
+    def elapsed(self):
+        if self.begin is None:
+            return 0.0
+
+        return (self.end or time.time()) - self.begin
+
+    def eta(self):
+        if self.status != 'running' or self.step == 0:
+            return None
+
+        return self.elapsed() / self.step * (self.num_steps - self.step)
+
+    def to_dict(self):
+        return {'id': self.id,
+                'status': self.status,
+                'step': self.step,
+                'num_steps': self.num_steps,
+                'elapsed': self.elapsed(),
+                'eta': self.eta(),
+                'error': self.error}
+
+    def _run(self):
+        self.begin = time.time()
+        self.status = 'running'
+
+        try:
+            for output in self.run_steps:
+                self.result = output
+                self.step += 1
+
+                if self._cancelled.is_set():
+                    self.status = 'cancelled'
+                    break
+            else:
+                self.status = 'done'
+        except Exception:
+            log.exception('model run job {0} failed'.format(self.id))
+            fmt = traceback.format_exception(*sys.exc_info())
+
+            self.error = [l.strip() for l in fmt][-2:]
+            self.status = 'failed'
+        finally:
+            self.run_steps.close()
+            self.end = time.time()
@@ -0,0 +1,200 @@
+"""
+A process-wide cache of the models loaded from our location files.
+
+Loading a location model parses all of its data files (grids, tides,
+the map), and the result is the same for every session.  So we load
+each location once, keep that model as a template that nobody touches,
+and hand each session its own deep copy.
+"""
+import os
+import copy
+import time
+import logging
+import traceback
+import cPickle as pickle
+from threading import Lock
+from multiprocessing import Pool
+
+from .location_snapshot import load_location
+
+log = logging.getLogger(__name__)
+
+
+def latest_mtime(path):
+    '''
+        The latest modification time of a folder tree, so we can tell
+        when any of the location's files have changed.
+    '''
+    mtime = os.path.getmtime(path)
+
+    for dir_path, dir_names, file_names in os.walk(path):
+        for n in dir_names + file_names:
+            mtime = max(mtime, os.path.getmtime(os.path.join(dir_path, n)))
+
+    return mtime
+
+
+def _warm_up_load(args):
+    '''
+        Loads a location model in a warm-up worker process, and sends it
+        back pickled.  Models that can't be pickled are only timed, and
+        need to be loaded again by the web process.
+    '''
+    load_model, location_file = args
+    begin = time.time()
+
+    try:
+        model = load_model(location_file)
+    except Exception:
+        return (location_file, time.time() - begin, None,
+                traceback.format_exc())
+
+    load_time = time.time() - begin
+
+    try:
+        data = pickle.dumps(model, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        data = None
+
+    return (location_file, load_time, data, None)
+
+
+class LocationModelCache(object):
+    '''
+        Keeps the template model of each location, keyed by the path of
+        its save folder, along with the modification time of the folder
+        when it was loaded.  We look for changes to a location's files at
+        most once every check interval.
+
+        A location whose model can't be copied is not cached; every
+        session loads it from its files.
+    '''
+    def __init__(self, load_model=load_location, check_interval=60):
+        self.load_model = load_model
+        self.check_interval = check_interval
+
+        self._lock = Lock()
+        self._templates = {}
+        self._load_locks = {}
+        self._last_checks = {}
+        self._uncopyable = set()
+
+        self.warm_up_report = None
+
+    def _load_lock(self, location_file):
+        with self._lock:
+            return self._load_locks.setdefault(location_file, Lock())
+
+    def get_template(self, location_file):
+        '''
+            Returns the template model of a location, loading it if we
+            don't have it yet or its files have changed.
+            The template must not be modified.
+        '''
+        # Sessions loading the same location wait for the one that loads
+        # it first, but other locations can load at the same time.
+        with self._load_lock(location_file):
+            now = time.time()
+
+            with self._lock:
+                entry = self._templates.get(location_file, None)
+                last_check = self._last_checks.get(location_file, 0)
+
+            if entry is None or now - last_check >= self.check_interval:
+                mtime = latest_mtime(location_file)
+
+                if entry is None or entry[0] != mtime:
+                    log.info('location cache: loading {0}'
+                             .format(location_file))
+                    entry = (mtime, self.load_model(location_file))
+
+                with self._lock:
+                    self._templates[location_file] = entry
+                    self._last_checks[location_file] = now
+
+        return entry[1]
+
+    def add_template(self, location_file, model, mtime):
+        with self._lock:
+            self._templates[location_file] = (mtime, model)
+            self._last_checks[location_file] = time.time()
+
+    def warm_up(self, location_files, num_processes=None, fork_lock=None):
+        '''
+            Loads the models of a number of locations in a pool of worker
+            processes, and adds them to the cache.
+
+            :param fork_lock: A lock to hold while forking the pool.
+
+            Returns a dict with the load time in seconds, or the error,
+            of each location.  It is also kept as our warm_up_report.
+        '''
+        mtimes = dict([(f, latest_mtime(f)) for f in location_files])
+        jobs = [(self.load_model, f) for f in location_files]
+        report = {}
+
+        if fork_lock is not None:
+            with fork_lock:
+                pool = Pool(num_processes)
+        else:
+            pool = Pool(num_processes)
+
+        try:
+            for result in pool.imap_unordered(_warm_up_load, jobs):
+                location_file, load_time, data, error = result
+
+                report[location_file] = {'load_time': load_time,
+                                         'error': error}
+
+                if error is not None:
+                    log.error('location cache: warm up of {0} failed:\n{1}'
+                              .format(location_file, error))
+                    continue
+
+                if data is not None:
+                    model = pickle.loads(data)
+                else:
+                    model = self.load_model(location_file)
+
+                self.add_template(location_file, model,
+                                  mtimes[location_file])
+
+                log.info('location cache: warmed up {0} in {1:.2f}s'
+                         .format(location_file, load_time))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.warm_up_report = report
+
+        return report
+
+    def get_model(self, location_file):
+        '''
+            Returns a new copy of a location's model for a session.
+        '''
+        with self._lock:
+            uncopyable = location_file in self._uncopyable
+
+        if uncopyable:
+            return self.load_model(location_file)
+
+        template = self.get_template(location_file)
+
+        try:
+            return copy.deepcopy(template)
+        except Exception:
+            log.exception('location cache: could not copy {0}, '
+                          'not caching it anymore'.format(location_file))
+
+            with self._lock:
+                self._uncopyable.add(location_file)
+                self._templates.pop(location_file, None)
+
+            return self.load_model(location_file)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._last_checks.clear()
+            self._uncopyable.clear()
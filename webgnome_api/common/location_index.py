@@ -0,0 +1,145 @@
+"""
+An index of our location files, so that the location views don't need to
+read them on every request.
+"""
+import os
+import zlib
+import time
+import hashlib
+import logging
+from threading import Lock
+
+import ujson
+import slugify
+from geojson import FeatureCollection, Feature, Point
+
+log = logging.getLogger(__name__)
+
+
+class LocationCatalog(object):
+    '''
+        The FeatureCollection of all locations, serialized and gzipped
+        once, along with the entity tag of its contents.
+    '''
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+
+        # wbits of 16 + 15 makes zlib write a gzip stream
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.gzip_body = compressor.compress(body) + compressor.flush()
+        self.gzip_etag = self.etag + '-gzip'
+
+
+def make_catalog(features):
+    return LocationCatalog(ujson.dumps(features))
+
+
+class LocationIndex(object):
+    '''
+        Maps the slug of each location to its compiled metadata and the
+        path of its save folder, and keeps the FeatureCollection of all
+        locations ready to be served.
+
+        Every location is a folder right below the locations folder, with
+        a compiled.json file and a <folder name>_save folder.  The index
+        is rebuilt if any compiled.json file, or the set of location
+        folders, has changed.  We look for changes at most once every
+        check interval.
+    '''
+    def __init__(self, locations_dir, check_interval=60):
+        self.locations_dir = locations_dir
+        self.check_interval = check_interval
+
+        self._lock = Lock()
+        self._signature = None
+        self._last_check = 0
+
+        self.locations = {}
+        self.features = FeatureCollection([])
+        self.catalog = None
+
+        self.refresh()
+
+    def compiled_files(self):
+        for d in sorted(os.listdir(self.locations_dir)):
+            compiled_file = os.path.join(self.locations_dir, d,
+                                         'compiled.json')
+
+            if os.path.isfile(compiled_file):
+                yield d, compiled_file
+
+    def signature(self):
+        return tuple([(compiled_file, os.path.getmtime(compiled_file))
+                      for _d, compiled_file in self.compiled_files()])
+
+    def refresh(self, force=False):
+        '''
+            Rebuilds the index if the location files have changed.
+        '''
+        with self._lock:
+            now = time.time()
+
+            if not force and now - self._last_check < self.check_interval:
+                return
+
+            self._last_check = now
+            signature = self.signature()
+
+            if not force and signature == self._signature:
+                return
+
+            locations = {}
+            features = []
+
+            for d, compiled_file in self.compiled_files():
+                with open(compiled_file, 'r') as fh:
+                    content = ujson.load(fh)
+
+                slug = slugify.slugify_url(content['name'])
+                save_dir = os.path.join(self.locations_dir, d, d + '_save')
+
+                if slug in locations:
+                    log.warning('location {0}: slug {1} is already taken'
+                                .format(d, slug))
+                    continue
+
+                locations[slug] = (content, save_dir)
+                features.append(
+                    Feature(geometry=Point(content['geometry']
+                                           ['coordinates']),
+                            properties={'title': content['name'],
+                                        'slug': slug,
+                                        'content': content['steps']
+                                        }
+                            )
+                )
+
+            self.locations = locations
+            self.features = FeatureCollection(features)
+            self.catalog = make_catalog(self.features)
+            self._signature = signature
+
+            log.info('location index: {0} locations'.format(len(locations)))
+
+    def get(self, slug):
+        '''
+            Returns the (metadata, save folder) of a location,
+            or None if we don't have it.
+        '''
+        self.refresh()
+
+        return self.locations.get(slug, None)
+
+    def feature_collection(self):
+        self.refresh()
+
+        return self.features
+
+    def get_catalog(self):
+        '''
+            Returns the serialized FeatureCollection of all locations.
+        '''
+        self.refresh()
+
+        return self.catalog
@@ -0,0 +1,154 @@
+"""
+Binary snapshots of our location models.
+
+Loading a location's save folder with py_gnome parses its JSON files and
+all of its data files (grids, tides, maps).  A snapshot is the model as
+loaded, pickled into a single file next to the save folder, so that
+loading it only takes unpickling the already parsed objects.
+
+A snapshot starts with a header describing the save folder it was made
+from: its path, the size and modification time of each of its files, and
+the hash of their contents.  If the save folder has changed since, the
+snapshot is stale and we load the save folder instead.
+
+The pickled model refers to its data files by their absolute paths, so
+a snapshot is only good for the save folder at the path it was made
+from.  It does not survive a move or a fresh checkout somewhere else.
+"""
+import os
+import hashlib
+import logging
+import cPickle as pickle
+
+from gnome.persist import load
+
+log = logging.getLogger(__name__)
+
+snapshot_version = 2
+
+
+def snapshot_file(save_dir):
+    return save_dir.rstrip(os.path.sep) + '.snapshot'
+
+
+def save_dir_files(save_dir):
+    '''
+        The relative path, size and modification time of all the files in
+        a save folder.  Much cheaper to get than save_dir_hash().
+    '''
+    files = []
+
+    for dir_path, dir_names, file_names in os.walk(save_dir):
+        dir_names.sort()
+
+        for f in sorted(file_names):
+            path = os.path.join(dir_path, f)
+            st = os.stat(path)
+
+            files.append((os.path.relpath(path, save_dir),
+                          st.st_size, st.st_mtime))
+
+    return files
+
+
+def save_dir_hash(save_dir):
+    '''
+        The hash of the names and contents of all the files in a save
+        folder.  We only need it when the file times have changed, like
+        after a checkout, to find out whether the contents have too.
+    '''
+    hasher = hashlib.sha1()
+
+    for dir_path, dir_names, file_names in os.walk(save_dir):
+        dir_names.sort()
+
+        for f in sorted(file_names):
+            path = os.path.join(dir_path, f)
+            hasher.update(os.path.relpath(path, save_dir))
+
+            with open(path, 'rb') as fh:
+                while True:
+                    data = fh.read(1024 * 1024)
+
+                    if len(data) == 0:
+                        break
+
+                    hasher.update(data)
+
+    return hasher.hexdigest()
+
+
+def write_snapshot(save_dir, load_model=load):
+    '''
+        Loads a location's save folder and writes its snapshot.
+        Returns the path of the snapshot.
+    '''
+    header = {'version': snapshot_version,
+              'save_dir': os.path.abspath(save_dir),
+              'source_files': save_dir_files(save_dir),
+              'source_hash': save_dir_hash(save_dir)}
+    model = load_model(save_dir)
+
+    path = snapshot_file(save_dir)
+    tmp_path = path + '.tmp'
+
+    try:
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(header, fh, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(model, fh, pickle.HIGHEST_PROTOCOL)
+
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return path
+
+
+def load_snapshot(save_dir):
+    '''
+        Returns the model from a location's snapshot, or None if there is
+        no usable snapshot.
+    '''
+    path = snapshot_file(save_dir)
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as fh:
+            header = pickle.load(fh)
+
+            if not snapshot_is_current(header, save_dir):
+                log.info('location snapshot {0} is stale'.format(path))
+                return None
+
+            return pickle.load(fh)
+    except Exception:
+        log.exception('could not load location snapshot {0}'.format(path))
+        return None
+
+
+def snapshot_is_current(header, save_dir):
+    if (header.get('version') != snapshot_version or
+            header.get('save_dir') != os.path.abspath(save_dir)):
+        return False
+
+    if header.get('source_files') == save_dir_files(save_dir):
+        return True
+
+    # the files have been touched, but may still be the same
+    return header.get('source_hash') == save_dir_hash(save_dir)
+
+
+def load_location(save_dir):
+    '''
+        Loads a location's model, from its snapshot if it has a current
+        one, or else from its save folder.
+    '''
+    model = load_snapshot(save_dir)
+
+    if model is None:
+        model = load(save_dir)
+
+    return model
@@ -0,0 +1,172 @@
+"""
+Lock management for py_gnome work done on behalf of our sessions.
+"""
+from itertools import count
+from contextlib import contextmanager
+from thread import get_ident
+from threading import Lock, Condition
+
+# lock versions are unique across all locks, so a version seen on a
+# dropped lock never comes back on its replacement.
+_versions = count(1)
+
+
+class ReadWriteLock(object):
+    '''
+        A lock with an exclusive and a shared mode.
+
+        The exclusive mode is used by anything that changes the state of
+        the session's model (stepping, rewinding, creating or updating
+        objects, loading a model).  It has the same interface as a
+        threading.RLock, and like an RLock it is re-entrant for the thread
+        that holds it.
+
+        The shared mode is for read-only work like serializing objects.
+        Any number of threads can hold the lock in shared mode at the same
+        time.  A thread waiting for the exclusive mode blocks any new
+        shared holders, so a steady stream of reads can not starve a model
+        step.
+
+        The lock also carries a version of the state it protects.  Whoever
+        changes that state in a way the session's clients can see calls
+        changed() while holding the exclusive mode.  Work that takes the
+        exclusive mode without changing anything, like stepping ahead of
+        the client or probing an idle session, leaves the version alone.
+    '''
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+
+        self.version = next(_versions)
+
+    def acquire(self, blocking=True):
+        me = get_ident()
+
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return True
+
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    if not blocking:
+                        return False
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+
+            self._writer = me
+            self._writer_depth = 1
+
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._writer != get_ident():
+                raise RuntimeError('cannot release un-acquired lock')
+
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    def acquire_shared(self, blocking=True):
+        me = get_ident()
+
+        with self._cond:
+            if self._writer == me:
+                # we already have exclusive access
+                self._writer_depth += 1
+                return True
+
+            if me in self._readers:
+                # A waiting writer can't get the lock before we release
+                # the share we already hold, so we must not wait for it.
+                self._readers[me] += 1
+                return True
+
+            while self._writer is not None or self._writers_waiting > 0:
+                if not blocking:
+                    return False
+                self._cond.wait()
+
+            self._readers[me] = 1
+
+            return True
+
+    def release_shared(self):
+        me = get_ident()
+
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth -= 1
+                return
+
+            if me not in self._readers:
+                raise RuntimeError('cannot release un-acquired lock')
+
+            self._readers[me] -= 1
+            if self._readers[me] == 0:
+                del self._readers[me]
+
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def changed(self):
+        '''
+            Gives the protected state a new version.  This should only be
+            called while holding the lock exclusively.
+        '''
+        self.version = next(_versions)
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield self
+        finally:
+            self.release_shared()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class SessionLockManager(object):
+    '''
+        Hands out one execution lock per session id.
+
+        Each session owns its own model and object pool, so there is no
+        need for one session's model run to wait on another's.  We only
+        serialize py_gnome operations that belong to the same session.
+    '''
+    def __init__(self):
+        self._guard = Lock()
+        self._locks = {}
+
+    def get_lock(self, session_id):
+        with self._guard:
+            if session_id not in self._locks:
+                self._locks[session_id] = ReadWriteLock()
+
+            return self._locks[session_id]
+
+    def drop_lock(self, session_id, lock=None):
+        '''
+            Forgets the lock of a session.  If a lock is given, the
+            session's lock is only dropped if it is still that one.
+        '''
+        with self._guard:
+            if lock is None or self._locks.get(session_id) is lock:
+                self._locks.pop(session_id, None)
+
+    def session_ids(self):
+        with self._guard:
+            return self._locks.keys()
@@ -0,0 +1,110 @@
+"""
+Estimation of the memory used on behalf of our sessions.
+"""
+import os
+import sys
+from logging import Logger
+from types import ModuleType, FunctionType, MethodType, BuiltinFunctionType
+
+import numpy as np
+
+_skipped_types = (type, ModuleType, FunctionType, MethodType,
+                  BuiltinFunctionType, Logger)
+
+
+def estimate_size(obj, seen=None):
+    '''
+        Estimates the number of bytes used by an object, plus everything
+        it refers to through its attributes and items.
+
+        Numpy arrays are counted with their data buffers, which is where
+        the bulk of a model's memory is (particle arrays, grids).
+        Extension types only report their own size, so for those this is
+        a lower bound.
+
+        :param seen: A set of the ids of the objects already counted.
+                     Passing the same set to several calls counts any
+                     shared objects only once.
+    '''
+    if seen is None:
+        seen = set()
+
+    size = 0
+    stack = [obj]
+
+    while stack:
+        o = stack.pop()
+
+        if id(o) in seen or isinstance(o, _skipped_types):
+            continue
+
+        seen.add(id(o))
+
+        if isinstance(o, np.ndarray):
+            if o.base is None:
+                size += o.nbytes
+            else:
+                size += sys.getsizeof(o, 0)
+                stack.append(o.base)
+
+            if o.dtype.hasobject:
+                stack.extend(o.flat)
+
+            continue
+
+        size += sys.getsizeof(o, 0)
+
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+
+        if hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+
+        slots = getattr(type(o), '__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+
+        for slot in slots:
+            if hasattr(o, slot):
+                stack.append(getattr(o, slot))
+
+    return size
+
+
+def dir_size(path):
+    '''
+        The total size in bytes of the files in a folder tree.
+    '''
+    size = 0
+
+    for dir_path, _dir_names, file_names in os.walk(path):
+        for f in file_names:
+            try:
+                size += os.path.getsize(os.path.join(dir_path, f))
+            except OSError:
+                # removed while we were looking
+                pass
+
+    return size
+
+
+def process_rss(pid=None):
+    '''
+        The resident memory in bytes of a process, or None if we can not
+        find out on this platform.
+    '''
+    if pid is None:
+        pid = os.getpid()
+
+    try:
+        with open('/proc/{0}/status'.format(pid)) as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+
+    return None
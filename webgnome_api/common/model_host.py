@@ -0,0 +1,153 @@
+"""
+Out-of-process hosting of a session's model run.
+
+Similar in spirit to the py_gnome ModelBroadcaster, we fork a worker process
+that inherits a copy of the session's model, and then drive that copy
+with commands sent over a pipe.  This lets the model runs of different
+sessions use different cores, and a crash in a long model run takes down
+only the worker, not the web process.
+"""
+import traceback
+import logging
+from threading import RLock
+from multiprocessing import Process, Pipe
+
+log = logging.getLogger(__name__)
+
+
+class ModelHostError(Exception):
+    pass
+
+
+class ModelHostConsumer(object):
+    '''
+        The worker side of a ModelHost.  Each command sent to the host
+        is dispatched to the method of the same name with an underscore
+        prefix.
+    '''
+    def __init__(self, conn, model):
+        self.conn = conn
+        self.model = model
+
+    def run(self):
+        while True:
+            try:
+                command, args = self.conn.recv()
+            except (EOFError, IOError):
+                break
+
+            if command == 'stop':
+                self.conn.send(('ok', None))
+                break
+
+            try:
+                result = getattr(self, '_' + command)(*args)
+                self.conn.send(('ok', result))
+            except StopIteration:
+                self.conn.send(('stop_iteration', None))
+            except Exception:
+                self.conn.send(('error', traceback.format_exc()))
+
+        self.conn.close()
+
+    def _step(self):
+        return self.model.step()
+
+    def _rewind(self):
+        return self.model.rewind()
+
+    def _current_time_step(self):
+        return self.model.current_time_step
+
+
+def _serve_model(conn, model):
+    ModelHostConsumer(conn, model).run()
+
+
+class ModelHost(object):
+    '''
+        Proxy for a copy of a model that lives in a dedicated worker process.
+
+        The host implements the part of the Model interface that our run
+        views need (step(), rewind(), current_time_step and iteration),
+        so that the views can drive either one.
+
+        The worker is forked from the web process, so it inherits the
+        model in the state it is in when the host is created.  Any later
+        changes to the web process copy are not seen by the worker.
+        A host needs to be replaced whenever the model is edited.
+
+        Commands are sent one at a time.  A caller that needs several
+        commands to happen together, like a model step plus the steps of
+        its uncertain models, holds the host's lock around them.
+    '''
+    def __init__(self, model):
+        self.model = model
+        self.lock = RLock()
+
+        self._conn, child_conn = Pipe()
+        self._process = Process(target=_serve_model,
+                                args=(child_conn, model))
+        self._process.daemon = True
+        self._process.start()
+
+        child_conn.close()
+        log.info('model host started: pid {0}'.format(self._process.pid))
+
+    def cmd(self, command, *args):
+        try:
+            with self.lock:
+                self._conn.send((command, args))
+                status, result = self._conn.recv()
+        except (EOFError, IOError):
+            raise ModelHostError('model host process {0} has died'
+                                 .format(self._process.pid))
+
+        if status == 'stop_iteration':
+            raise StopIteration()
+        elif status == 'error':
+            raise ModelHostError(result)
+
+        return result
+
+    def step(self):
+        return self.cmd('step')
+
+    def next(self):
+        return self.step()
+
+    def __iter__(self):
+        return self
+
+    def rewind(self):
+        return self.cmd('rewind')
+
+    @property
+    def current_time_step(self):
+        return self.cmd('current_time_step')
+
+    @property
+    def has_weathering_uncertainty(self):
+        return self.model.has_weathering_uncertainty
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def stop(self):
+        if self._process.is_alive():
+            try:
+                self.cmd('stop')
+            except ModelHostError:
+                pass
+
+            self._process.join(5)
+
+            if self._process.is_alive():
+                self._process.terminate()
+
+        self._conn.close()
+        log.info('model host stopped: pid {0}'.format(self._process.pid))
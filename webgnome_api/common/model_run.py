@@ -0,0 +1,205 @@
+"""
+Common functions for stepping through a model run.
+"""
+import time
+import logging
+
+from gnome.weatherers import Skimmer, Burn, ChemicalDispersion
+
+from .session_management import (get_uncertain_models,
+                                 set_uncertain_models,
+                                 drop_uncertain_models,
+                                 get_session_lock,
+                                 get_model_runner,
+                                 objects_changed,
+                                 drop_model_host,
+                                 drop_step_prefetcher,
+                                 uncertainty_percentiles)
+from .uncertainty import aggregate_weathering_series
+
+log = logging.getLogger(__name__)
+
+
+def get_uncertain_steps(uncertain_models):
+    if uncertain_models:
+        return uncertain_models.cmd('step', {})
+    else:
+        return None
+
+
+def step_model(model_runner, uncertain_models):
+    '''
+        Advances the model run, plus any uncertainty models, by one step
+        and returns the output for the step.
+
+        The output of the uncertainty models is kept with the step until
+        add_weathering_uncertainty() aggregates it, so that the steps we
+        send together can be aggregated together.
+
+        :param model_runner: The model, or the ModelHost running it.
+        :param uncertain_models: The session's ModelBroadcaster, or None.
+    '''
+    begin = time.time()
+    output = model_runner.step()
+
+    begin_uncertain = time.time()
+    steps = get_uncertain_steps(uncertain_models)
+    end = time.time()
+
+    if 'WeatheringOutput' in output:
+        output['_uncertain_steps'] = steps
+
+        output['uncertain_response_time'] = end - begin_uncertain
+        output['total_response_time'] = end - begin
+
+    return output
+
+
+def add_weathering_uncertainty(outputs, percentiles=()):
+    '''
+        Replaces the nominal WeatheringOutput of each step output with one
+        that includes the aggregated output of the uncertainty models.
+        The steps are aggregated as one time series.
+
+        :param outputs: Step outputs from step_model().
+        :param percentiles: Percentiles of the uncertainty ensemble to
+                            add to the WeatheringOutput.
+    '''
+    uncertain = []
+
+    for output in outputs:
+        if 'WeatheringOutput' not in output:
+            continue
+
+        nominal = output['WeatheringOutput']
+        steps = output.pop('_uncertain_steps', None)
+
+        if steps:
+            uncertain.append((output, nominal,
+                              [s['WeatheringOutput'] for s in steps]))
+        else:
+            output['WeatheringOutput'] = {'time_stamp': nominal['time_stamp'],
+                                          'nominal': nominal,
+                                          'low': None,
+                                          'high': None}
+
+    if uncertain:
+        series = aggregate_weathering_series([n for _o, n, _e in uncertain],
+                                             [e for _o, _n, e in uncertain],
+                                             percentiles)
+
+        for (output, _n, _e), full_output in zip(uncertain, series):
+            output['WeatheringOutput'] = full_output
+
+
+class FullRunInterrupted(Exception):
+    pass
+
+
+def disable_response_weatherers(active_model):
+    for w in active_model.weatherers:
+        if isinstance(w, (Skimmer, Burn, ChemicalDispersion)):
+            w.on = False
+
+
+def restore_weatherers(active_model, weatherer_enabled_flags):
+    for a, w in zip(weatherer_enabled_flags, active_model.weatherers):
+        w.on = a
+
+
+def start_full_run(request, active_model):
+    '''
+        Turns off the response weatherers of the active model, rewinds it
+        and establishes the uncertain models for a new run.
+        Returns the runner to step through.
+    '''
+    disable_response_weatherers(active_model)
+
+    active_model.rewind()
+    objects_changed(request)
+
+    # a hosted model needs to pick up our disabled weatherers
+    drop_model_host(request)
+    model_runner = get_model_runner(request)
+
+    if active_model.has_weathering_uncertainty:
+        log.info('Model has weathering uncertainty')
+        set_uncertain_models(request)
+    else:
+        log.info('Model does not have weathering uncertainty')
+        drop_uncertain_models(request)
+
+    return model_runner
+
+
+def end_full_run(request, active_model, weatherer_enabled_flags):
+    restore_weatherers(active_model, weatherer_enabled_flags)
+
+    # the hosted copy still has its response weatherers disabled.
+    drop_model_host(request)
+
+
+def iter_full_run_steps(request, active_model):
+    '''
+        Generates the step outputs of a full run of the active model with
+        its response weatherers turned off.
+
+        The session lock is only held while a step is computed, so that
+        the session's other requests are served between the steps.  The
+        response weatherers are only turned off while we step, so those
+        requests see the model as it is.  A request that changes the
+        session's objects (an edit, a step or a rewind) takes the model
+        away from the run, and we raise FullRunInterrupted.
+
+        A consumer that stops early should close() the generator, so that
+        the copy of the model we ran is dropped.
+    '''
+    log_prefix = 'req({0}): iter_full_run_steps():'.format(id(request))
+
+    session_lock = get_session_lock(request)
+
+    with session_lock:
+        drop_step_prefetcher(request)
+        weatherer_enabled_flags = [w.on for w in active_model.weatherers]
+
+        try:
+            model_runner = start_full_run(request, active_model)
+        finally:
+            restore_weatherers(active_model, weatherer_enabled_flags)
+
+        uncertain_models = get_uncertain_models(request)
+        percentiles = uncertainty_percentiles(request)
+
+        version = session_lock.version
+
+    try:
+        while True:
+            with session_lock:
+                if session_lock.version != version:
+                    log.info('  ' + log_prefix + 'model changed...')
+                    raise FullRunInterrupted('the model was changed '
+                                             'during the run')
+
+                disable_response_weatherers(active_model)
+                try:
+                    output = step_model(model_runner, uncertain_models)
+                except StopIteration:
+                    break
+                finally:
+                    restore_weatherers(active_model,
+                                       weatherer_enabled_flags)
+
+                objects_changed(request)
+                version = session_lock.version
+
+            # every step is sent as soon as it is done, so we can't
+            # wait for more of the series.
+            add_weathering_uncertainty([output], percentiles)
+
+            yield output
+    finally:
+        with session_lock:
+            if session_lock.version == version:
+                # the hosted copy still has its response weatherers
+                # disabled.
+                drop_model_host(request)
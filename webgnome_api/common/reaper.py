@@ -0,0 +1,97 @@
+"""
+Periodic cleanup of what our expired sessions leave behind.
+
+Redis forgets a session when it times out, but we are never told about
+it, so everything we hold for the session (its object pool, its model
+processes, its upload folder) would stay around for the lifetime of
+the server.
+"""
+import logging
+from threading import Thread, Event
+
+log = logging.getLogger(__name__)
+
+
+class SessionReaper(object):
+    '''
+        Runs a cleanup round in a background thread every interval.
+
+        Each round compares the session ids we hold resources for with
+        the ones that are still alive.  A session is only reaped when it
+        has been found dead in two rounds in a row, so that a brand new
+        session whose first request is still in progress is left alone.
+    '''
+    def __init__(self, interval, known_session_ids, live_session_ids,
+                 reap_session, between_rounds=None):
+        '''
+            :param interval: Seconds between two rounds.
+            :param known_session_ids: A callable returning the ids of the
+                                      sessions we hold resources for.
+            :param live_session_ids: A callable taking a list of session
+                                     ids, and returning the ones that are
+                                     still alive, or None if it can not
+                                     tell right now.
+            :param reap_session: A callable that frees the resources of
+                                 a session.  Returns False if the session
+                                 is busy and should be tried again later.
+                                 If it is None, no sessions are reaped,
+                                 and we only run between_rounds.
+            :param between_rounds: An optional callable for any other
+                                   periodic housekeeping.
+        '''
+        self.interval = interval
+        self.known_session_ids = known_session_ids
+        self.live_session_ids = live_session_ids
+        self.reap_session = reap_session
+        self.between_rounds = between_rounds
+
+        self._suspects = set()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def reap(self):
+        '''
+            Runs one cleanup round, and returns the ids of the sessions
+            that were reaped.
+        '''
+        known = set(self.known_session_ids())
+        live = self.live_session_ids(list(known))
+
+        if live is None:
+            return []
+
+        dead = known.difference(live)
+        reaped = []
+
+        for session_id in dead.intersection(self._suspects):
+            if self.reap_session(session_id) is not False:
+                reaped.append(session_id)
+
+        self._suspects = dead.difference(reaped)
+
+        if reaped:
+            log.info('reaped {0} expired sessions'.format(len(reaped)))
+
+        return reaped
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.reap_session is not None:
+                    self.reap()
+
+                if self.between_rounds is not None:
+                    self.between_rounds()
+            except Exception:
+                log.exception('session reaper round failed')
@@ -0,0 +1,269 @@
+"""
+Eviction of the object pools of idle sessions to disk.
+
+Our sessions can outlive their use by a long time, and every one of them
+keeps its models in memory.  The object pool of a session that has not
+been accessed for a while is pickled to a snapshot file and dropped from
+memory, and it is transparently loaded back on the next access.
+"""
+import os
+import time
+import logging
+import cPickle as pickle
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+
+class SessionEvictor(object):
+    '''
+        Keeps track of when each session last accessed its object pool,
+        and moves object pools between memory and their snapshot files.
+
+        Pickling the object pool as a whole keeps the object ids and the
+        references between the objects intact, so the objects are the
+        same to the client after a reload.
+    '''
+    def __init__(self, obj_pool, snapshot_dir, idle_time,
+                 max_resident=0, check_interval=60, session_locks=None):
+        '''
+            :param obj_pool: The dict of object pools, keyed by session id.
+            :param snapshot_dir: The folder for our snapshot files.
+            :param idle_time: Seconds since the last access after which
+                              a session may be evicted.  Zero means never.
+            :param max_resident: The number of object pools to keep in
+                                 memory, evicting the least recently used
+                                 ones first.  Zero means no limit.
+            :param check_interval: The minimum number of seconds between
+                                   two searches for sessions to evict.
+            :param session_locks: The SessionLockManager of our sessions.
+                                  A session is only evicted if we can get
+                                  its lock without waiting.
+        '''
+        self.obj_pool = obj_pool
+        self.snapshot_dir = snapshot_dir
+        self.idle_time = idle_time
+        self.max_resident = max_resident
+        self.check_interval = check_interval
+        self.session_locks = session_locks
+
+        # Guards our bookkeeping only.  The snapshot file I/O of a session
+        # is done holding the session's own pool lock, so that it doesn't
+        # hold up the other sessions.
+        self._lock = Lock()
+        self._pool_locks = {}
+        self._last_access = {}
+        self._num_accesses = {}
+        self._last_check = time.time()
+
+    def snapshot_file(self, session_id):
+        return os.path.join(self.snapshot_dir,
+                            '{0}.pickle'.format(session_id))
+
+    def is_evicted(self, session_id):
+        return os.path.exists(self.snapshot_file(session_id))
+
+    def _pool_lock(self, session_id):
+        with self._lock:
+            return self._pool_locks.setdefault(session_id, Lock())
+
+    def _access(self, session_id):
+        '''
+            Records an access, and returns the session's pool if it is
+            resident.  Must be called holding self._lock.
+        '''
+        self._last_access[session_id] = time.time()
+        self._num_accesses[session_id] = (self._num_accesses.get(session_id,
+                                                                 0) + 1)
+
+        return self.obj_pool.get(session_id, None)
+
+    def get_pool(self, session_id, create=True):
+        '''
+            Records an access to the session's object pool and returns it,
+            loading it back from its snapshot if it was evicted.
+
+            :param create: Whether to start an empty pool for a session
+                           that has none, in memory or on disk.
+
+            Returns a (pool, reloaded) tuple.
+        '''
+        with self._lock:
+            pool = self._access(session_id)
+
+        if pool is not None:
+            return pool, False
+
+        # The session may be in the middle of being evicted, in which
+        # case we wait for its snapshot.
+        with self._pool_lock(session_id):
+            with self._lock:
+                pool = self.obj_pool.get(session_id, None)
+
+            if pool is not None:
+                return pool, False
+
+            snapshot_file = self.snapshot_file(session_id)
+            reloaded = os.path.exists(snapshot_file)
+
+            if reloaded:
+                with open(snapshot_file, 'rb') as fh:
+                    pool = pickle.load(fh)
+            elif create:
+                pool = {}
+            else:
+                return None, False
+
+            with self._lock:
+                self.obj_pool[session_id] = pool
+
+            if reloaded:
+                os.remove(snapshot_file)
+                log.info('session {0}: reloaded object pool'
+                         .format(session_id))
+
+        return pool, reloaded
+
+    def ensure_resident(self, session_id):
+        '''
+            Records an access to the session's object pool, and loads
+            the pool back from its snapshot if it was evicted.
+
+            Returns True if the pool was reloaded.
+        '''
+        return self.get_pool(session_id, create=False)[1]
+
+    def evicted_session_ids(self):
+        return [f[:-len('.pickle')]
+                for f in os.listdir(self.snapshot_dir)
+                if f.endswith('.pickle')]
+
+    def discard_snapshot(self, session_id):
+        with self._pool_lock(session_id):
+            snapshot_file = self.snapshot_file(session_id)
+
+            if os.path.exists(snapshot_file):
+                os.remove(snapshot_file)
+
+    def forget(self, session_id):
+        '''
+            Drops everything we have for the session, in memory
+            and on disk.
+        '''
+        self.discard_snapshot(session_id)
+
+        with self._lock:
+            self._last_access.pop(session_id, None)
+            self._num_accesses.pop(session_id, None)
+            self._pool_locks.pop(session_id, None)
+            self.obj_pool.pop(session_id, None)
+
+    def check_due(self, now=None):
+        '''
+            Returns True if it is time to search for sessions to evict.
+            Only one caller per check interval gets True.
+        '''
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return False
+
+            self._last_check = now
+            return True
+
+    def resident_sessions(self, exclude=()):
+        '''
+            Returns (session_id, last_access) tuples of all the resident
+            sessions, least recently used first.
+        '''
+        with self._lock:
+            return [(s, t)
+                    for t, s in sorted([(self._last_access.get(s, 0), s)
+                                        for s in self.obj_pool
+                                        if s not in exclude])]
+
+    def eviction_candidates(self, now=None, exclude=()):
+        '''
+            Returns (session_id, last_access) tuples of the resident
+            sessions that should be evicted, least recently used first.
+        '''
+        if now is None:
+            now = time.time()
+
+        resident = self.resident_sessions(exclude)
+
+        num_over = 0
+        if self.max_resident > 0:
+            num_over = len(self.obj_pool) - self.max_resident
+
+        return [(s, t) for i, (s, t) in enumerate(resident)
+                if i < num_over or
+                (self.idle_time > 0 and now - t >= self.idle_time)]
+
+    def evict(self, session_id, last_access=None):
+        '''
+            Pickles the session's object pool to its snapshot file and
+            drops it from memory.
+
+            The session is left alone if somebody holds its lock, or if
+            its pool is accessed while we are pickling it.
+
+            :param last_access: If given, the session is only evicted if
+                                it has not been accessed since then.
+
+            Returns True if the session was evicted.  If the object pool
+            can not be pickled it stays in memory.
+        '''
+        session_lock = None
+        if self.session_locks is not None:
+            session_lock = self.session_locks.get_lock(session_id)
+
+            if not session_lock.acquire(blocking=False):
+                return False
+
+        try:
+            with self._pool_lock(session_id):
+                return self._evict(session_id, last_access)
+        finally:
+            if session_lock is not None:
+                session_lock.release()
+
+    def _evict(self, session_id, last_access):
+        with self._lock:
+            pool = self.obj_pool.get(session_id, None)
+
+            if pool is None:
+                return False
+
+            if (last_access is not None and
+                    self._last_access.get(session_id, 0) > last_access):
+                return False
+
+            num_accesses = self._num_accesses.get(session_id, 0)
+
+        snapshot_file = self.snapshot_file(session_id)
+        tmp_file = snapshot_file + '.tmp'
+
+        try:
+            with open(tmp_file, 'wb') as fh:
+                pickle.dump(pool, fh, pickle.HIGHEST_PROTOCOL)
+
+            with self._lock:
+                if self._num_accesses.get(session_id, 0) != num_accesses:
+                    # somebody got hold of the pool while we pickled it.
+                    return False
+
+                os.rename(tmp_file, snapshot_file)
+                del self.obj_pool[session_id]
+        except Exception:
+            log.exception('session {0}: could not evict object pool'
+                          .format(session_id))
+            return False
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        log.info('session {0}: evicted object pool'.format(session_id))
+        return True
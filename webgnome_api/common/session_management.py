@@ -1,22 +1,59 @@
 """
 Common Gnome object request handlers.
 """
+import os
+import shutil
+import logging
+
+import ujson
+
+from pyramid.settings import asbool
+
+from gnome.model import Model
 from gnome.multi_model_broadcast import ModelBroadcaster
 
+from .model_host import ModelHost, ModelHostError
+from .memory import estimate_size, dir_size, process_rss
+from .step_prefetch import StepPrefetcher
+
+log = logging.getLogger(__name__)
+
 
 def init_session_objects(request, force=False):
-    session = request.session
-    obj_pool = request.registry.settings['objects']
+    '''
+        Makes sure the session has an object pool, loading it back from
+        its snapshot if it was evicted.
 
-    if (session.session_id not in obj_pool) or force:
-        obj_pool[session.session_id] = {}
+        :param force: Start the session over with an empty pool.
+    '''
+    session_id = request.session.session_id
+    settings = request.registry.settings
+    obj_pool = settings['objects']
+    evictor = settings['session_evictor']
+
+    if force:
+        if evictor is not None:
+            evictor.discard_snapshot(session_id)
+
+        obj_pool[session_id] = {}
+
+    return get_session_objects(request)
 
 
 def get_session_objects(request):
-    init_session_objects(request)
-    obj_pool = request.registry.settings['objects']
+    '''
+        Returns the session's object pool.  A pool that has been evicted
+        is loaded back from its snapshot, even if the eviction happens
+        while we are looking for the pool.
+    '''
+    session_id = request.session.session_id
+    settings = request.registry.settings
+    evictor = settings['session_evictor']
+
+    if evictor is not None:
+        return evictor.get_pool(session_id)[0]
 
-    return obj_pool[request.session.session_id]
+    return settings['objects'].setdefault(session_id, {})
 
 
 def get_session_object(obj_id, request):
@@ -33,6 +70,60 @@ def set_session_object(obj, request):
         objects[id(obj)] = obj
 
 
+def get_serialized_object(request, obj):
+    '''
+        Returns the version of the session's objects, and the JSON of one
+        of them.  We keep the JSON of the objects we serialize, and only
+        serialize an object again once the version has changed, i.e. once
+        objects_changed() has been called for the session.
+
+        A serialized object includes the objects it contains, so any change
+        in the session makes all of its JSON stale.
+
+        This should only be called while holding the session lock.
+    '''
+    serialized_objects = request.registry.settings['serialized_objects']
+    session_id = request.session.session_id
+    version = get_session_lock(request).version
+
+    serialized = serialized_objects.get(session_id, None)
+    if serialized is None or serialized[0] != version:
+        serialized = (version, {})
+        serialized_objects[session_id] = serialized
+
+    try:
+        json_body = serialized[1][obj.id]
+    except KeyError:
+        json_body = ujson.dumps(obj.serialize())
+        serialized[1][obj.id] = json_body
+
+    return version, json_body
+
+
+def get_session_lock(request):
+    '''
+        Returns the lock that serializes py_gnome work for the session
+        making the request.  Requests from other sessions are not affected.
+
+        Anything that changes the session's model acquires the lock
+        exclusively.  Read-only work like serialization should use the
+        shared mode, so that it does not queue up behind other reads.
+    '''
+    session_locks = request.registry.settings['session_locks']
+
+    return session_locks.get_lock(request.session.session_id)
+
+
+def objects_changed(request):
+    '''
+        To be called, while holding the session lock exclusively, whenever
+        the session's objects have been created, edited or stepped.  This
+        gives them a new version, so that their cached JSON and the ETags
+        we have sent for them are no longer current.
+    '''
+    get_session_lock(request).changed()
+
+
 def set_active_model(request, obj_id):
     session = request.session
 
@@ -61,25 +152,620 @@ def get_uncertain_models(request):
         return None
 
 
+def uncertain_models_config(active_model):
+    '''
+        The parts of the model state that a ModelBroadcaster can not be
+        re-synchronized with.  The uncertainty processes each hold a copy
+        of the model that was made when they were spawned.  The full run
+        turns response weatherers on and off in our copy.
+    '''
+    return (active_model.id,
+            tuple([w.on for w in active_model.weatherers]))
+
+
 def set_uncertain_models(request):
+    '''
+        Establishes the uncertain models for a new model run.
+
+        If the session's ModelBroadcaster was spawned from the model in
+        its current configuration, we just rewind it.  Only if the model
+        has changed since then, or one of its processes has died, do we
+        pay for spawning a new one.
+
+        If the uncertainty worker pool is enabled, the ensemble is loaded
+        into the shared pool workers instead of forking a ModelBroadcaster.
+    '''
     session_id = request.session.session_id
     uncertain_models = request.registry.settings['uncertain_models']
+    configs = request.registry.settings['uncertain_model_configs']
 
     active_model = get_active_model(request)
     if active_model:
-        model_broadcaster = ModelBroadcaster(active_model,
-                                             ('down', 'normal', 'up'),
-                                             ('down', 'normal', 'up'),
-                                             'ipc_files')
+        config = uncertain_models_config(active_model)
+
+        if (uncertain_models.get(session_id) is not None and
+                configs.get(session_id) == config):
+            try:
+                uncertain_models[session_id].cmd('rewind', {})
+                return
+            except Exception:
+                log.warning('session {0}: uncertain models failed to '
+                            'rewind, starting new ones'.format(session_id),
+                            exc_info=True)
+
+        drop_uncertain_models(request)
+
+        uncertainty_pool = request.registry.settings['uncertainty_pool']
+
+        if uncertainty_pool is not None:
+            model_broadcaster = uncertainty_pool.start_ensemble(
+                active_model,
+                ('down', 'normal', 'up'),
+                ('down', 'normal', 'up')
+            )
+        else:
+            # Spawning the uncertainty processes forks our web process,
+            # which is process-wide py_gnome state, so only one session
+            # does it at a time.
+            with request.registry.settings['py_gnome_shared_lock']:
+                model_broadcaster = ModelBroadcaster(active_model,
+                                                     ('down', 'normal', 'up'),
+                                                     ('down', 'normal', 'up'),
+                                                     'ipc_files')
 
         uncertain_models[session_id] = model_broadcaster
+        configs[session_id] = config
 
 
 def drop_uncertain_models(request):
     session_id = request.session.session_id
     uncertain_models = request.registry.settings['uncertain_models']
+    configs = request.registry.settings['uncertain_model_configs']
+
+    configs.pop(session_id, None)
 
     if (session_id in uncertain_models and
             uncertain_models[session_id] is not None):
-        uncertain_models[session_id].stop()
-        uncertain_models[session_id] = None
+        try:
+            uncertain_models[session_id].stop()
+        except Exception:
+            # an ensemble that has died may not stop cleanly
+            log.warning('session {0}: uncertain models failed to stop'
+                        .format(session_id), exc_info=True)
+        finally:
+            uncertain_models[session_id] = None
+
+
+def model_hosting_enabled(request):
+    return asbool(request.registry.settings.get('model_host.enabled', False))
+
+
+def get_model_host(request):
+    session_id = request.session.session_id
+    model_hosts = request.registry.settings['model_hosts']
+
+    return model_hosts.get(session_id, None)
+
+
+def set_model_host(request):
+    session_id = request.session.session_id
+    model_hosts = request.registry.settings['model_hosts']
+
+    drop_model_host(request)
+
+    active_model = get_active_model(request)
+    if active_model:
+        # like the uncertainty models, this forks our web process.
+        with request.registry.settings['py_gnome_shared_lock']:
+            model_hosts[session_id] = ModelHost(active_model)
+
+        return model_hosts[session_id]
+
+
+def drop_model_host(request):
+    session_id = request.session.session_id
+    model_hosts = request.registry.settings['model_hosts']
+
+    model_host = model_hosts.pop(session_id, None)
+    if model_host is not None:
+        model_host.stop()
+
+
+def stop_model_host(request):
+    '''
+        Stops the session's model host after a failure, but keeps it as
+        the session's host, so that the run can't go on until the model
+        is rewound or changed.
+    '''
+    model_host = get_model_host(request)
+    if model_host is not None:
+        model_host.stop()
+
+
+def get_model_runner(request):
+    '''
+        Returns the object that our run views should step through.
+        This is either the active model itself, or, if model hosting is
+        enabled, the worker process hosting a copy of the active model.
+
+        A host that has stopped or died is not replaced here.  A new host
+        would be forked from our copy of the model, which never moves
+        past the start of the run, so the run would silently start over.
+        Rewinding, or changing the model, replaces the host.
+    '''
+    active_model = get_active_model(request)
+
+    if active_model is None or not model_hosting_enabled(request):
+        return active_model
+
+    model_host = get_model_host(request)
+    if model_host is None:
+        model_host = set_model_host(request)
+    elif not model_host.is_alive():
+        raise ModelHostError('model host process {0} has stopped, '
+                             'the model needs to be rewound'
+                             .format(model_host.pid))
+
+    return model_host
+
+
+def step_prefetch_depth(request):
+    return int(request.registry.settings.get('step_prefetch.depth', 0))
+
+
+def uncertainty_percentiles(request):
+    settings = request.registry.settings
+
+    return [float(p)
+            for p in settings.get('uncertainty.percentiles', '').split()]
+
+
+def get_step_prefetcher(request):
+    session_id = request.session.session_id
+    prefetchers = request.registry.settings['step_prefetchers']
+
+    return prefetchers.get(session_id, None)
+
+
+def get_step_lock(request, model_runner):
+    '''
+        Returns the lock to hold while stepping the model runner.
+
+        A hosted model doesn't share any objects with the session, so
+        stepping it only needs the host's own lock.  A model in our own
+        process is stepped under the session lock.
+    '''
+    if isinstance(model_runner, ModelHost):
+        return model_runner.lock
+    else:
+        return get_session_lock(request)
+
+
+def set_step_prefetcher(request, model_runner, step_func):
+    session_id = request.session.session_id
+    prefetchers = request.registry.settings['step_prefetchers']
+
+    drop_step_prefetcher(request)
+
+    prefetchers[session_id] = StepPrefetcher(get_step_lock(request,
+                                                           model_runner),
+                                             step_func,
+                                             step_prefetch_depth(request))
+
+    return prefetchers[session_id]
+
+
+def drop_step_prefetcher(request):
+    '''
+        Returns the number of prefetched steps that were discarded.
+    '''
+    session_id = request.session.session_id
+    prefetchers = request.registry.settings['step_prefetchers']
+
+    prefetcher = prefetchers.pop(session_id, None)
+    if prefetcher is not None:
+        return prefetcher.invalidate()
+
+    return 0
+
+
+def get_run_job(request):
+    session_id = request.session.session_id
+    run_jobs = request.registry.settings['run_jobs']
+
+    return run_jobs.get(session_id, None)
+
+
+def set_run_job(request, job):
+    '''
+        A session has at most one run job.  Any previous job is cancelled.
+    '''
+    session_id = request.session.session_id
+    run_jobs = request.registry.settings['run_jobs']
+
+    drop_run_job(request)
+    run_jobs[session_id] = job
+
+
+def drop_run_job(request):
+    session_id = request.session.session_id
+    run_jobs = request.registry.settings['run_jobs']
+
+    job = run_jobs.pop(session_id, None)
+    if job is not None:
+        job.cancel()
+
+
+def model_changed(request):
+    '''
+        To be called whenever the session's model has been edited or
+        replaced.  Anything that holds a copy of the old model state
+        is discarded here.
+
+        Returns True if this has started the session's model run over,
+        which the client can't tell from the model itself.
+    '''
+    objects_changed(request)
+    run_reset = False
+
+    if drop_step_prefetcher(request) > 0:
+        # The model run has gotten ahead of the steps the client has seen,
+        # so the run can not continue where the client thinks it is.
+        active_model = get_active_model(request)
+        if active_model is not None:
+            active_model.rewind()
+            run_reset = True
+
+    model_host = get_model_host(request)
+    if model_host is not None and model_host.is_alive():
+        # the next step forks a new host from our copy of the model,
+        # which is still at the start of the run.
+        try:
+            run_reset = run_reset or model_host.current_time_step > -1
+        except ModelHostError:
+            pass
+
+    drop_model_host(request)
+
+    # The uncertainty processes can keep running with their copy of the
+    # old model, but we can't reuse them for the next run.
+    request.registry.settings['uncertain_model_configs'].pop(
+        request.session.session_id, None
+    )
+
+    return run_reset
+
+
+def release_session_resources(settings, session_id):
+    '''
+        Stops and drops everything that our run views have created for a
+        session, apart from its object pool.  All of it is recreated when
+        the session needs it again.
+    '''
+    prefetcher = settings['step_prefetchers'].pop(session_id, None)
+    if prefetcher is not None:
+        prefetcher.invalidate()
+
+    model_host = settings['model_hosts'].pop(session_id, None)
+    if model_host is not None:
+        model_host.stop()
+
+    settings['uncertain_model_configs'].pop(session_id, None)
+
+    uncertain_models = settings['uncertain_models'].pop(session_id, None)
+    if uncertain_models is not None:
+        uncertain_models.stop()
+
+    job = settings['run_jobs'].pop(session_id, None)
+    if job is not None:
+        job.cancel()
+
+    settings['serialized_objects'].pop(session_id, None)
+    settings['object_sizes'].pop(session_id, None)
+
+
+def evict_sessions(settings, candidates, stop_when=None):
+    '''
+        Moves the object pools of the candidate sessions to disk, in the
+        order given.
+
+        A session that is busy, i.e. somebody holds its lock, or that is
+        in the middle of a model run, is left alone.  Our snapshots don't
+        keep the state of a run, so evicting it would start the run over
+        without the client knowing.  The models of an evicted session are
+        rewound, which keeps the snapshot small.
+
+        :param candidates: (session_id, last_access) tuples.
+        :param stop_when: A callable that returns True when we have
+                          evicted enough sessions.
+    '''
+    evictor = settings['session_evictor']
+    session_locks = settings['session_locks']
+
+    for session_id, last_access in candidates:
+        if stop_when is not None and stop_when():
+            break
+
+        session_lock = session_locks.get_lock(session_id)
+
+        if not session_lock.acquire(blocking=False):
+            continue
+
+        try:
+            if run_in_progress(settings, session_id):
+                continue
+
+            release_session_resources(settings, session_id)
+
+            for obj in settings['objects'].get(session_id, {}).values():
+                if isinstance(obj, Model):
+                    obj.rewind()
+
+            evictor.evict(session_id, last_access)
+        finally:
+            session_lock.release()
+
+
+def run_in_progress(settings, session_id):
+    '''
+        Whether the session has a model run that has been started, and not
+        rewound since.
+
+        This should only be called while holding the session lock.
+    '''
+    job = settings['run_jobs'].get(session_id, None)
+    if job is not None and not job.is_finished():
+        return True
+
+    if settings['step_prefetchers'].get(session_id, None) is not None:
+        return True
+
+    model_host = settings['model_hosts'].get(session_id, None)
+    if model_host is not None and model_host.is_alive():
+        try:
+            if model_host.current_time_step > -1:
+                return True
+        except ModelHostError:
+            # a host that has died has lost its run anyway
+            pass
+
+    return any([obj.current_time_step > -1
+                for obj in settings['objects'].get(session_id, {}).values()
+                if isinstance(obj, Model)])
+
+
+def evict_idle_sessions(settings, exclude=()):
+    '''
+        Moves the object pools of idle sessions to disk.
+    '''
+    evictor = settings['session_evictor']
+
+    evict_sessions(settings, evictor.eviction_candidates(exclude=exclude))
+
+
+def session_data_dir(settings, session_id):
+    return os.path.join(settings['model_data_dir'], 'session', session_id)
+
+
+def session_memory_usage(settings, session_id, with_objects=True):
+    '''
+        Estimates the memory used on behalf of a session, in bytes.
+
+        - objects: the session's object pool, including the particle
+                   and grid arrays of its models, and the JSON we keep
+                   of its objects.
+        - processes: the resident memory of the session's model host.
+        - uploads: the files the session has uploaded.  These are on
+                   disk, but the model loads their data as it needs it.
+
+        The uncertainty models are not included.  Their processes are
+        either forked copies of the model or shared by all sessions.
+
+        :param with_objects: Whether to walk the object pool.  This should
+                             only be done while holding the session lock.
+    '''
+    usage = {'objects': 0,
+             'processes': 0,
+             'uploads': dir_size(session_data_dir(settings, session_id)),
+             'evicted': False}
+
+    objects = settings['objects'].get(session_id, None)
+    if objects is not None:
+        if with_objects:
+            usage['objects'] = object_pool_size(settings, session_id, objects)
+
+            serialized = settings['serialized_objects'].get(session_id, None)
+            if serialized is not None:
+                usage['objects'] += sum([len(j)
+                                         for j in serialized[1].values()])
+    elif settings['session_evictor'] is not None:
+        usage['evicted'] = settings['session_evictor'].is_evicted(session_id)
+
+    model_host = settings['model_hosts'].get(session_id, None)
+    if model_host is not None and model_host.is_alive():
+        usage['processes'] = process_rss(model_host.pid) or 0
+
+    usage['total'] = usage['objects'] + usage['processes']
+
+    return usage
+
+
+def object_pool_size(settings, session_id, objects):
+    '''
+        The estimated size of a session's object pool.  Walking the pool
+        costs as much as the size of the model, so we only do it here for
+        a session that has no estimate yet.  The estimates of the sessions
+        that have changed since are brought up to date in the background,
+        by update_object_sizes().
+    '''
+    object_sizes = settings['object_sizes']
+
+    size = object_sizes.get(session_id, None)
+    if size is None:
+        version = settings['session_locks'].get_lock(session_id).version
+        size = (version, estimate_size(objects))
+        object_sizes[session_id] = size
+
+    return size[1]
+
+
+def update_object_sizes(settings):
+    '''
+        Estimates the size of the object pools that have changed since
+        their last estimate.  A session that somebody is changing at the
+        moment is left for the next time.
+    '''
+    object_sizes = settings['object_sizes']
+    session_locks = settings['session_locks']
+
+    for session_id in settings['objects'].keys():
+        session_lock = session_locks.get_lock(session_id)
+
+        size = object_sizes.get(session_id, None)
+        if size is not None and size[0] == session_lock.version:
+            continue
+
+        if not session_lock.acquire_shared(blocking=False):
+            continue
+
+        try:
+            objects = settings['objects'].get(session_id, None)
+            if objects is not None:
+                object_sizes[session_id] = (session_lock.version,
+                                            estimate_size(objects))
+        finally:
+            session_lock.release_shared()
+
+
+def memory_caps(settings):
+    '''
+        Returns the configured (session_cap, total_cap) in bytes.
+        Zero means no cap.
+    '''
+    return (int(settings.get('memory.session_cap', 0)),
+            int(settings.get('memory.total_cap', 0)))
+
+
+def over_total_memory_cap(settings):
+    total_cap = memory_caps(settings)[1]
+    rss = process_rss()
+
+    return total_cap > 0 and rss is not None and rss > total_cap
+
+
+def make_room_for_session(request, replacing=False):
+    '''
+        Checks the memory caps before a session takes on more work.
+
+        If our process is over the total cap, the least recently used
+        sessions are evicted until it isn't.
+
+        :param replacing: The work replaces the session's objects, so
+                          their current size doesn't count against the
+                          session cap.
+
+        Returns a message saying which cap is exceeded, or None if the
+        session may go ahead.
+    '''
+    settings = request.registry.settings
+    session_id = request.session.session_id
+    session_cap, total_cap = memory_caps(settings)
+
+    if session_cap > 0 and not replacing:
+        with get_session_lock(request).shared():
+            usage = session_memory_usage(settings, session_id)
+
+        if usage['total'] > session_cap:
+            return ('session memory use of {0} bytes exceeds the cap '
+                    'of {1} bytes'.format(usage['total'], session_cap))
+
+    if over_total_memory_cap(settings):
+        evictor = settings['session_evictor']
+
+        if evictor is not None:
+            def under_cap():
+                return not over_total_memory_cap(settings)
+
+            evict_sessions(settings,
+                           evictor.resident_sessions(exclude=(session_id,)),
+                           stop_when=under_cap)
+
+        if over_total_memory_cap(settings):
+            return ('server memory use exceeds the cap of {0} bytes'
+                    .format(total_cap))
+
+    return None
+
+
+def known_session_ids(settings):
+    '''
+        The ids of all the sessions that we hold anything for,
+        in memory or on disk.
+    '''
+    session_ids = set(settings['session_locks'].session_ids())
+
+    for k in ('objects', 'uncertain_models', 'uncertain_model_configs',
+              'model_hosts', 'step_prefetchers', 'run_jobs'):
+        session_ids.update(settings[k].keys())
+
+    if settings['session_evictor'] is not None:
+        session_ids.update(settings['session_evictor'].evicted_session_ids())
+
+    sessions_dir = os.path.join(settings['model_data_dir'], 'session')
+    if os.path.isdir(sessions_dir):
+        session_ids.update(os.listdir(sessions_dir))
+
+    return session_ids
+
+
+def live_session_ids(registry, session_ids):
+    '''
+        Returns the session ids that Redis still has a session for,
+        or None if we don't have a Redis connection yet.
+
+        pyramid_redis_sessions keeps its connection in the registry once
+        it has handled a request.  Until then, nobody can have a session.
+    '''
+    redis = getattr(registry, '_redis_sessions', None)
+    if redis is None:
+        return None
+
+    pipe = redis.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.exists(session_id)
+
+    return [s for s, exists in zip(session_ids, pipe.execute()) if exists]
+
+
+def reap_session(settings, session_id):
+    '''
+        Frees everything that we hold for an expired session.
+        Returns False if the session is busy.
+    '''
+    session_locks = settings['session_locks']
+    session_lock = session_locks.get_lock(session_id)
+
+    if not session_lock.acquire(blocking=False):
+        return False
+
+    try:
+        release_session_resources(settings, session_id)
+
+        settings['objects'].pop(session_id, None)
+
+        if settings['session_evictor'] is not None:
+            settings['session_evictor'].forget(session_id)
+
+        shutil.rmtree(session_data_dir(settings, session_id),
+                      ignore_errors=True)
+
+        # Dropped while we still hold it, so that nobody can acquire it
+        # between our release and the drop, and then hold a lock that
+        # the next request for the session doesn't get.
+        session_locks.drop_lock(session_id, session_lock)
+    finally:
+        session_lock.release()
+
+    log.info('session {0}: reaped'.format(session_id))
+
+    return True
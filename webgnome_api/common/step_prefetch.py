@@ -0,0 +1,144 @@
+"""
+Background precomputation of upcoming model steps.
+"""
+import sys
+import logging
+from collections import deque
+from threading import Thread, Condition
+
+log = logging.getLogger(__name__)
+
+
+class StepPrefetcher(object):
+    '''
+        Keeps computing the next few steps of a session's model run in a
+        background thread, so that a step request can usually be answered
+        with a step that has already been computed.
+
+        All stepping, in the background or not, happens while holding the
+        step lock of the model runner.  Prefetched steps are queued in the
+        order they were computed, and a request only computes a step
+        itself when the queue is empty, so the steps are always handed out
+        in sequence.
+
+        For a model that runs in our own process, the step lock is the
+        session lock, so reads of the session's objects wait for the
+        background step that is in progress.  A hosted model has a lock of
+        its own, and the session's reads are not held up by prefetching.
+
+        The prefetched steps belong to one particular model state.  If the
+        model is edited or rewound, the prefetcher must be invalidated.
+        The background thread checks for that before every step, while
+        holding the step lock, so it never steps a runner that has been
+        invalidated under that lock.
+    '''
+    def __init__(self, step_lock, step_func, depth):
+        '''
+            :param step_lock: The lock that needs to be held while
+                              stepping the model runner.
+            :param step_func: A callable that computes the next step
+                              output, and raises StopIteration at the end
+                              of the run.
+            :param depth: The number of steps to keep computed ahead.
+        '''
+        self.step_lock = step_lock
+        self.step_func = step_func
+        self.depth = depth
+
+        self._results = deque()
+        self._cond = Condition()
+        self._generation = 0
+        self._finished = False
+        self._thread = None
+
+    def next_step(self):
+        '''
+            Returns the next prefetched step output, or None if there
+            isn't one ready.
+            Raises StopIteration (or whatever the step function raised)
+            if the background thread ran into it.
+        '''
+        with self._cond:
+            if not self._results:
+                return None
+
+            kind, value = self._results.popleft()
+
+        if kind == 'stop':
+            raise StopIteration()
+        elif kind == 'error':
+            raise value[0], value[1], value[2]
+
+        return value
+
+    def num_ready(self):
+        with self._cond:
+            return len(self._results)
+
+    def num_steps_ahead(self):
+        '''
+            The number of steps the model run is ahead of the steps
+            that have been handed out.
+        '''
+        with self._cond:
+            return len([k for k, _v in self._results if k == 'output'])
+
+    def fill(self):
+        '''
+            Makes sure the background thread is running if there are fewer
+            than depth steps ready.
+        '''
+        with self._cond:
+            if (self._finished or len(self._results) >= self.depth or
+                    (self._thread is not None and self._thread.is_alive())):
+                return
+
+            self._thread = Thread(target=self._run,
+                                  args=(self._generation,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def invalidate(self):
+        '''
+            Discards the prefetched steps, and stops the background thread
+            before it computes another step.
+
+            Returns the number of computed steps that were never handed out.
+        '''
+        with self._cond:
+            self._generation += 1
+            self._finished = False
+
+            discarded = self.num_steps_ahead()
+            self._results.clear()
+
+        return discarded
+
+    def _is_current(self, generation):
+        return (generation == self._generation and
+                len(self._results) < self.depth)
+
+    def _run(self, generation):
+        while True:
+            with self.step_lock:
+                with self._cond:
+                    if not self._is_current(generation):
+                        break
+
+                try:
+                    result = ('output', self.step_func())
+                except StopIteration:
+                    result = ('stop', None)
+                except Exception:
+                    log.exception('step prefetch failed')
+                    result = ('error', sys.exc_info())
+
+                with self._cond:
+                    if generation != self._generation:
+                        break
+
+                    self._results.append(result)
+
+                    if result[0] != 'output':
+                        self._finished = True
+                        break
@@ -0,0 +1,106 @@
+"""
+Aggregation of the weathering output of our uncertainty model ensemble.
+"""
+import warnings
+from numbers import Number
+
+import numpy as np
+
+
+def _is_numeric(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def aggregate_weathering_output(nominal, ensemble, percentiles=()):
+    '''
+        Aggregates the weathering output of one step.
+
+        :param nominal: The WeatheringOutput of the nominal model.
+        :param ensemble: A list of the WeatheringOutput of each
+                         uncertainty model.
+        :param percentiles: Percentiles (0-100) to compute in addition to
+                            the low, high and mean values.
+    '''
+    return aggregate_weathering_series([nominal], [ensemble], percentiles)[0]
+
+
+def aggregate_weathering_series(nominal_series, ensemble_series,
+                                percentiles=()):
+    '''
+        Aggregates the weathering output of a series of steps.
+
+        The numeric values of all steps and ensemble members are stacked
+        into one (steps, members, keys) array, so the statistics of the
+        whole series are computed with a single pass over each axis.
+        Non-numeric values like the time stamps only get a low and a high.
+
+        Returns a list with the full WeatheringOutput of each step.
+        This contains the nominal output, the aggregated low, high and
+        mean values, the requested percentiles keyed by percentile,
+        and the output of each ensemble member keyed by its index.
+    '''
+    keys = set()
+    for ensemble in ensemble_series:
+        for member in ensemble:
+            keys.update(member)
+
+    numeric_keys = sorted(k for k in keys
+                          if all(_is_numeric(m[k])
+                                 for ensemble in ensemble_series
+                                 for m in ensemble
+                                 if k in m))
+    other_keys = keys.difference(numeric_keys)
+
+    num_members = max([len(e) for e in ensemble_series] + [0])
+    values = np.full((len(ensemble_series), num_members, len(numeric_keys)),
+                     np.nan)
+
+    for i, ensemble in enumerate(ensemble_series):
+        for j, member in enumerate(ensemble):
+            values[i, j] = [member.get(k, np.nan) for k in numeric_keys]
+
+    with warnings.catch_warnings():
+        # keys that no member of a step has are all-NaN slices
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        low = np.nanmin(values, axis=1)
+        high = np.nanmax(values, axis=1)
+        mean = np.nanmean(values, axis=1)
+
+        if percentiles:
+            bands = np.nanpercentile(values, list(percentiles), axis=1)
+
+    series = []
+    for i, (nominal, ensemble) in enumerate(zip(nominal_series,
+                                                ensemble_series)):
+        present = [(n, k) for n, k in enumerate(numeric_keys)
+                   if any(k in m for m in ensemble)]
+
+        def by_key(row):
+            return dict((k, float(row[n])) for n, k in present)
+
+        full_output = {'time_stamp': nominal['time_stamp'],
+                       'nominal': nominal,
+                       'low': by_key(low[i]),
+                       'high': by_key(high[i]),
+                       'mean': by_key(mean[i])}
+
+        for k in other_keys:
+            v = [m[k] for m in ensemble if k in m]
+
+            if v:
+                full_output['low'][k] = min(v)
+                full_output['high'][k] = max(v)
+
+        if percentiles:
+            full_output['percentiles'] = dict(('{0:g}'.format(p),
+                                               by_key(bands[p_idx][i]))
+                                              for p_idx, p
+                                              in enumerate(percentiles))
+
+        for idx, member in enumerate(ensemble):
+            full_output[idx] = member
+
+        series.append(full_output)
+
+    return series
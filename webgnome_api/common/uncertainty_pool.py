@@ -0,0 +1,362 @@
+"""
+A pool of pre-forked worker processes that run the uncertainty models
+of all sessions.
+
+A py_gnome ModelBroadcaster forks a process for every member of a
+session's uncertainty ensemble, so the number of processes grows with
+the number of sessions.  Here a fixed number of workers is forked when
+the web application starts, and the members of each session's ensemble
+are spread over the workers that are least busy when its run starts.
+
+The workers are forked before any model exists, so a model is handed
+to them as a save file, which each member loads for itself.
+"""
+import os
+import uuid
+import logging
+import itertools
+import traceback
+from threading import Thread, Lock, Event
+from multiprocessing import Process, Pipe
+
+from gnome.persist import load
+from gnome.environment import Wind
+from gnome.outputters import WeatheringOutput
+
+log = logging.getLogger(__name__)
+
+
+class UncertaintyPoolError(Exception):
+    pass
+
+
+def load_member_model(save_file, wind_speed_uncertainty,
+                      spill_amount_uncertainty):
+    '''
+        Loads a copy of a model from its save file and applies the
+        uncertainty of one ensemble member, the same way the py_gnome
+        ModelBroadcaster does.  We only need the weathering output of
+        the members, so their other outputters are turned off.
+    '''
+    model = load(save_file)
+
+    for w in model.environment:
+        if isinstance(w, Wind):
+            w.set_speed_uncertainty(wind_speed_uncertainty)
+
+    for s in model.spills:
+        s.set_amount_uncertainty(spill_amount_uncertainty)
+
+    for o in model.outputters:
+        o.on = isinstance(o, WeatheringOutput)
+
+    return model
+
+
+class UncertaintyWorkerConsumer(object):
+    '''
+        The worker side of a pool worker.  It holds the member models
+        of any number of ensembles, keyed by member id.
+    '''
+    def __init__(self, conn, load_member):
+        self.conn = conn
+        self.load_member = load_member
+        self.models = {}
+
+    def run(self):
+        while True:
+            try:
+                req_id, command, args, kwargs = self.conn.recv()
+            except (EOFError, IOError):
+                break
+
+            if command == 'stop':
+                self.conn.send((req_id, 'ok', None))
+                break
+
+            try:
+                result = getattr(self, '_' + command)(*args, **kwargs)
+                self.conn.send((req_id, 'ok', result))
+            except StopIteration:
+                self.conn.send((req_id, 'stop_iteration', None))
+            except Exception:
+                self.conn.send((req_id, 'error', traceback.format_exc()))
+
+        self.conn.close()
+
+    def _load(self, member_id, save_file, wind_speed_uncertainty,
+              spill_amount_uncertainty):
+        self.models[member_id] = self.load_member(save_file,
+                                                  wind_speed_uncertainty,
+                                                  spill_amount_uncertainty)
+
+    def _unload(self, member_id):
+        self.models.pop(member_id, None)
+
+    def _step(self, member_id):
+        return self.models[member_id].step()
+
+    def _rewind(self, member_id):
+        return self.models[member_id].rewind()
+
+
+def _serve_members(conn, load_member):
+    UncertaintyWorkerConsumer(conn, load_member).run()
+
+
+class PendingResult(object):
+    def __init__(self):
+        self._done = Event()
+        self.status = None
+        self.result = None
+
+    def set(self, status, result):
+        self.status = status
+        self.result = result
+        self._done.set()
+
+    def get(self):
+        self._done.wait()
+
+        if self.status == 'stop_iteration':
+            raise StopIteration()
+        elif self.status == 'error':
+            raise UncertaintyPoolError(self.result)
+
+        return self.result
+
+
+class PoolWorker(object):
+    '''
+        Proxy for one worker process of the pool.
+
+        Any thread can submit a command to the worker.  The commands are
+        pipelined; the worker executes them in the order they were sent,
+        and a reader thread hands each reply to whoever is waiting on it.
+    '''
+    def __init__(self, load_member):
+        self.member_ids = set()
+
+        self._conn, child_conn = Pipe()
+        self._process = Process(target=_serve_members,
+                                args=(child_conn, load_member))
+        self._process.daemon = True
+        self._process.start()
+
+        child_conn.close()
+
+        self._send_lock = Lock()
+        self._req_ids = itertools.count()
+        self._pending = {}
+        self._dead = False
+
+        self._reader = Thread(target=self._read_replies)
+        self._reader.daemon = True
+        self._reader.start()
+
+        log.info('uncertainty worker started: pid {0}'
+                 .format(self._process.pid))
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    def submit(self, command, *args, **kwargs):
+        pending = PendingResult()
+
+        with self._send_lock:
+            if self._dead:
+                pending.set('error', 'uncertainty worker {0} has died'
+                            .format(self.pid))
+                return pending
+
+            req_id = next(self._req_ids)
+            self._pending[req_id] = pending
+
+            try:
+                self._conn.send((req_id, command, args, kwargs))
+            except (EOFError, IOError):
+                self._pending.pop(req_id, None)
+                pending.set('error', 'uncertainty worker {0} has died'
+                            .format(self.pid))
+
+        return pending
+
+    def _read_replies(self):
+        while True:
+            try:
+                req_id, status, result = self._conn.recv()
+            except (EOFError, IOError):
+                break
+
+            with self._send_lock:
+                pending = self._pending.pop(req_id, None)
+
+            if pending is not None:
+                pending.set(status, result)
+
+        with self._send_lock:
+            self._dead = True
+            abandoned, self._pending = self._pending.values(), {}
+
+        for pending in abandoned:
+            pending.set('error', 'uncertainty worker {0} has died'
+                        .format(self.pid))
+
+    def is_alive(self):
+        return not self._dead and self._process.is_alive()
+
+    def stop(self):
+        if self._process.is_alive():
+            try:
+                self.submit('stop').get()
+            except UncertaintyPoolError:
+                pass
+
+            self._process.join(5)
+
+            if self._process.is_alive():
+                self._process.terminate()
+
+        self._reader.join(5)
+        self._conn.close()
+        log.info('uncertainty worker stopped: pid {0}'.format(self.pid))
+
+
+class PooledEnsemble(object):
+    '''
+        A session's uncertainty ensemble, with its members hosted by the
+        workers of the pool.
+
+        It supports the part of the ModelBroadcaster interface that we
+        use, so that the run views can drive either one.
+    '''
+    def __init__(self, pool, members):
+        '''
+            :param pool: The UncertaintyWorkerPool hosting our members.
+            :param members: A list of (member_id, PoolWorker) tuples
+                            in the order of the uncertainty values.
+        '''
+        self.pool = pool
+        self.members = members
+
+    def cmd(self, command, args):
+        '''
+            Sends a command to all our members in parallel, and returns
+            their results in member order.
+        '''
+        pending = [worker.submit(command, member_id, **args)
+                   for member_id, worker in self.members]
+
+        return [p.get() for p in pending]
+
+    def stop(self):
+        self.pool.release(self)
+        self.members = []
+
+
+class UncertaintyWorkerPool(object):
+    '''
+        A fixed number of worker processes, shared by the uncertainty
+        ensembles of all sessions.
+    '''
+    def __init__(self, num_workers, ipc_dir, load_member=load_member_model):
+        '''
+            :param num_workers: The number of processes to fork.
+            :param ipc_dir: A folder for the save files that we hand
+                            our models to the workers with.
+            :param load_member: The function the workers use to load
+                                an ensemble member from a save file.
+        '''
+        self.ipc_dir = ipc_dir
+        self.load_member = load_member
+
+        self._lock = Lock()
+        self.workers = [PoolWorker(load_member) for _i in range(num_workers)]
+
+    def _replace_dead_workers(self):
+        for i, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                log.warning('replacing dead uncertainty worker: pid {0}'
+                            .format(worker.pid))
+                worker.stop()
+                self.workers[i] = PoolWorker(self.load_member)
+
+    def _assign_workers(self, num_members):
+        '''
+            Picks a worker for each member.  Every member goes to the
+            worker that hosts the fewest members at the time, so a single
+            ensemble is spread over as many workers as possible.
+        '''
+        with self._lock:
+            self._replace_dead_workers()
+
+            assigned = []
+            for _i in range(num_members):
+                worker = min(self.workers, key=lambda w: len(w.member_ids))
+                member_id = str(uuid.uuid4())
+
+                worker.member_ids.add(member_id)
+                assigned.append((member_id, worker))
+
+            return assigned
+
+    def start_ensemble(self, model, wind_speed_uncertainties,
+                       spill_amount_uncertainties):
+        '''
+            Loads the members of an uncertainty ensemble for a model,
+            one for each combination of uncertainty values, like the
+            ModelBroadcaster does.
+        '''
+        uncertainties = list(itertools.product(wind_speed_uncertainties,
+                                               spill_amount_uncertainties))
+
+        file_name = '{0}.zip'.format(uuid.uuid4())
+        save_file = os.path.join(self.ipc_dir, file_name)
+
+        model.save(saveloc=self.ipc_dir, name=file_name)
+
+        ensemble = PooledEnsemble(self,
+                                  self._assign_workers(len(uncertainties)))
+
+        try:
+            pending = [worker.submit('load', member_id, save_file,
+                                     wind, spill)
+                       for (member_id, worker), (wind, spill)
+                       in zip(ensemble.members, uncertainties)]
+
+            for p in pending:
+                p.get()
+        except Exception:
+            ensemble.stop()
+            raise
+        finally:
+            os.remove(save_file)
+
+        return ensemble
+
+    def release(self, ensemble):
+        '''
+            Unloads the members of an ensemble from their workers.
+        '''
+        pending = [worker.submit('unload', member_id)
+                   for member_id, worker in ensemble.members]
+
+        for p in pending:
+            try:
+                p.get()
+            except UncertaintyPoolError:
+                pass
+
+        with self._lock:
+            for member_id, worker in ensemble.members:
+                worker.member_ids.discard(member_id)
+
+    def num_members(self):
+        with self._lock:
+            return sum([len(w.member_ids) for w in self.workers])
+
+    def stop(self):
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
@@ -17,21 +17,30 @@ from pyramid.httpexceptions import (HTTPBadRequest,
 
 from pyramid.interfaces import ISessionFactory
 
-from pyramid.response import FileResponse
+from pyramid.response import Response, FileResponse
 
 from .helpers import (JSONImplementsOneOf,
                       FQNamesToList,
-                      PyClassFromName)
+                      class_registry)
 
 from .common_object import (CreateObject,
                             UpdateObject,
+                            PatchObject,
+                            PatchFieldError,
+                            SerializeFields,
                             ObjectImplementsOneOf,
                             obj_id_from_url,
                             obj_id_from_req_payload,
                             get_session_dir,
                             clean_session_dir)
 
-from .session_management import get_session_objects, get_session_object
+from .session_management import (get_session_objects,
+                                 get_session_object,
+                                 get_serialized_object,
+                                 get_session_lock,
+                                 make_room_for_session,
+                                 objects_changed,
+                                 model_changed)
 
 cors_policy = {'credentials': True
                }
@@ -81,6 +90,22 @@ def cors_file_response(request, path):
     return file_response
 
 
+def check_memory_caps(request, replacing=False):
+    '''
+        Rejects the request if the work it asks for could take us past
+        our memory caps.
+    '''
+    message = make_room_for_session(request, replacing)
+
+    if message is not None:
+        log.warning('req({0}): {1}'.format(id(request), message))
+
+        http_exc = cors_exception(request, HTTPInsufficientStorage)
+        http_exc.json_body = ujson.dumps([message])
+
+        raise http_exc
+
+
 def get_object(request, implemented_types):
     '''Returns a Gnome object in JSON.'''
     obj_id = obj_id_from_url(request)
@@ -90,19 +115,59 @@ def get_object(request, implemented_types):
         obj = get_session_object(obj_id, request)
         if obj:
             if ObjectImplementsOneOf(obj, implemented_types):
-                return obj.serialize()
+                with get_session_lock(request).shared():
+                    return object_response(request, obj)
             else:
                 raise cors_exception(request, HTTPUnsupportedMediaType)
         else:
             raise cors_exception(request, HTTPNotFound)
 
 
+def object_response(request, obj):
+    '''
+        Serves the JSON of a session object, tagged with the object's id
+        and the version of the session's objects.  Clients that already
+        have the current JSON get a 304 without any body.
+
+        The ETag is weak, because our gzip filter sends the same tag with
+        a compressed body.
+
+        This should only be called while holding the session lock.
+    '''
+    version = get_session_lock(request).version
+    etag = '{0}-{1}'.format(obj.id, version)
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        json_body = get_serialized_object(request, obj)[1]
+
+        response = Response(body=json_body,
+                            content_type='application/json')
+
+    response.etag = (etag, False)
+    response.cache_control = 'no-cache'
+
+    return cors_response(request, response)
+
+
+def report_model_changed(request):
+    '''
+        Calls model_changed(), and tells the client with a response header
+        if the session's model run has been started over because of it,
+        so that a client in the middle of a run knows that the next step
+        is the first one again.
+    '''
+    if model_changed(request):
+        request.response.headers['X-Model-Run-Reset'] = 'true'
+
+
 def get_specifications(request, implemented_types):
     specs = {}
     for t in implemented_types:
         try:
             name = FQNamesToList((t,))[0][0]
-            cls = PyClassFromName(t)
+            cls = class_registry.get_class(t)
             if cls:
                 spec = dict([(n, None)
                              for n in cls._state.get_names(['read', 'update'])
@@ -127,9 +192,11 @@ def create_object(request, implemented_types):
     if not JSONImplementsOneOf(json_request, implemented_types):
         raise cors_exception(request, HTTPNotImplemented)
 
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('  ' + log_prefix + 'semaphore acquired...')
+    check_memory_caps(request)
+
+    session_lock = get_session_lock(request)
+    session_lock.acquire()
+    log.info('  ' + log_prefix + 'session lock acquired...')
 
     try:
         log.info('  ' + log_prefix + 'creating ' + json_request['obj_type'])
@@ -138,8 +205,12 @@ def create_object(request, implemented_types):
         raise cors_exception(request, HTTPUnsupportedMediaType,
                              with_stacktrace=True)
     finally:
-        gnome_sema.release()
-        log.info('  ' + log_prefix + 'semaphore released...')
+        # a create that failed part way may still have added objects.
+        try:
+            objects_changed(request)
+        finally:
+            session_lock.release()
+        log.info('  ' + log_prefix + 'session lock released...')
 
     log.info('<<' + log_prefix)
     return obj.serialize()
@@ -161,9 +232,11 @@ def update_object(request, implemented_types):
     obj = get_session_object(obj_id_from_req_payload(json_request),
                              request)
     if obj:
-        gnome_sema = request.registry.settings['py_gnome_semaphore']
-        gnome_sema.acquire()
-        log.info('  ' + log_prefix + 'semaphore acquired...')
+        check_memory_caps(request)
+
+        session_lock = get_session_lock(request)
+        session_lock.acquire()
+        log.info('  ' + log_prefix + 'session lock acquired...')
 
         try:
             UpdateObject(obj, json_request, get_session_objects(request))
@@ -171,8 +244,13 @@ def update_object(request, implemented_types):
             raise cors_exception(request, HTTPUnsupportedMediaType,
                                  with_stacktrace=True)
         finally:
-            gnome_sema.release()
-            log.info('  ' + log_prefix + 'semaphore released...')
+            # an update that failed part way may still have changed
+            # some of our objects.
+            try:
+                report_model_changed(request)
+            finally:
+                session_lock.release()
+            log.info('  ' + log_prefix + 'session lock released...')
     else:
         raise cors_exception(request, HTTPNotFound)
 
@@ -180,7 +258,77 @@ def update_object(request, implemented_types):
     return obj.serialize()
 
 
-def process_upload(request, field_name):
+def patch_object(request, implemented_types, get_default=None):
+    '''
+        Updates only the fields of a Gnome object that are in the request,
+        and returns only those fields.
+
+        :param get_default: a function that returns the object to update
+                            if the request doesn't name one.
+    '''
+    log_prefix = 'req({0}): patch_object():'.format(id(request))
+    log.info('>>' + log_prefix)
+
+    try:
+        json_request = ujson.loads(request.body)
+    except:
+        raise cors_exception(request, HTTPBadRequest)
+
+    if not isinstance(json_request, dict):
+        raise cors_exception(request, HTTPBadRequest)
+
+    obj_id = obj_id_from_req_payload(json_request) or obj_id_from_url(request)
+
+    if obj_id:
+        obj = get_session_object(obj_id, request)
+    elif get_default is not None:
+        obj = get_default(request)
+    else:
+        obj = None
+
+    if obj:
+        if not ObjectImplementsOneOf(obj, implemented_types):
+            raise cors_exception(request, HTTPUnsupportedMediaType)
+
+        check_memory_caps(request)
+
+        session_lock = get_session_lock(request)
+        session_lock.acquire()
+        log.info('  ' + log_prefix + 'session lock acquired...')
+
+        try:
+            try:
+                apply_patch = PatchObject(obj, json_request,
+                                          get_session_objects(request))
+            except PatchFieldError:
+                # nothing has been changed
+                raise cors_exception(request, HTTPBadRequest,
+                                     with_stacktrace=True)
+            except:
+                raise cors_exception(request, HTTPUnsupportedMediaType,
+                                     with_stacktrace=True)
+
+            try:
+                field_names = apply_patch()
+                ret = SerializeFields(obj, field_names)
+            except:
+                raise cors_exception(request, HTTPUnsupportedMediaType,
+                                     with_stacktrace=True)
+            finally:
+                # a patch that failed part way may still have changed
+                # some of our objects.
+                report_model_changed(request)
+        finally:
+            session_lock.release()
+            log.info('  ' + log_prefix + 'session lock released...')
+    else:
+        raise cors_exception(request, HTTPNotFound)
+
+    log.info('<<' + log_prefix)
+    return ret
+
+
+def process_upload(request, field_name, replacing=False):
     # For some reason, the multipart form does not contain
     # a session cookie, and Nathan so far has not been able to explicitly
     # set it.  So a workaround is to put the session ID in the form as
@@ -203,6 +351,8 @@ def process_upload(request, field_name):
                                                'could not re-establish session'
                                                ))
 
+    check_memory_caps(request, replacing)
+
     session_dir = get_session_dir(request)
     max_upload_size = eval(request.registry.settings['max_upload_size'])
 
@@ -240,8 +390,13 @@ def process_upload(request, field_name):
 
     # Finally write the data to the session temporary dir
     input_file.seek(0)
-    with open(file_path, 'wb') as output_file:
-        shutil.copyfileobj(input_file, output_file)
+    file_store = request.registry.settings['data_file_store']
+
+    if file_store is not None:
+        file_store.add_stream(input_file, file_path)
+    else:
+        with open(file_path, 'wb') as output_file:
+            shutil.copyfileobj(input_file, output_file)
 
     log.info('\tSuccessfully uploaded file "{0}"'.format(file_path))
 
@@ -51,11 +51,27 @@ class FunctionalTestBase(GnomeTestCase):
         registry = self.testapp.app.registry
         settings = registry.settings
 
+        if settings['session_reaper'] is not None:
+            settings['session_reaper'].stop()
+
         for session_umodels in settings['uncertain_models'].values():
             print 'our session umodels object:', session_umodels
             if session_umodels is not None:
                 session_umodels.stop()
 
+        if settings['uncertainty_pool'] is not None:
+            settings['uncertainty_pool'].stop()
+
+        for model_host in settings['model_hosts'].values():
+            model_host.stop()
+
+        for prefetcher in settings['step_prefetchers'].values():
+            prefetcher.invalidate()
+
+        for job in settings['run_jobs'].values():
+            job.cancel()
+            job.join()
+
         if hasattr(registry, '_redis_sessions'):
             registry._redis_sessions.connection_pool.disconnect()
 
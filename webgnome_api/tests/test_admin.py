@@ -0,0 +1,34 @@
+"""
+Functional tests for the admin API
+"""
+from base import FunctionalTestBase
+
+
+class AdminDisabledTest(FunctionalTestBase):
+    def test_memory_disabled(self):
+        self.testapp.get('/admin/memory', status=404)
+
+
+class AdminTest(FunctionalTestBase):
+    def get_settings(self, *args, **kwargs):
+        settings = super(AdminTest, self).get_settings(*args, **kwargs)
+        settings['admin.enabled'] = 'true'
+
+        return settings
+
+    def test_memory(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.get('/admin/memory')
+        memory = resp.json_body
+
+        assert memory['session_cap'] == 0
+        assert memory['total_cap'] == 0
+
+        assert len(memory['sessions']) == 1
+
+        usage = memory['sessions'].values()[0]
+        assert usage['objects'] > 0
+        assert usage['busy'] is False
+        assert usage['evicted'] is False
+        assert memory['total'] == usage['total']
@@ -0,0 +1,46 @@
+"""
+Unit tests for the registry of our implemented classes
+"""
+from collections import OrderedDict, Counter
+
+from webgnome_api.common.helpers import (ClassRegistry,
+                                         JSONImplementedType)
+
+
+class TestClassRegistry(object):
+    implemented_types = ('collections.OrderedDict',
+                         'collections.Counter',
+                         )
+
+    def setup_method(self, method):
+        self.registry = ClassRegistry()
+
+    def test_register(self):
+        self.registry.register(self.implemented_types)
+
+        assert set(self.registry.obj_types()) == set(self.implemented_types)
+
+    def test_register_bad_type(self):
+        self.registry.register(('collections.Nothing',
+                                'collections.Counter'))
+
+        assert self.registry.obj_types() == ['collections.Counter']
+
+    def test_get_class(self):
+        assert self.registry.get_class('collections.OrderedDict') is OrderedDict
+
+        # not registered, imported and kept.
+        assert self.registry.get_class('collections.Counter') is Counter
+        assert 'collections.Counter' in self.registry.obj_types()
+
+    def test_class_names(self):
+        names = self.registry.class_names(self.implemented_types)
+
+        assert names == frozenset(['OrderedDict', 'Counter'])
+        assert self.registry.class_names(list(self.implemented_types)) is names
+
+    def test_json_implemented_type(self):
+        json_obj = {'obj_type': 'collections.Counter'}
+
+        assert JSONImplementedType(json_obj, self.implemented_types) is Counter
+        assert JSONImplementedType(json_obj, ('collections.deque',)) is None
@@ -168,3 +168,31 @@ class WaterTests(WindTests):
             attributes.
         '''
         pass
+
+
+class WindPatchTests(FunctionalTestBase):
+    '''
+        Tests out the partial update of a Gnome Wind object
+    '''
+    req_data = WindTests.req_data
+
+    def test_patch_timeseries(self):
+        resp = self.testapp.post_json('/environment', params=self.req_data)
+        obj_id = resp.json_body['id']
+
+        timeseries = [['2012-11-06T20:10:30', [5.0, 90.0]],
+                      ['2012-11-06T20:11:30', [10.0, 180.0]]]
+
+        resp = self.testapp.patch_json('/environment',
+                                       params={'id': obj_id,
+                                               'timeseries': timeseries,
+                                               'units': 'knots'})
+
+        assert resp.json_body['units'] == 'knots'
+        assert resp.json_body['timeseries'] == timeseries
+
+        resp = self.testapp.get('/environment/{0}'.format(obj_id))
+
+        assert resp.json_body['units'] == 'knots'
+        assert resp.json_body['timeseries'] == timeseries
+        assert resp.json_body['description'] == self.req_data['description']
@@ -0,0 +1,87 @@
+"""
+Unit tests for the content-addressed data file store
+"""
+import os
+import stat
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from webgnome_api.common.file_store import DataFileStore
+
+
+class TestDataFileStore(object):
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.temp_dir, 'store')
+        os.mkdir(self.store_dir)
+
+        for s in ('s1', 's2'):
+            os.mkdir(os.path.join(self.temp_dir, s))
+
+        self.store = DataFileStore(self.store_dir)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def session_file(self, session_id, name):
+        return os.path.join(self.temp_dir, session_id, name)
+
+    def test_same_contents_stored_once(self):
+        first = self.store.add_stream(StringIO('grid data'),
+                                      self.session_file('s1', 'a.nc'))
+        second = self.store.add_stream(StringIO('grid data'),
+                                       self.session_file('s2', 'b.nc'))
+
+        assert first == second
+        assert os.listdir(self.store_dir) == [first]
+
+        for path in (self.session_file('s1', 'a.nc'),
+                     self.session_file('s2', 'b.nc')):
+            with open(path) as fh:
+                assert fh.read() == 'grid data'
+
+        other = self.store.add_stream(StringIO('other data'),
+                                      self.session_file('s1', 'c.nc'))
+        assert other != first
+        assert len(os.listdir(self.store_dir)) == 2
+
+    def test_collect_garbage(self):
+        digest = self.store.add_stream(StringIO('grid data'),
+                                       self.session_file('s1', 'a.nc'))
+        self.store.add_stream(StringIO('grid data'),
+                              self.session_file('s2', 'a.nc'))
+
+        assert self.store.collect_garbage() == 0
+
+        shutil.rmtree(os.path.join(self.temp_dir, 's1'))
+        assert self.store.collect_garbage() == 0
+
+        shutil.rmtree(os.path.join(self.temp_dir, 's2'))
+        assert self.store.collect_garbage() == 1
+        assert not os.path.exists(self.store.stored_path(digest))
+
+    def test_read_only(self):
+        link_path = self.session_file('s1', 'a.nc')
+        digest = self.store.add_stream(StringIO('grid data'), link_path)
+
+        for path in (link_path, self.store.stored_path(digest)):
+            assert not os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP |
+                                                stat.S_IWOTH)
+
+        # a new upload replaces the link, not the stored contents
+        self.store.add_stream(StringIO('new data'), link_path)
+
+        with open(self.store.stored_path(digest)) as fh:
+            assert fh.read() == 'grid data'
+
+    def test_gc_due(self):
+        store = DataFileStore(self.store_dir, gc_interval=60)
+        now = store._last_gc
+
+        assert not store.gc_due(now + 30)
+        assert store.gc_due(now + 60)
+
+        # only once per interval
+        assert not store.gc_due(now + 61)
+        assert store.gc_due(now + 120)
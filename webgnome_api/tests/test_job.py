@@ -0,0 +1,134 @@
+"""
+Tests for the background model run jobs
+"""
+import time
+
+import pytest
+
+from webgnome_api.common.jobs import ModelRunJob
+
+from base import FunctionalTestBase
+
+
+def counting_run(num_steps, delay=0.0, closed=None):
+    try:
+        for s in range(num_steps):
+            time.sleep(delay)
+            yield {'step_num': s}
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+def failing_run():
+    yield {'step_num': 0}
+    raise ValueError('bad step')
+
+
+class TestModelRunJob(object):
+    def test_run_to_completion(self):
+        closed = []
+        job = ModelRunJob(counting_run(5, closed=closed), 5)
+        job.start()
+        job.join(5)
+
+        status = job.to_dict()
+        assert status['status'] == 'done'
+        assert status['step'] == 5
+        assert status['num_steps'] == 5
+        assert status['eta'] is None
+
+        assert job.result == {'step_num': 4}
+        assert closed == [True]
+
+    def test_cancel(self):
+        closed = []
+        job = ModelRunJob(counting_run(1000, 0.01, closed), 1000)
+        job.start()
+
+        time.sleep(0.1)
+        job.cancel()
+        job.join(5)
+
+        assert job.status == 'cancelled'
+        assert 0 < job.step < 1000
+        assert closed == [True]
+
+    def test_failure(self):
+        job = ModelRunJob(failing_run(), 2)
+        job.start()
+        job.join(5)
+
+        assert job.status == 'failed'
+        assert job.step == 1
+        assert 'bad step' in job.error[-1]
+
+
+class JobTest(FunctionalTestBase):
+    '''
+        Tests out the model run job API
+    '''
+    def test_no_active_model(self):
+        self.testapp.post_json('/job', status=412)
+
+    def test_no_job(self):
+        self.testapp.get('/job', status=404)
+        self.testapp.get('/job/bogus', status=404)
+
+    @pytest.mark.slow
+    def test_job_run(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.post_json('/job')
+        job = resp.json_body
+
+        assert job['status'] in ('pending', 'running')
+        num_steps = job['num_steps']
+
+        while job['status'] in ('pending', 'running'):
+            time.sleep(0.1)
+            job = self.testapp.get('/job/{0}'.format(job['id'])).json_body
+
+        assert job['status'] == 'done'
+        assert job['step'] == num_steps
+
+        resp = self.testapp.get('/job/{0}/result'.format(job['id']))
+        assert resp.json_body['step_num'] == num_steps - 1
+
+    @pytest.mark.slow
+    def test_job_cancel(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        job = self.testapp.post_json('/job').json_body
+
+        resp = self.testapp.delete('/job/{0}'.format(job['id']))
+        assert resp.json_body['id'] == job['id']
+
+        while job['status'] in ('pending', 'running'):
+            time.sleep(0.1)
+            job = self.testapp.get('/job').json_body
+
+        assert job['status'] in ('cancelled', 'done')
+
+        self.testapp.get('/job/{0}/result'.format(job['id']),
+                         status=(200 if job['status'] == 'done' else 409))
+
+    @pytest.mark.slow
+    def test_job_model_changed(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        job = self.testapp.post_json('/job').json_body
+
+        # served between the steps of the run, which can't go on after
+        # the model has changed.
+        self.testapp.patch_json('/model', params={'time_step': 1800.0})
+
+        while job['status'] in ('pending', 'running'):
+            time.sleep(0.1)
+            job = self.testapp.get('/job').json_body
+
+        if job['status'] == 'failed':
+            assert 'changed during the run' in job['error'][-1]
+        else:
+            # we didn't get to it before the run was done
+            assert job['status'] == 'done'
@@ -25,6 +25,28 @@ class LocationTest(FunctionalTestBase):
             assert 'slug' in f['properties']
             assert 'content' in f['properties']
 
+    def test_get_no_id_not_modified(self):
+        resp = self.testapp.get('/location')
+        etag = resp.headers['ETag']
+
+        self.testapp.get('/location', headers={'If-None-Match': etag},
+                         status=304)
+
+        self.testapp.get('/location', headers={'If-None-Match': '"bogus"'},
+                         status=200)
+
+    def test_get_no_id_gzip(self):
+        resp = self.testapp.get('/location')
+
+        gzip_resp = self.testapp.get('/location',
+                                     headers={'Accept-Encoding': 'gzip'})
+
+        assert gzip_resp.headers['Content-Encoding'] == 'gzip'
+        assert gzip_resp.headers['ETag'] != resp.headers['ETag']
+
+        gzip_resp.decode_content()
+        assert gzip_resp.json_body == resp.json_body
+
     def test_get_invalid_id(self):
         self.testapp.get('/location/bogus', status=404)
 
@@ -0,0 +1,142 @@
+"""
+Unit tests for the location model cache
+"""
+import os
+import time
+import shutil
+import tempfile
+from threading import Lock
+
+from webgnome_api.common.location_cache import LocationModelCache
+
+
+def load_location_model(location_file):
+    with open(os.path.join(location_file, 'Model.json')) as fh:
+        contents = fh.read()
+
+    if contents == 'broken':
+        raise ValueError('bad location')
+
+    return LocationModel(contents)
+
+
+class LocationModel(object):
+    def __init__(self, contents):
+        self.contents = contents
+        self.movers = [{'grid': range(10)}]
+
+
+class UncopyableModel(LocationModel):
+    def __init__(self, contents):
+        super(UncopyableModel, self).__init__(contents)
+        self.lock = Lock()
+
+
+class TestLocationModelCache(object):
+    def setup_method(self, method):
+        self.location_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.location_dir, 'Model.json')
+        self.write_data('first')
+
+        self.num_loads = 0
+        self.cache = LocationModelCache(self.load_model)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.location_dir)
+
+    def write_data(self, contents):
+        with open(self.data_file, 'w') as fh:
+            fh.write(contents)
+
+    def load_model(self, location_file):
+        self.num_loads += 1
+
+        with open(os.path.join(location_file, 'Model.json')) as fh:
+            return LocationModel(fh.read())
+
+    def test_loads_once(self):
+        first = self.cache.get_model(self.location_dir)
+        second = self.cache.get_model(self.location_dir)
+
+        assert self.num_loads == 1
+        assert first.contents == second.contents == 'first'
+
+        # each session gets its own copy
+        assert first is not second
+        assert first.movers[0] is not second.movers[0]
+
+        first.movers[0]['grid'].append(10)
+        assert len(self.cache.get_template(self.location_dir)
+                   .movers[0]['grid']) == 10
+
+    def test_reload_on_change(self):
+        self.cache.check_interval = 0
+        self.cache.get_model(self.location_dir)
+
+        self.write_data('second')
+        mtime = time.time() + 10
+        os.utime(self.data_file, (mtime, mtime))
+
+        assert self.cache.get_model(self.location_dir).contents == 'second'
+        assert self.num_loads == 2
+
+    def test_check_interval(self):
+        self.cache.get_model(self.location_dir)
+
+        self.write_data('second')
+        mtime = time.time() + 10
+        os.utime(self.data_file, (mtime, mtime))
+
+        # we don't look again until the check interval is up
+        assert self.cache.get_model(self.location_dir).contents == 'first'
+        assert self.num_loads == 1
+
+    def test_uncopyable(self):
+        def load_model(location_file):
+            self.num_loads += 1
+            return UncopyableModel('first')
+
+        cache = LocationModelCache(load_model)
+
+        assert cache.get_model(self.location_dir).contents == 'first'
+        assert self.num_loads == 2
+
+        # not cached anymore, just loaded
+        assert cache.get_model(self.location_dir).contents == 'first'
+        assert self.num_loads == 3
+
+    def test_copy_location_model(self):
+        here = os.path.dirname(__file__)
+        location_file = os.path.join(here, '..', '..', 'location_files',
+                                     'long_island', 'long_island_save')
+
+        cache = LocationModelCache()
+
+        first = cache.get_model(location_file)
+        second = cache.get_model(location_file)
+
+        # copied, not loaded again
+        assert first is not second
+        assert first.movers is not second.movers
+        assert location_file not in cache._uncopyable
+
+    def test_warm_up(self):
+        broken_dir = tempfile.mkdtemp()
+
+        try:
+            with open(os.path.join(broken_dir, 'Model.json'), 'w') as fh:
+                fh.write('broken')
+
+            cache = LocationModelCache(load_location_model)
+            report = cache.warm_up([self.location_dir, broken_dir], 2)
+
+            assert report[self.location_dir]['error'] is None
+            assert report[self.location_dir]['load_time'] >= 0.0
+            assert 'bad location' in report[broken_dir]['error']
+            assert cache.warm_up_report is report
+
+            # the model came back from the worker
+            assert (cache.get_template(self.location_dir).contents ==
+                    'first')
+        finally:
+            shutil.rmtree(broken_dir)
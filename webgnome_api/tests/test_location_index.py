@@ -0,0 +1,93 @@
+"""
+Unit tests for the location index
+"""
+import os
+import zlib
+import shutil
+import tempfile
+
+import ujson
+
+from webgnome_api.common.location_index import LocationIndex
+
+
+class TestLocationIndex(object):
+    def setup_method(self, method):
+        self.locations_dir = tempfile.mkdtemp()
+
+        self.add_location('long_island', 'Long Island Sound')
+        self.add_location('mobile_bay', 'Mobile Bay')
+
+        # not a location
+        os.mkdir(os.path.join(self.locations_dir, 'images'))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.locations_dir)
+
+    def add_location(self, dir_name, name, mtime=None):
+        location_dir = os.path.join(self.locations_dir, dir_name)
+        if not os.path.isdir(location_dir):
+            os.mkdir(location_dir)
+
+        compiled_file = os.path.join(location_dir, 'compiled.json')
+        with open(compiled_file, 'w') as fh:
+            ujson.dump({'name': name,
+                        'geometry': {'coordinates': [-72.9, 41.1]},
+                        'steps': []},
+                       fh)
+
+        if mtime is not None:
+            os.utime(compiled_file, (mtime, mtime))
+
+    def test_index(self):
+        index = LocationIndex(self.locations_dir)
+
+        content, save_dir = index.get('long-island-sound')
+        assert content['name'] == 'Long Island Sound'
+        assert save_dir == os.path.join(self.locations_dir,
+                                        'long_island', 'long_island_save')
+
+        assert index.get('bogus') is None
+
+        features = index.feature_collection()['features']
+        assert ([f['properties']['slug'] for f in features] ==
+                ['long-island-sound', 'mobile-bay'])
+
+    def test_refresh(self):
+        index = LocationIndex(self.locations_dir, check_interval=0)
+
+        mtime = os.path.getmtime(os.path.join(self.locations_dir,
+                                              'mobile_bay',
+                                              'compiled.json')) + 10
+        self.add_location('mobile_bay', 'Mobile Bay Renamed', mtime)
+
+        assert index.get('mobile-bay') is None
+        assert index.get('mobile-bay-renamed') is not None
+
+    def test_check_interval(self):
+        index = LocationIndex(self.locations_dir, check_interval=3600)
+
+        self.add_location('galveston', 'Galveston Bay')
+        assert index.get('galveston-bay') is None
+
+        index.refresh(force=True)
+        assert index.get('galveston-bay') is not None
+
+    def test_catalog(self):
+        index = LocationIndex(self.locations_dir, check_interval=0)
+        catalog = index.get_catalog()
+
+        assert (ujson.loads(catalog.body)['features'][0]['properties']
+                ['slug'] == 'long-island-sound')
+        assert zlib.decompress(catalog.gzip_body,
+                               16 + zlib.MAX_WBITS) == catalog.body
+
+        # unchanged files give the same catalog
+        assert index.get_catalog().etag == catalog.etag
+
+        mtime = os.path.getmtime(os.path.join(self.locations_dir,
+                                              'mobile_bay',
+                                              'compiled.json')) + 10
+        self.add_location('mobile_bay', 'Mobile Bay Renamed', mtime)
+
+        assert index.get_catalog().etag != catalog.etag
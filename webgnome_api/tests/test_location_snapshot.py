@@ -0,0 +1,87 @@
+"""
+Unit tests for the location model snapshots
+"""
+import os
+import shutil
+import tempfile
+
+from webgnome_api.common import location_snapshot
+from webgnome_api.common.location_snapshot import (snapshot_file,
+                                                   write_snapshot,
+                                                   load_snapshot)
+
+
+class LocationModel(object):
+    def __init__(self, contents):
+        self.contents = contents
+
+
+def load_location_model(save_dir):
+    with open(os.path.join(save_dir, 'Model.json')) as fh:
+        return LocationModel(fh.read())
+
+
+class TestLocationSnapshot(object):
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.save_dir = os.path.join(self.temp_dir, 'bay_save')
+        os.mkdir(self.save_dir)
+
+        self.write_data('first')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def write_data(self, contents):
+        with open(os.path.join(self.save_dir, 'Model.json'), 'w') as fh:
+            fh.write(contents)
+
+    def test_no_snapshot(self):
+        assert load_snapshot(self.save_dir) is None
+
+    def test_snapshot(self):
+        path = write_snapshot(self.save_dir, load_location_model)
+
+        assert path == snapshot_file(self.save_dir)
+        assert path == os.path.join(self.temp_dir, 'bay_save.snapshot')
+
+        assert load_snapshot(self.save_dir).contents == 'first'
+
+    def test_stale_snapshot(self):
+        write_snapshot(self.save_dir, load_location_model)
+
+        self.write_data('second')
+        assert load_snapshot(self.save_dir) is None
+
+    def test_broken_snapshot(self):
+        with open(snapshot_file(self.save_dir), 'wb') as fh:
+            fh.write('not a pickle')
+
+        assert load_snapshot(self.save_dir) is None
+
+    def test_unchanged_files_not_hashed(self, monkeypatch):
+        write_snapshot(self.save_dir, load_location_model)
+
+        def no_hash(save_dir):
+            raise AssertionError('save folder hashed')
+
+        monkeypatch.setattr(location_snapshot, 'save_dir_hash', no_hash)
+
+        assert load_snapshot(self.save_dir).contents == 'first'
+
+    def test_touched_files(self):
+        write_snapshot(self.save_dir, load_location_model)
+
+        os.utime(os.path.join(self.save_dir, 'Model.json'), (0, 0))
+
+        # same contents, so the snapshot is still good
+        assert load_snapshot(self.save_dir).contents == 'first'
+
+    def test_moved_save_dir(self):
+        write_snapshot(self.save_dir, load_location_model)
+
+        moved_dir = os.path.join(self.temp_dir, 'moved_save')
+        os.rename(self.save_dir, moved_dir)
+        os.rename(snapshot_file(self.save_dir), snapshot_file(moved_dir))
+
+        assert load_snapshot(moved_dir) is None
@@ -0,0 +1,144 @@
+"""
+Unit tests for our session lock management
+"""
+import time
+from threading import Thread
+
+from webgnome_api.common.locks import ReadWriteLock, SessionLockManager
+
+
+def run_in_thread(func):
+    result = []
+
+    t = Thread(target=lambda: result.append(func()))
+    t.start()
+    t.join()
+
+    return result[0]
+
+
+class TestReadWriteLock(object):
+    def test_shared_holders(self):
+        lock = ReadWriteLock()
+
+        def share():
+            if not lock.acquire_shared(False):
+                return False
+
+            lock.release_shared()
+            return True
+
+        with lock.shared():
+            assert run_in_thread(share)
+            assert not run_in_thread(lambda: lock.acquire(False))
+
+        assert run_in_thread(lambda: lock.acquire(False))
+
+    def test_exclusive_blocks_shared(self):
+        lock = ReadWriteLock()
+
+        with lock:
+            assert not run_in_thread(lambda: lock.acquire_shared(False))
+            assert not run_in_thread(lambda: lock.acquire(False))
+
+    def test_reentrant_for_owner(self):
+        lock = ReadWriteLock()
+
+        with lock:
+            with lock:
+                with lock.shared():
+                    pass
+
+            assert not run_in_thread(lambda: lock.acquire_shared(False))
+
+        assert run_in_thread(lambda: lock.acquire_shared(False))
+
+    def test_shared_again_with_writer_waiting(self):
+        lock = ReadWriteLock()
+        acquired = []
+
+        def write():
+            with lock:
+                acquired.append('writer')
+
+        with lock.shared():
+            writer = Thread(target=write)
+            writer.start()
+
+            while not lock._writers_waiting:
+                time.sleep(0.01)
+
+            # new readers wait for the writer...
+            assert not run_in_thread(lambda: lock.acquire_shared(False))
+
+            # ...but we already hold a share, so waiting would deadlock.
+            with lock.shared():
+                acquired.append('reader')
+
+        writer.join(5)
+
+        assert acquired == ['reader', 'writer']
+
+    def test_version(self):
+        lock = ReadWriteLock()
+        version = lock.version
+
+        with lock.shared():
+            pass
+
+        with lock:
+            pass
+
+        # nothing has been changed
+        assert lock.version == version
+
+        with lock:
+            lock.changed()
+
+        assert lock.version > version
+        assert ReadWriteLock().version > lock.version
+
+
+class TestSessionLockManager(object):
+    def test_same_session_same_lock(self):
+        locks = SessionLockManager()
+
+        assert locks.get_lock('abc') is locks.get_lock('abc')
+
+    def test_sessions_do_not_contend(self):
+        locks = SessionLockManager()
+        acquired = []
+
+        def other_session():
+            lock = locks.get_lock('other')
+            acquired.append(lock.acquire(False))
+            lock.release()
+
+        with locks.get_lock('busy'):
+            t = Thread(target=other_session)
+            t.start()
+            t.join()
+
+        assert acquired == [True]
+
+    def test_drop_lock(self):
+        locks = SessionLockManager()
+        lock = locks.get_lock('abc')
+
+        locks.drop_lock('abc')
+
+        assert 'abc' not in locks.session_ids()
+        assert locks.get_lock('abc') is not lock
+
+    def test_drop_other_lock(self):
+        locks = SessionLockManager()
+        old_lock = locks.get_lock('abc')
+        locks.drop_lock('abc')
+        lock = locks.get_lock('abc')
+
+        # the session has a newer lock, which we keep
+        locks.drop_lock('abc', old_lock)
+        assert locks.get_lock('abc') is lock
+
+        locks.drop_lock('abc', lock)
+        assert 'abc' not in locks.session_ids()
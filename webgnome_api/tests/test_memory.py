@@ -0,0 +1,73 @@
+"""
+Unit tests for our memory use estimation
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from webgnome_api.common.memory import (estimate_size, dir_size,
+                                        process_rss)
+
+
+class Container(object):
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+
+class TestEstimateSize(object):
+    def test_array_buffers(self):
+        arr = np.zeros((1000,), dtype=np.float64)
+
+        assert estimate_size(arr) == arr.nbytes
+        assert estimate_size(Container({'a': arr})) > arr.nbytes
+
+    def test_shared_objects_counted_once(self):
+        arr = np.zeros((1000,), dtype=np.float64)
+        one = Container({'a': arr})
+        both = [one, Container({'a': arr})]
+
+        assert estimate_size(both) < estimate_size(one) + arr.nbytes
+
+        seen = set()
+        estimate_size(one, seen)
+        assert estimate_size(arr, seen) == 0
+
+    def test_views(self):
+        arr = np.zeros((1000,), dtype=np.float64)
+
+        # a view only adds its header
+        assert estimate_size([arr, arr[:10]]) < arr.nbytes * 1.1
+
+    def test_cycles(self):
+        a = Container(None)
+        b = Container(a)
+        a.arrays = b
+
+        assert estimate_size(a) > 0
+
+
+class TestDirSize(object):
+    def test_dir_size(self):
+        temp_dir = tempfile.mkdtemp()
+
+        try:
+            os.mkdir(os.path.join(temp_dir, 'sub'))
+
+            for name in ('a', os.path.join('sub', 'b')):
+                with open(os.path.join(temp_dir, name), 'wb') as fh:
+                    fh.write('x' * 100)
+
+            assert dir_size(temp_dir) == 200
+            assert dir_size(os.path.join(temp_dir, 'missing')) == 0
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestProcessRSS(object):
+    def test_process_rss(self):
+        rss = process_rss()
+
+        # not every platform has a /proc
+        assert rss is None or rss > 0
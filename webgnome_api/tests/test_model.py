@@ -70,6 +70,63 @@ class ModelTests(FunctionalTestBase):
 
         assert model1['id'] == model2['id']
 
+    def test_get_model_etag(self):
+        self.testapp.post_json('/model', params=self.req_data)
+
+        resp1 = self.testapp.get('/model')
+        etag = resp1.headers['ETag']
+
+        # the gzip filter sends the same tag for a different body
+        assert etag.startswith('W/')
+
+        # nothing has changed
+        resp2 = self.testapp.get('/model', headers={'If-None-Match': etag},
+                                 status=304)
+
+        assert resp2.body == ''
+        assert resp2.headers['ETag'] == etag
+
+        # a change gives us a new copy
+        self.testapp.patch_json('/model', params={'time_step': 1800.0})
+
+        resp3 = self.testapp.get('/model', headers={'If-None-Match': etag})
+
+        assert resp3.headers['ETag'] != etag
+        assert resp3.json_body['time_step'] == 1800.0
+
+    def test_get_model_etag_session_version(self):
+        '''
+            The version in our ETags is kept per session, not per object,
+            because an object's JSON includes the objects it contains.
+            Any change in the session gives every object a new ETag.
+        '''
+        self.testapp.post_json('/model', params=self.req_data)
+        wind = self.testapp.post_json('/environment',
+                                      params={'obj_type':
+                                              'gnome.environment.Wind',
+                                              'timeseries':
+                                              [('2012-11-06T20:10:30',
+                                                (1.0, 0.0))],
+                                              'units': 'meter per second'}
+                                      ).json_body
+
+        etag = self.testapp.get('/model').headers['ETag']
+
+        # a rejected patch changes nothing
+        self.testapp.patch_json('/environment',
+                                params={'id': wind['id'], 'bogus': 1},
+                                status=400)
+        self.testapp.get('/model', headers={'If-None-Match': etag},
+                         status=304)
+
+        # a change to any of the session's objects
+        self.testapp.patch_json('/environment',
+                                params={'id': wind['id'],
+                                        'name': 'another wind'})
+
+        resp = self.testapp.get('/model', headers={'If-None-Match': etag})
+        assert resp.headers['ETag'] != etag
+
     def test_post_no_payload(self):
         '''
             This case is different than the other object create methods.
@@ -150,6 +207,50 @@ class ModelTests(FunctionalTestBase):
                     for v in s.values()
                     if isinstance(v, ModelBroadcaster)]
 
+    def test_patch_no_id_no_active_model(self):
+        self.testapp.patch_json('/model', params={'time_step': 1800.0},
+                                status=404)
+
+    def test_patch_no_id_active_model(self):
+        resp = self.testapp.post_json('/model', params=self.req_data)
+        model1 = resp.json_body
+
+        resp = self.testapp.patch_json('/model', params={'time_step': 1800.0})
+        patch = resp.json_body
+
+        # we only get back what we changed
+        assert set(patch.keys()) == set(['id', 'obj_type', 'time_step'])
+        assert patch['id'] == model1['id']
+        assert patch['time_step'] == 1800.0
+
+        resp = self.testapp.get('/model')
+        model2 = resp.json_body
+
+        assert model2['time_step'] == 1800.0
+        assert model2['duration'] == model1['duration']
+
+    def test_patch_valid_id(self):
+        resp = self.testapp.post_json('/model', params=self.req_data)
+        model1 = resp.json_body
+
+        resp = self.testapp.patch_json('/model/{0}'.format(model1['id']),
+                                       params={'uncertain': True})
+
+        assert resp.json_body['uncertain'] is True
+        assert 'movers' not in resp.json_body
+
+    def test_patch_bad_field(self):
+        resp = self.testapp.post_json('/model', params=self.req_data)
+        model1 = resp.json_body
+
+        self.testapp.patch_json('/model', params={'time_step': 1800.0,
+                                                  'bogus': 1},
+                                status=400)
+
+        # nothing has been applied
+        model2 = self.testapp.get('/model').json_body
+        assert model2['time_step'] == model1['time_step']
+
 
 class NestedModelTests(FunctionalTestBase):
     req_data = {'obj_type': u'gnome.model.Model',
@@ -0,0 +1,80 @@
+"""
+Unit tests for the out-of-process model host
+"""
+import os
+
+import pytest
+
+from webgnome_api.common.model_host import ModelHost, ModelHostError
+
+
+class CountingModel(object):
+    '''
+        Stands in for a gnome Model.  Just enough of the interface
+        for our host to drive it.
+    '''
+    has_weathering_uncertainty = False
+
+    def __init__(self, num_time_steps):
+        self.num_time_steps = num_time_steps
+        self.current_time_step = -1
+
+    def step(self):
+        if self.num_time_steps < 0:
+            raise ValueError('bad model')
+
+        if self.current_time_step + 1 >= self.num_time_steps:
+            raise StopIteration
+
+        self.current_time_step += 1
+        return {'step_num': self.current_time_step, 'pid': os.getpid()}
+
+    def rewind(self):
+        self.current_time_step = -1
+
+
+class TestModelHost(object):
+    def test_step_in_worker(self):
+        host = ModelHost(CountingModel(3))
+
+        try:
+            assert host.current_time_step == -1
+
+            output = host.step()
+            assert output['step_num'] == 0
+            assert output['pid'] != os.getpid()
+
+            assert host.current_time_step == 0
+
+            # the web process copy is untouched
+            assert host.model.current_time_step == -1
+        finally:
+            host.stop()
+
+        assert not host.is_alive()
+
+    def test_iterate_and_rewind(self):
+        host = ModelHost(CountingModel(3))
+
+        try:
+            assert [o['step_num'] for o in host] == [0, 1, 2]
+
+            with pytest.raises(StopIteration):
+                host.step()
+
+            host.rewind()
+            assert host.step()['step_num'] == 0
+        finally:
+            host.stop()
+
+    def test_worker_error(self):
+        host = ModelHost(CountingModel(-5))
+
+        try:
+            with pytest.raises(ModelHostError):
+                host.step()
+
+            # the worker survives an exception in the model
+            assert host.is_alive()
+        finally:
+            host.stop()
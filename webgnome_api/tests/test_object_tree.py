@@ -0,0 +1,208 @@
+"""
+Unit tests for the processing of nested object payloads
+"""
+from webgnome_api.common.helpers import class_registry
+import pytest
+
+from webgnome_api.common.common_object import (ProcessJsonObjectTree,
+                                               _CreateObject,
+                                               PatchObject,
+                                               PatchFieldError,
+                                               SerializeFields)
+
+
+class Thing(object):
+    _id = 0
+
+    def __init__(self, name, **kwargs):
+        Thing._id += 1
+        self.id = 'thing-{0}'.format(Thing._id)
+        self.name = name
+        self.children = kwargs
+
+    @classmethod
+    def new_from_dict(cls, payload):
+        kwargs = dict([(k, v) for k, v in payload.items()
+                       if k not in ('obj_type', 'name')])
+
+        return cls(payload['name'], **kwargs)
+
+
+class TestProcessJsonObjectTree(object):
+    def setup_method(self, method):
+        self.payload = {'obj_type': 'Thing',
+                        'name': 'model',
+                        'movers': [{'obj_type': 'Thing', 'name': 'mover1'},
+                                   {'obj_type': 'Thing', 'name': 'mover2',
+                                    'wind': {'obj_type': 'Thing',
+                                             'name': 'wind'}}],
+                        'map': {'obj_type': 'Thing', 'name': 'map'},
+                        'bounds': {'west': -70.0, 'east': -69.0}}
+
+    def test_order(self):
+        processed = []
+
+        def process(payload, parent, attr_name, all_objects):
+            processed.append(payload['name'] if 'name' in payload
+                             else 'bounds')
+
+            return payload
+
+        ProcessJsonObjectTree(process, self.payload, {})
+
+        # every payload once, children before their parents
+        assert sorted(processed) == sorted(['model', 'mover1', 'mover2',
+                                            'wind', 'map', 'bounds'])
+        assert processed[-1] == 'model'
+        assert processed.index('wind') < processed.index('mover2')
+        assert processed.index('mover1') < processed.index('mover2')
+
+    def test_create(self, monkeypatch):
+        monkeypatch.setattr(class_registry, 'get_class',
+                            lambda obj_type: Thing)
+
+        all_objects = {}
+        existing = Thing('existing map')
+        all_objects[existing.id] = existing
+        self.payload['map'] = {'obj_type': 'Thing', 'id': existing.id}
+
+        model = ProcessJsonObjectTree(_CreateObject, self.payload,
+                                      all_objects)
+
+        assert model.name == 'model'
+        assert model.children['map'] is existing
+
+        mover2 = model.children['movers'][1]
+        assert mover2.name == 'mover2'
+        assert mover2.children['wind'].name == 'wind'
+
+        # a plain dict stays a dict
+        assert model.children['bounds'] == {'west': -70.0, 'east': -69.0}
+
+        assert len(all_objects) == 5
+
+
+class SecondsNode(object):
+    '''
+        A schema node that turns hours into seconds and back.
+    '''
+    name = 'duration'
+    required = False
+
+    def deserialize(self, value):
+        return float(value) * 3600
+
+    def serialize(self, value):
+        return value / 3600
+
+
+class MoverSchema(object):
+    children = [SecondsNode()]
+
+    def get(self, name, default=None):
+        return self.children[0] if name == 'duration' else default
+
+
+class MoverState(object):
+    def get_names(self, attr):
+        return ['name', 'duration', 'wind'] if attr == 'update' else []
+
+
+class Mover(object):
+    _schema = MoverSchema
+    _state = MoverState()
+
+    def __init__(self, obj_id, wind):
+        self.id = obj_id
+        self.name = 'mover'
+        self.duration = 3600
+        self.wind = wind
+
+    @classmethod
+    def deserialize(cls, json_obj):
+        schema = cls._schema()
+
+        return dict([(k, schema.get(k).deserialize(v)
+                      if schema.get(k) is not None else v)
+                     for k, v in json_obj.items()])
+
+    def update_from_dict(self, data):
+        for k, v in data.items():
+            setattr(self, k, v)
+
+    def serialize(self):
+        return {'id': self.id, 'name': self.name}
+
+
+class TestPatchObject(object):
+    def setup_method(self, method):
+        self.wind = Mover('wind', None)
+        self.mover = Mover('mover', self.wind)
+        self.all_objects = {'wind': self.wind, 'mover': self.mover}
+
+    def test_patch(self):
+        apply_patch = PatchObject(self.mover,
+                                  {'id': 'mover', 'json_': 'webapi',
+                                   'duration': 2,
+                                   'wind': {'id': 'wind', 'name': 'new wind'}},
+                                  self.all_objects)
+
+        # nothing is changed until the patch is applied
+        assert self.mover.duration == 3600
+        assert self.wind.name == 'mover'
+
+        names = apply_patch()
+
+        assert sorted(names) == ['duration', 'wind']
+        assert self.mover.duration == 7200
+        assert self.mover.name == 'mover'
+
+        # the nested object is patched, not replaced
+        assert self.mover.wind is self.wind
+        assert self.wind.name == 'new wind'
+
+    def test_patch_bad_field(self):
+        with pytest.raises(PatchFieldError):
+            PatchObject(self.mover,
+                        {'duration': 2,
+                         'wind': {'id': 'wind', 'name': 'new wind',
+                                  'bogus': 1}},
+                        self.all_objects)
+
+        # nothing has been applied
+        assert self.mover.duration == 3600
+        assert self.wind.name == 'mover'
+        assert not hasattr(self.wind, 'bogus')
+
+    def test_patch_bad_value(self):
+        with pytest.raises(ValueError):
+            PatchObject(self.mover,
+                        {'wind': {'id': 'wind', 'name': 'new wind'},
+                         'duration': 'forever'},
+                        self.all_objects)
+
+        # the nested object has not been patched
+        assert self.wind.name == 'mover'
+        assert self.mover.duration == 3600
+
+    def test_patch_bad_value_new_object(self, monkeypatch):
+        monkeypatch.setattr(class_registry, 'get_class',
+                            lambda obj_type: Mover)
+
+        with pytest.raises(ValueError):
+            PatchObject(self.mover,
+                        {'wind': {'obj_type': 'Mover', 'name': 'new wind'},
+                         'duration': 'forever'},
+                        self.all_objects)
+
+        # the new object has not been created
+        assert self.mover.wind is self.wind
+        assert sorted(self.all_objects.keys()) == ['mover', 'wind']
+
+    def test_serialize_fields(self):
+        json_obj = SerializeFields(self.mover, ['duration', 'wind'])
+
+        assert json_obj == {'id': 'mover',
+                            'obj_type': '{0}.Mover'.format(__name__),
+                            'duration': 1,
+                            'wind': {'id': 'wind', 'name': 'mover'}}
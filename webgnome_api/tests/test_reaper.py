@@ -0,0 +1,56 @@
+"""
+Unit tests for the expired session reaper
+"""
+from webgnome_api.common.reaper import SessionReaper
+
+
+class TestSessionReaper(object):
+    def setup_method(self, method):
+        self.known = set(['s1', 's2', 's3'])
+        self.live = set(['s1'])
+        self.busy = set()
+        self.reaped = []
+
+        self.reaper = SessionReaper(60,
+                                    lambda: self.known,
+                                    self.live_session_ids,
+                                    self.reap_session)
+
+    def live_session_ids(self, session_ids):
+        return [s for s in session_ids if s in self.live]
+
+    def reap_session(self, session_id):
+        if session_id in self.busy:
+            return False
+
+        self.reaped.append(session_id)
+        self.known.discard(session_id)
+
+    def test_reap_after_two_rounds(self):
+        # the first time a session is found dead, it is only a suspect
+        assert self.reaper.reap() == []
+
+        assert sorted(self.reaper.reap()) == ['s2', 's3']
+        assert sorted(self.reaped) == ['s2', 's3']
+        assert self.known == set(['s1'])
+
+    def test_session_comes_alive(self):
+        self.reaper.reap()
+
+        self.live.add('s2')
+        assert self.reaper.reap() == ['s3']
+
+    def test_busy_session(self):
+        self.busy.add('s2')
+
+        self.reaper.reap()
+        assert self.reaper.reap() == ['s3']
+
+        self.busy.clear()
+        assert self.reaper.reap() == ['s2']
+
+    def test_no_live_sessions_info(self):
+        self.reaper.live_session_ids = lambda session_ids: None
+
+        self.reaper.reap()
+        assert self.reaper.reap() == []
@@ -0,0 +1,152 @@
+"""
+Unit tests for the registration of our model objects
+"""
+from gnome.model import Model as GnomeModel
+
+from webgnome_api.common.common_object import (RegisterObject,
+                                               AttributePlan,
+                                               _leaf_types,
+                                               _container_types)
+
+from base import FunctionalTestBase
+
+
+def dir_walk_ids(obj):
+    '''
+        The ids of the objects reached by walking the public attributes
+        that dir() finds on each object, which is how we used to look
+        for the objects to register.
+    '''
+    ids = set()
+    visited = set()
+    todo = [obj]
+
+    while todo:
+        o = todo.pop()
+
+        if id(o) in visited:
+            continue
+
+        visited.add(id(o))
+
+        if hasattr(o, 'id') and not isinstance(o, type):
+            ids.add(o.id)
+
+        if isinstance(o, _container_types):
+            todo.extend(o)
+        elif hasattr(o, '__dict__'):
+            for k in dir(o):
+                if k.startswith('_'):
+                    continue
+
+                attr = getattr(o, k)
+                if not isinstance(attr, _leaf_types):
+                    todo.append(attr)
+
+    return ids
+
+
+class Wind(object):
+    def __init__(self, obj_id):
+        self.id = obj_id
+        self.name = 'wind'
+        self.filename = 'wind.txt'
+
+
+class Mover(object):
+    units = 'm/s'
+
+    def __init__(self, obj_id, wind):
+        self.id = obj_id
+        self.name = 'mover'
+        self._wind = wind
+        self.model = None
+
+        # not part of what we save, but still one of our objects
+        self.scratch = Wind('scratch-' + obj_id)
+
+    @property
+    def wind(self):
+        return self._wind
+
+    def get_move(self):
+        pass
+
+
+class Model(object):
+    def __init__(self, obj_id, movers, environment):
+        self.id = obj_id
+        self.name = 'model'
+        self.movers = movers
+        self.environment = environment
+
+
+class Registry(object):
+    def __init__(self):
+        self.settings = {'objects': {},
+                         'session_evictor': None}
+
+
+class Session(object):
+    session_id = 'session-1'
+
+
+class Request(object):
+    def __init__(self):
+        self.registry = Registry()
+        self.session = Session()
+
+
+class TestRegisterObject(object):
+    def setup_method(self, method):
+        self.wind = Wind('wind-1')
+        self.movers = [Mover('mover-1', self.wind),
+                       Mover('mover-2', self.wind)]
+        self.model = Model('model-1', self.movers, [self.wind])
+
+        # movers refer back to their model
+        for m in self.movers:
+            m.model = self.model
+
+        self.request = Request()
+
+    def registered(self):
+        return self.request.registry.settings['objects']['session-1']
+
+    def test_attribute_plan(self):
+        assert AttributePlan(Wind) == frozenset()
+        assert AttributePlan(Mover) == frozenset(['wind'])
+
+    def test_register(self):
+        num_registered = RegisterObject(self.model, self.request)
+
+        assert num_registered == 6
+        assert set(self.registered().keys()) == set(['model-1', 'mover-1',
+                                                     'mover-2', 'wind-1',
+                                                     'scratch-mover-1',
+                                                     'scratch-mover-2'])
+        assert self.registered()['wind-1'] is self.wind
+
+    def test_same_as_dir_walk(self):
+        RegisterObject(self.movers[0], self.request)
+
+        assert set(self.registered().keys()) == dir_walk_ids(self.movers[0])
+
+    def test_gnome_model(self):
+        model = GnomeModel()
+
+        RegisterObject(model, self.request)
+
+        assert model.id in self.registered()
+        assert set(self.registered().keys()) == dir_walk_ids(model)
+
+
+class LocationRegisterTest(FunctionalTestBase):
+    def test_location_model(self):
+        self.testapp.get('/location/central-long-island-sound')
+        model_id = self.testapp.get('/model').json_body['id']
+
+        objects = self.testapp.app.registry.settings['objects'].values()[0]
+        model = objects[model_id]
+
+        assert dir_walk_ids(model) <= set(objects.keys())
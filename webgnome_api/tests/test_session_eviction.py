@@ -0,0 +1,160 @@
+"""
+Unit tests for the eviction of idle sessions to disk
+"""
+import os
+import shutil
+import tempfile
+from threading import Lock, Thread
+
+from webgnome_api.common.locks import SessionLockManager
+from webgnome_api.common.session_eviction import SessionEvictor
+
+
+class Thing(object):
+    def __init__(self, id, child=None):
+        self.id = id
+        self.child = child
+
+
+class AccessedWhilePickled(object):
+    '''
+        Gets its session's pool from the evictor while being pickled, like
+        a request of the session that comes in during the eviction.
+    '''
+    def __init__(self, evictor, session_id):
+        self.evictor = evictor
+        self.session_id = session_id
+
+    def __getstate__(self):
+        self.evictor.get_pool(self.session_id)
+
+        return {}
+
+
+class TestSessionEvictor(object):
+    def setup_method(self, method):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.obj_pool = {}
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.snapshot_dir)
+
+    def add_session(self, evictor, session_id):
+        child = Thing('{0}-child'.format(session_id))
+
+        self.obj_pool[session_id] = {child.id: child,
+                                     session_id: Thing(session_id, child)}
+        evictor.ensure_resident(session_id)
+
+    def test_evict_and_reload(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10)
+        self.add_session(evictor, 's1')
+
+        assert evictor.evict('s1')
+        assert 's1' not in self.obj_pool
+        assert evictor.is_evicted('s1')
+
+        assert evictor.ensure_resident('s1')
+        assert not evictor.is_evicted('s1')
+
+        # the references between the objects survive
+        objects = self.obj_pool['s1']
+        assert objects['s1'].child is objects['s1-child']
+
+        # already resident
+        assert not evictor.ensure_resident('s1')
+
+    def test_get_pool(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10)
+        self.add_session(evictor, 's1')
+
+        assert evictor.evict('s1')
+
+        # a missing pool with a snapshot is reloaded, not started over
+        pool, reloaded = evictor.get_pool('s1')
+        assert reloaded
+        assert sorted(pool.keys()) == ['s1', 's1-child']
+        assert self.obj_pool['s1'] is pool
+
+        pool, reloaded = evictor.get_pool('s2')
+        assert not reloaded
+        assert pool == {}
+        assert self.obj_pool['s2'] is pool
+
+    def test_busy_session(self):
+        session_locks = SessionLockManager()
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10,
+                                 session_locks=session_locks)
+        self.add_session(evictor, 's1')
+
+        with session_locks.get_lock('s1'):
+            result = []
+
+            t = Thread(target=lambda: result.append(evictor.evict('s1')))
+            t.start()
+            t.join()
+
+            assert result == [False]
+            assert 's1' in self.obj_pool
+
+        assert evictor.evict('s1')
+
+    def test_accessed_while_pickled(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10)
+        self.add_session(evictor, 's1')
+        self.obj_pool['s1']['x'] = AccessedWhilePickled(evictor, 's1')
+
+        assert not evictor.evict('s1')
+        assert 's1' in self.obj_pool
+        assert os.listdir(self.snapshot_dir) == []
+
+    def test_idle_candidates(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10)
+        self.add_session(evictor, 's1')
+        self.add_session(evictor, 's2')
+
+        assert evictor.eviction_candidates() == []
+
+        later = evictor._last_access['s2'] + 11
+        candidates = evictor.eviction_candidates(now=later)
+        assert sorted([s for s, _t in candidates]) == ['s1', 's2']
+
+        candidates = evictor.eviction_candidates(now=later, exclude=('s1',))
+        assert [s for s, _t in candidates] == ['s2']
+
+    def test_max_resident(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 0,
+                                 max_resident=2)
+        for s in ('s1', 's2', 's3'):
+            self.add_session(evictor, s)
+
+        evictor._last_access['s1'] += 5
+
+        # only the least recently used one
+        assert [s for s, _t in evictor.eviction_candidates()] == ['s2']
+
+    def test_accessed_since_candidate(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10)
+        self.add_session(evictor, 's1')
+
+        last_access = evictor._last_access['s1'] - 1
+
+        assert not evictor.evict('s1', last_access)
+        assert 's1' in self.obj_pool
+
+    def test_unpicklable_pool_stays_resident(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10)
+        self.obj_pool['s1'] = {'lock': Lock()}
+
+        assert not evictor.evict('s1')
+        assert 's1' in self.obj_pool
+        assert os.listdir(self.snapshot_dir) == []
+
+    def test_check_due(self):
+        evictor = SessionEvictor(self.obj_pool, self.snapshot_dir, 10,
+                                 check_interval=60)
+        now = evictor._last_check
+
+        assert not evictor.check_due(now + 30)
+        assert evictor.check_due(now + 61)
+        assert not evictor.check_due(now + 62)
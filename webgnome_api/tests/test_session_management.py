@@ -0,0 +1,207 @@
+"""
+Unit tests for our session resource management
+"""
+import time
+import shutil
+import tempfile
+from threading import Thread
+
+from gnome.model import Model as GnomeModel
+
+from webgnome_api.common.locks import SessionLockManager
+from webgnome_api.common.session_eviction import SessionEvictor
+from webgnome_api.common.session_management import (set_uncertain_models,
+                                                    get_uncertain_models,
+                                                    evict_sessions,
+                                                    object_pool_size,
+                                                    update_object_sizes)
+
+
+def run_in_thread(func):
+    result = []
+
+    t = Thread(target=lambda: result.append(func()))
+    t.start()
+    t.join()
+
+    return result[0]
+
+
+class Model(object):
+    def __init__(self, obj_id):
+        self.id = obj_id
+        self.weatherers = []
+
+
+class Ensemble(object):
+    def __init__(self):
+        self.commands = []
+        self.stopped = False
+
+    def cmd(self, command, args):
+        self.commands.append(command)
+
+    def stop(self):
+        self.stopped = True
+
+
+class DeadEnsemble(Ensemble):
+    '''
+        An ensemble one of whose processes has died.
+    '''
+    def cmd(self, command, args):
+        raise EOFError('uncertainty process has died')
+
+    def stop(self):
+        raise EOFError('uncertainty process has died')
+
+
+class Pool(object):
+    def __init__(self):
+        self.ensembles = []
+
+    def start_ensemble(self, model, wind_speed_uncertainties,
+                       spill_amount_uncertainties):
+        self.ensembles.append(Ensemble())
+
+        return self.ensembles[-1]
+
+
+class Registry(object):
+    def __init__(self):
+        self.settings = {'objects': {},
+                         'session_evictor': None,
+                         'session_locks': SessionLockManager(),
+                         'uncertain_models': {},
+                         'uncertain_model_configs': {},
+                         'uncertainty_pool': Pool()}
+
+
+class Session(dict):
+    session_id = 'session-1'
+
+
+class Request(object):
+    def __init__(self):
+        self.registry = Registry()
+        self.session = Session(active_model='model-1')
+
+        self.registry.settings['objects']['session-1'] = {
+            'model-1': Model('model-1')
+        }
+
+
+class TestSetUncertainModels(object):
+    def setup_method(self, method):
+        self.request = Request()
+        self.pool = self.request.registry.settings['uncertainty_pool']
+
+    def test_reuse(self):
+        set_uncertain_models(self.request)
+        ensemble = get_uncertain_models(self.request)
+
+        set_uncertain_models(self.request)
+
+        assert get_uncertain_models(self.request) is ensemble
+        assert ensemble.commands == ['rewind']
+        assert len(self.pool.ensembles) == 1
+
+    def test_dead_ensemble(self):
+        set_uncertain_models(self.request)
+
+        dead = DeadEnsemble()
+        self.request.registry.settings['uncertain_models']['session-1'] = dead
+
+        set_uncertain_models(self.request)
+
+        # we start over with a new ensemble instead of failing the step
+        assert get_uncertain_models(self.request) is self.pool.ensembles[-1]
+        assert len(self.pool.ensembles) == 2
+
+
+class TestEvictSessions(object):
+    def setup_method(self, method):
+        self.snapshot_dir = tempfile.mkdtemp()
+
+        self.settings = {'objects': {},
+                         'session_locks': SessionLockManager(),
+                         'run_jobs': {},
+                         'model_hosts': {},
+                         'step_prefetchers': {},
+                         'uncertain_models': {},
+                         'uncertain_model_configs': {},
+                         'serialized_objects': {},
+                         'object_sizes': {}}
+        self.settings['session_evictor'] = SessionEvictor(
+            self.settings['objects'], self.snapshot_dir, 0, 1,
+            session_locks=self.settings['session_locks']
+        )
+
+        self.model = GnomeModel()
+        self.settings['objects']['session-1'] = {'model-1': self.model}
+        self.settings['session_evictor'].ensure_resident('session-1')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.snapshot_dir)
+
+    def evict_and_reload(self):
+        evictor = self.settings['session_evictor']
+
+        evict_sessions(self.settings, [('session-1', time.time())])
+        evicted = evictor.is_evicted('session-1')
+
+        return evicted, evictor.get_pool('session-1')[0]['model-1']
+
+    def test_evict_rewound(self):
+        evicted, model = self.evict_and_reload()
+
+        assert evicted
+        assert model.current_time_step == -1
+
+    def test_evict_mid_run(self):
+        self.model.step()
+        self.model.step()
+
+        evicted, model = self.evict_and_reload()
+
+        # the run goes on where the client left it
+        assert not evicted
+        assert model.current_time_step == 1
+
+
+class TestObjectSizes(object):
+    def setup_method(self, method):
+        self.settings = {'objects': {'session-1': {'a': 'x' * 1000}},
+                         'session_locks': SessionLockManager(),
+                         'object_sizes': {}}
+
+    def test_estimate_kept_until_update(self):
+        objects = self.settings['objects']['session-1']
+        size = object_pool_size(self.settings, 'session-1', objects)
+
+        objects['b'] = 'y' * 100000
+        self.settings['session_locks'].get_lock('session-1').changed()
+
+        # the request path doesn't walk the pool again
+        assert object_pool_size(self.settings, 'session-1', objects) == size
+
+        update_object_sizes(self.settings)
+
+        assert object_pool_size(self.settings, 'session-1', objects) > size
+
+    def test_busy_session_left_alone(self):
+        objects = self.settings['objects']['session-1']
+        size = object_pool_size(self.settings, 'session-1', objects)
+
+        objects['b'] = 'y' * 100000
+        session_lock = self.settings['session_locks'].get_lock('session-1')
+
+        with session_lock:
+            session_lock.changed()
+            run_in_thread(lambda: update_object_sizes(self.settings))
+
+        assert object_pool_size(self.settings, 'session-1', objects) == size
+
+        update_object_sizes(self.settings)
+
+        assert object_pool_size(self.settings, 'session-1', objects) > size
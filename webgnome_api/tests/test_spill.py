@@ -89,6 +89,35 @@ class SpillTests(FunctionalTestBase):
         for k in self.fields_to_check:
             assert resp2.json_body[k] == resp1.json_body[k]
 
+    def test_patch_valid_id(self):
+        rel_obj = self.create_release_obj(self.rel_req_data)
+        init_obj = self.create_init_obj(self.init_req_data)
+        elem_type_obj = self.create_elem_type_obj(self.elem_type_req_data,
+                                                  init_obj)
+        self.req_data['release'] = rel_obj
+        self.req_data['element_type'] = elem_type_obj
+
+        resp1 = self.testapp.post_json('/spill', params=self.req_data)
+        obj_id = resp1.json_body['id']
+
+        resp2 = self.testapp.patch_json('/spill',
+                                        params={'id': obj_id,
+                                                'name': 'Another Name'})
+
+        assert resp2.json_body == {'id': obj_id,
+                                   'obj_type': resp1.json_body['obj_type'],
+                                   'name': 'Another Name'}
+
+        resp3 = self.testapp.get('/spill/{0}'.format(obj_id))
+
+        assert resp3.json_body['name'] == 'Another Name'
+        assert resp3.json_body['release'] == resp1.json_body['release']
+
+    def test_patch_invalid_id(self):
+        self.testapp.patch_json('/spill', params={'id': 'nothing',
+                                                  'name': 'Another Name'},
+                                status=404)
+
     def test_post_no_payload(self):
         self.testapp.post_json('/spill', status=400)
 
@@ -1,10 +1,21 @@
 """
 Functional tests for the Gnome Location object Web API
 """
+import os
+import time
+import signal
 import datetime
 import dateutil.parser
+import ujson
 
 import pytest
+from webob import Request
+
+from webgnome_api.common.gzip_filter import make_gzip_filter
+
+from webtest import TestApp
+
+from webgnome_api import main
 
 from base import FunctionalTestBase
 
@@ -583,6 +594,9 @@ class StepTest(FunctionalTestBase):
                           if isinstance(v, dict)]
         assert len(weathering_out) == 12
 
+        uncertain_models = (self.testapp.app.registry
+                            .settings['uncertain_models'].values())
+
         resp = self.testapp.get('/rewind')
         rewind_response = resp.json_body
         assert rewind_response is None
@@ -596,6 +610,10 @@ class StepTest(FunctionalTestBase):
                           if isinstance(v, dict)]
         assert len(weathering_out) == 12
 
+        # the unchanged model should have reused its uncertainty models
+        assert (self.testapp.app.registry.settings['uncertain_models']
+                .values() == uncertain_models)
+
     def test_current_output_step(self):
         # We are testing our ability to generate the first step in a
         # weathering model run
@@ -835,6 +853,44 @@ class StepTest(FunctionalTestBase):
 
         assert first_step['step_num'] == 0
 
+    @pytest.mark.slow
+    def test_update_model_performance(self):
+        # We are timing the update of a full model payload, which is
+        # deserialized and turned into objects in a single pass.
+        self.testapp.get('/location/new-york-harbor')
+
+        resp = self.testapp.get('/model')
+        model1 = resp.json_body
+
+        model1['spills'] = [self.spill_data]
+        model1['environment'].append(self.wind_data)
+        model1['environment'].append(self.water_data)
+        model1['outputters'] = [self.geojson_output_data,
+                                self.weathering_output_data]
+
+        begin = time.time()
+        resp = self.testapp.put_json('/model', params=model1)
+        create_time = time.time() - begin
+
+        model1 = resp.json_body
+
+        assert 'id' in model1['spills'][0]
+        assert 'id' in model1['outputters'][0]
+
+        # nothing new, so only existing objects are updated
+        update_times = []
+        for _i in range(10):
+            begin = time.time()
+            resp = self.testapp.put_json('/model', params=model1)
+            update_times.append(time.time() - begin)
+
+            assert resp.json_body['id'] == model1['id']
+
+        print ('test_update_model_performance(): '
+               'create: {0:.3f}s, update: min {1:.3f}s, mean {2:.3f}s'
+               .format(create_time, min(update_times),
+                       sum(update_times) / len(update_times)))
+
     @pytest.mark.slow
     def test_all_steps(self):
         # We are testing our ability to generate the first step in a model run
@@ -1058,3 +1114,213 @@ class StepTest(FunctionalTestBase):
         assert 'nominal' in step['WeatheringOutput']
         assert 'skimmed' in step['WeatheringOutput']['nominal']
         assert step['WeatheringOutput']['nominal']['skimmed'] == skimmed_amt
+
+    def create_full_run_model(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.get('/model')
+        model1 = resp.json_body
+
+        model1['time_step'] = 900
+        resp = self.testapp.put_json('/model', params=model1)
+        model1 = resp.json_body
+
+        resp = self.testapp.post_json('/spill', params=self.spill_data)
+        model1['spills'] = [resp.json_body]
+        model1['outputters'] = [self.geojson_output_data,
+                                self.weathering_output_data]
+
+        resp = self.testapp.put_json('/model', params=model1)
+
+        return resp.json_body
+
+    @pytest.mark.slow
+    def test_full_run_stream(self):
+        '''
+            Testing the streaming full_run api
+        '''
+        model1 = self.create_full_run_model()
+        num_time_steps = model1['num_time_steps']
+
+        resp = self.testapp.get('/full_run_without_response/stream')
+        assert resp.content_type == 'application/x-ndjson'
+
+        steps = [ujson.loads(l) for l in resp.body.splitlines()]
+
+        assert len(steps) == num_time_steps
+        for s, step in enumerate(steps):
+            assert 'error' not in step
+            assert step['step_num'] == s
+            assert 'nominal' in step['WeatheringOutput']
+            assert 'low' in step['WeatheringOutput']
+            assert 'high' in step['WeatheringOutput']
+
+    @pytest.mark.slow
+    def test_full_run_stream_gzip(self):
+        '''
+            The streaming full_run api sends each step as soon as it has
+            been computed, even through our gzip filter.
+        '''
+        self.create_full_run_model()
+
+        stream_path = '/full_run_without_response/stream'
+        app = make_gzip_filter({}, unbuffered_paths=stream_path)(
+            self.testapp.app
+        )
+
+        cookie = '; '.join(['{0}={1}'.format(k, v)
+                            for k, v in self.testapp.cookies.items()])
+        req = Request.blank(stream_path, headers={'Accept-Encoding': 'gzip',
+                                                  'Cookie': cookie})
+
+        _status, _headers, app_iter = req.call_application(app)
+        try:
+            first_chunk = next(iter(app_iter))
+        finally:
+            # stops the run
+            app_iter.close()
+
+        # a buffered response would have come as one chunk with every step
+        assert first_chunk.count('\n') == 1
+        assert ujson.loads(first_chunk)['step_num'] == 0
+
+    @pytest.mark.slow
+    def test_step_batch(self):
+        '''
+            Testing the retrieval of multiple steps with one request
+        '''
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.get('/model')
+        model1 = resp.json_body
+
+        model1['time_step'] = 900
+        resp = self.testapp.put_json('/model', params=model1)
+        model1 = resp.json_body
+
+        resp = self.testapp.post_json('/spill', params=self.spill_data)
+        model1['spills'] = [resp.json_body]
+        model1['outputters'] = [self.weathering_output_data]
+
+        resp = self.testapp.put_json('/model', params=model1)
+        model1 = resp.json_body
+
+        num_time_steps = model1['num_time_steps']
+        start_time = dateutil.parser.parse(model1['start_time'])
+
+        self.testapp.get('/step?count=0', status=400)
+        self.testapp.get('/step?count=bogus', status=400)
+
+        resp = self.testapp.get('/step?count=3')
+        assert [s['step_num'] for s in resp.json_body] == [0, 1, 2]
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 3
+
+        until = start_time + datetime.timedelta(seconds=900 * 6)
+        resp = self.testapp.get('/step?until={0}'.format(until.isoformat()))
+        assert [s['step_num'] for s in resp.json_body] == [4, 5, 6]
+
+        # we are already there
+        resp = self.testapp.get('/step?until={0}'.format(until.isoformat()))
+        assert resp.json_body == []
+
+        self.testapp.get('/step', params={'until': until.isoformat() + 'Z'},
+                         status=400)
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 7
+
+        # a batch is cut short at the end of the run
+        resp = self.testapp.get('/step?count={0}'.format(num_time_steps))
+        steps = resp.json_body
+
+        assert steps[0]['step_num'] == 8
+        assert steps[-1]['step_num'] == num_time_steps - 1
+
+        self.testapp.get('/step?count=3', status=404)
+
+
+class HostedStepTest(FunctionalTestBase):
+    '''
+        Steps through a model that is hosted in a worker process.
+    '''
+    def setUp(self):
+        super(HostedStepTest, self).setUp()
+        self.cleanup_web_app_upon_shutdown()
+
+        self.settings['model_host.enabled'] = 'true'
+        self.testapp = TestApp(main(None, **self.settings))
+
+    @pytest.mark.slow
+    def test_host_died(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 0
+
+        model_hosts = self.testapp.app.registry.settings['model_hosts']
+        model_host = model_hosts.values()[0]
+
+        os.kill(model_host.pid, signal.SIGKILL)
+        model_host._process.join(5)
+
+        # a new host would start the run over, so we need to rewind
+        self.testapp.get('/step', status=422)
+        self.testapp.get('/step', status=422)
+
+        self.testapp.get('/rewind')
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 0
+
+
+class PrefetchedStepTest(FunctionalTestBase):
+    '''
+        Steps through a model whose next steps are prefetched in the
+        background.
+    '''
+    def setUp(self):
+        super(PrefetchedStepTest, self).setUp()
+        self.cleanup_web_app_upon_shutdown()
+
+        self.settings['step_prefetch.depth'] = '2'
+        self.testapp = TestApp(main(None, **self.settings))
+
+    @pytest.mark.slow
+    def test_patch_resets_run(self):
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 0
+
+        prefetchers = self.testapp.app.registry.settings['step_prefetchers']
+        prefetcher = prefetchers.values()[0]
+
+        end = time.time() + 30
+        while prefetcher.num_ready() == 0 and time.time() < end:
+            time.sleep(0.1)
+
+        # the run got ahead of us, so it has to start over
+        resp = self.testapp.patch_json('/model', params={'name': 'patched'})
+        assert resp.headers['X-Model-Run-Reset'] == 'true'
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 0
+
+    @pytest.mark.slow
+    def test_patch_keeps_run(self):
+        self.settings['step_prefetch.depth'] = '0'
+        self.testapp = TestApp(main(None, **self.settings))
+
+        self.testapp.get('/location/central-long-island-sound')
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 0
+
+        # nothing got ahead of us, so the run goes on
+        resp = self.testapp.patch_json('/model', params={'name': 'patched'})
+        assert 'X-Model-Run-Reset' not in resp.headers
+
+        resp = self.testapp.get('/step')
+        assert resp.json_body['step_num'] == 1
@@ -0,0 +1,152 @@
+"""
+Unit tests for the background step prefetching
+"""
+import time
+from threading import RLock, Event, Thread
+
+import pytest
+
+from webgnome_api.common.locks import ReadWriteLock
+from webgnome_api.common.step_prefetch import StepPrefetcher
+
+
+class StepCounter(object):
+    def __init__(self, num_steps):
+        self.num_steps = num_steps
+        self.step_num = -1
+
+    def __call__(self):
+        if self.step_num + 1 >= self.num_steps:
+            raise StopIteration
+
+        self.step_num += 1
+        return {'step_num': self.step_num}
+
+
+def wait_for(prefetcher, num_ready, timeout=5.0):
+    end = time.time() + timeout
+
+    while prefetcher.num_ready() < num_ready and time.time() < end:
+        time.sleep(0.01)
+
+
+class BlockingStep(object):
+    '''
+        A step function that doesn't return until we let it.
+    '''
+    def __init__(self):
+        self.started = Event()
+        self.finish = Event()
+
+    def __call__(self):
+        self.started.set()
+        self.finish.wait(5)
+
+        return {'step_num': 0}
+
+
+def run_in_thread(func):
+    result = []
+
+    t = Thread(target=lambda: result.append(func()))
+    t.start()
+    t.join()
+
+    return result[0]
+
+
+def can_share(lock):
+    def share():
+        if not lock.acquire_shared(False):
+            return False
+
+        lock.release_shared()
+        return True
+
+    return run_in_thread(share)
+
+
+class TestStepPrefetcher(object):
+    def test_steps_in_order(self):
+        prefetcher = StepPrefetcher(RLock(), StepCounter(10), 3)
+
+        assert prefetcher.next_step() is None
+
+        prefetcher.fill()
+        wait_for(prefetcher, 3)
+        assert prefetcher.num_ready() == 3
+
+        assert [prefetcher.next_step()['step_num']
+                for _i in range(3)] == [0, 1, 2]
+
+        prefetcher.fill()
+        wait_for(prefetcher, 3)
+        assert prefetcher.next_step()['step_num'] == 3
+
+    def test_end_of_run(self):
+        prefetcher = StepPrefetcher(RLock(), StepCounter(2), 5)
+
+        prefetcher.fill()
+        wait_for(prefetcher, 3)
+
+        assert prefetcher.next_step()['step_num'] == 0
+        assert prefetcher.next_step()['step_num'] == 1
+
+        with pytest.raises(StopIteration):
+            prefetcher.next_step()
+
+    def test_waits_for_session_lock(self):
+        session_lock = RLock()
+        prefetcher = StepPrefetcher(session_lock, StepCounter(10), 3)
+
+        with session_lock:
+            prefetcher.fill()
+            time.sleep(0.1)
+
+            assert prefetcher.num_ready() == 0
+
+        wait_for(prefetcher, 3)
+        assert prefetcher.num_ready() == 3
+
+    def test_invalidate(self):
+        prefetcher = StepPrefetcher(RLock(), StepCounter(10), 3)
+
+        prefetcher.fill()
+        wait_for(prefetcher, 3)
+
+        assert prefetcher.invalidate() == 3
+        assert prefetcher.next_step() is None
+
+    def test_reads_wait_for_step(self):
+        # a model in our own process is stepped under the session lock
+        session_lock = ReadWriteLock()
+        step = BlockingStep()
+        prefetcher = StepPrefetcher(session_lock, step, 1)
+
+        prefetcher.fill()
+        assert step.started.wait(5)
+
+        assert not can_share(session_lock)
+
+        step.finish.set()
+        wait_for(prefetcher, 1)
+
+        assert can_share(session_lock)
+
+    def test_hosted_reads_do_not_wait(self):
+        # a hosted model is stepped under the lock of its host
+        session_lock = ReadWriteLock()
+        host_lock = RLock()
+        step = BlockingStep()
+        prefetcher = StepPrefetcher(host_lock, step, 1)
+
+        prefetcher.fill()
+        assert step.started.wait(5)
+
+        assert can_share(session_lock)
+
+        # but anyone else stepping the host waits for the step
+        assert not run_in_thread(lambda: host_lock.acquire(False))
+
+        step.finish.set()
+        wait_for(prefetcher, 1)
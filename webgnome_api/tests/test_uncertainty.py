@@ -0,0 +1,114 @@
+"""
+Unit tests for the uncertainty ensemble aggregation
+"""
+import pytest
+
+from webgnome_api.common.uncertainty import (aggregate_weathering_output,
+                                             aggregate_weathering_series)
+from webgnome_api.common.model_run import add_weathering_uncertainty
+
+
+def weathering_output(time_stamp, **kwargs):
+    kwargs['time_stamp'] = time_stamp
+    return kwargs
+
+
+class TestAggregateWeatheringOutput(object):
+    nominal = weathering_output('2016-01-01T00:00:00',
+                                evaporated=2.0, floating=8.0)
+    ensemble = [weathering_output('2016-01-01T00:00:00',
+                                  evaporated=v, floating=10.0 - v)
+                for v in (1.0, 2.0, 3.0, 4.0, 5.0)]
+
+    def test_low_high_mean(self):
+        output = aggregate_weathering_output(self.nominal, self.ensemble)
+
+        assert output['time_stamp'] == self.nominal['time_stamp']
+        assert output['nominal'] == self.nominal
+
+        assert output['low']['evaporated'] == 1.0
+        assert output['high']['evaporated'] == 5.0
+        assert output['mean']['evaporated'] == 3.0
+
+        assert output['low']['floating'] == 5.0
+        assert output['high']['floating'] == 9.0
+
+        assert output['low']['time_stamp'] == self.nominal['time_stamp']
+        assert output['high']['time_stamp'] == self.nominal['time_stamp']
+
+        assert 'percentiles' not in output
+
+        for idx, member in enumerate(self.ensemble):
+            assert output[idx] == member
+
+    def test_percentiles(self):
+        output = aggregate_weathering_output(self.nominal, self.ensemble,
+                                             (25, 50, 75))
+
+        assert sorted(output['percentiles'].keys()) == ['25', '50', '75']
+        assert output['percentiles']['25']['evaporated'] == 2.0
+        assert output['percentiles']['50']['evaporated'] == 3.0
+        assert output['percentiles']['75']['evaporated'] == 4.0
+
+    def test_missing_keys(self):
+        ensemble = [weathering_output('t', evaporated=1.0),
+                    weathering_output('t', evaporated=3.0, skimmed=2.0)]
+
+        output = aggregate_weathering_output(weathering_output('t'), ensemble)
+
+        assert output['low'] == {'time_stamp': 't',
+                                 'evaporated': 1.0,
+                                 'skimmed': 2.0}
+        assert output['high']['evaporated'] == 3.0
+        assert output['high']['skimmed'] == 2.0
+
+
+class TestAggregateWeatheringSeries(object):
+    def test_series(self):
+        nominal_series = [weathering_output(t, evaporated=0.0)
+                          for t in ('t0', 't1', 't2')]
+        ensemble_series = [[weathering_output(t, evaporated=s * v)
+                            for v in (1.0, 2.0, 3.0)]
+                           for s, t in enumerate(('t0', 't1', 't2'))]
+
+        series = aggregate_weathering_series(nominal_series, ensemble_series,
+                                             (50,))
+
+        assert [o['time_stamp'] for o in series] == ['t0', 't1', 't2']
+        assert [o['high']['evaporated'] for o in series] == [0.0, 3.0, 6.0]
+        assert [o['low']['evaporated'] for o in series] == [0.0, 1.0, 2.0]
+        assert ([o['percentiles']['50']['evaporated'] for o in series] ==
+                pytest.approx([0.0, 2.0, 4.0]))
+
+
+class TestAddWeatheringUncertainty(object):
+    def step_output(self, t, ensemble):
+        output = {'WeatheringOutput': weathering_output(t, evaporated=0.0)}
+
+        if ensemble is not None:
+            output['_uncertain_steps'] = [
+                {'WeatheringOutput': weathering_output(t, evaporated=v)}
+                for v in ensemble
+            ]
+
+        return output
+
+    def test_batch(self):
+        outputs = [self.step_output('t0', (1.0, 3.0)),
+                   self.step_output('t1', None),
+                   self.step_output('t2', (2.0, 6.0)),
+                   {'step_num': 3}]
+
+        add_weathering_uncertainty(outputs, (50,))
+
+        assert [o['WeatheringOutput']['high']['evaporated']
+                for o in outputs[::2]] == [3.0, 6.0]
+        assert (outputs[2]['WeatheringOutput']['percentiles']['50'] ==
+                {'evaporated': 4.0})
+
+        # a step without uncertainty models only has its nominal output
+        assert outputs[1]['WeatheringOutput']['low'] is None
+        assert outputs[1]['WeatheringOutput']['nominal']['time_stamp'] == 't1'
+
+        # the ensemble output isn't sent along
+        assert not any(['_uncertain_steps' in o for o in outputs])
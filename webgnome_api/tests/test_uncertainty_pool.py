@@ -0,0 +1,120 @@
+"""
+Unit tests for the shared uncertainty worker pool
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from webgnome_api.common.uncertainty_pool import (UncertaintyWorkerPool,
+                                                  UncertaintyPoolError)
+
+
+class CountingModel(object):
+    '''
+        Stands in for a gnome Model.  It saves and loads just its
+        number of time steps.
+    '''
+    def __init__(self, num_time_steps, uncertainty=None):
+        self.num_time_steps = num_time_steps
+        self.uncertainty = uncertainty
+        self.current_time_step = -1
+
+    def save(self, saveloc, name):
+        with open(os.path.join(saveloc, name), 'w') as fh:
+            fh.write(str(self.num_time_steps))
+
+    def step(self):
+        if self.num_time_steps < 0:
+            raise ValueError('bad model')
+
+        if self.current_time_step + 1 >= self.num_time_steps:
+            raise StopIteration
+
+        self.current_time_step += 1
+        return {'step_num': self.current_time_step,
+                'uncertainty': self.uncertainty,
+                'pid': os.getpid()}
+
+    def rewind(self):
+        self.current_time_step = -1
+
+
+def load_counting_model(save_file, wind_speed_uncertainty,
+                        spill_amount_uncertainty):
+    with open(save_file) as fh:
+        return CountingModel(int(fh.read()),
+                             (wind_speed_uncertainty,
+                              spill_amount_uncertainty))
+
+
+class TestUncertaintyWorkerPool(object):
+    def setup_method(self, method):
+        self.ipc_dir = tempfile.mkdtemp()
+        self.pool = UncertaintyWorkerPool(3, self.ipc_dir,
+                                          load_counting_model)
+
+    def teardown_method(self, method):
+        self.pool.stop()
+        shutil.rmtree(self.ipc_dir)
+
+    def test_ensemble_step_and_rewind(self):
+        ensemble = self.pool.start_ensemble(CountingModel(2),
+                                            ('down', 'up'),
+                                            ('down', 'normal', 'up'))
+
+        assert len(ensemble.members) == 6
+        assert self.pool.num_members() == 6
+
+        # the save file is only needed for loading the members
+        assert os.listdir(self.ipc_dir) == []
+
+        steps = ensemble.cmd('step', {})
+        assert [s['step_num'] for s in steps] == [0] * 6
+        assert [s['uncertainty'] for s in steps] == [('down', 'down'),
+                                                     ('down', 'normal'),
+                                                     ('down', 'up'),
+                                                     ('up', 'down'),
+                                                     ('up', 'normal'),
+                                                     ('up', 'up')]
+
+        # the members are spread over all the workers
+        assert len(set([s['pid'] for s in steps])) == 3
+        assert os.getpid() not in [s['pid'] for s in steps]
+
+        ensemble.cmd('step', {})
+        with pytest.raises(StopIteration):
+            ensemble.cmd('step', {})
+
+        ensemble.cmd('rewind', {})
+        assert [s['step_num'] for s in ensemble.cmd('step', {})] == [0] * 6
+
+        ensemble.stop()
+        assert self.pool.num_members() == 0
+
+    def test_ensembles_share_workers(self):
+        first = self.pool.start_ensemble(CountingModel(3), ('up',), ('up',))
+        second = self.pool.start_ensemble(CountingModel(3), ('up',), ('up',))
+
+        # the second ensemble goes to a worker that is not busy
+        assert first.members[0][1] is not second.members[0][1]
+
+        first.cmd('step', {})
+        assert second.cmd('step', {})[0]['step_num'] == 0
+        assert first.cmd('step', {})[0]['step_num'] == 1
+
+        first.stop()
+        second.stop()
+
+    def test_member_error(self):
+        ensemble = self.pool.start_ensemble(CountingModel(-5),
+                                            ('up',), ('up',))
+
+        with pytest.raises(UncertaintyPoolError):
+            ensemble.cmd('step', {})
+
+        # the worker survives an exception in a member model
+        assert all([w.is_alive() for w in self.pool.workers])
+
+        ensemble.stop()
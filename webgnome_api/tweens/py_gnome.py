@@ -12,6 +12,15 @@ import ujson
 from webgnome_api.common.common_object import ValueIsJsonObject
 
 
+def short_session_id(session_id):
+    '''
+        The short session id that we use in our logs, so we don't have
+        to reveal the real one.
+    '''
+    hasher = hashlib.sha1(session_id)
+    return base64.urlsafe_b64encode(hasher.digest())
+
+
 class PyGnomeSchemaTweenFactory(object):
     def __init__(self, handler, registry):
         self.handler = handler
@@ -40,8 +49,7 @@ class PyGnomeSchemaTweenFactory(object):
 
     def generate_short_session_id(self, request):
         if hasattr(request, 'session'):
-            hasher = hashlib.sha1(request.session.session_id)
-            request.session_hash = base64.urlsafe_b64encode(hasher.digest())
+            request.session_hash = short_session_id(request.session.session_id)
 
     def before_the_handler(self, request):
         # code to be executed for each request
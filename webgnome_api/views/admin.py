@@ -0,0 +1,91 @@
+"""
+Views for the administration of our server.
+"""
+import logging
+
+from pyramid.settings import asbool
+from pyramid.httpexceptions import HTTPNotFound
+from cornice import Service
+
+from webgnome_api.common.views import cors_exception, cors_policy
+from webgnome_api.common.memory import process_rss
+from webgnome_api.common.session_management import (session_memory_usage,
+                                                    memory_caps)
+from webgnome_api.tweens.py_gnome import short_session_id
+
+log = logging.getLogger(__name__)
+
+memory_api = Service(name='memory', path='/admin/memory',
+                     description="Memory use of our sessions",
+                     cors_policy=cors_policy)
+
+location_cache_api = Service(name='location_cache',
+                             path='/admin/location_cache',
+                             description="Our cache of location models",
+                             cors_policy=cors_policy)
+
+
+def admin_enabled(request):
+    return asbool(request.registry.settings.get('admin.enabled', False))
+
+
+@memory_api.get()
+def get_memory(request):
+    '''
+        Returns the estimated memory use of every session we know of,
+        keyed by the short session id that appears in our logs.
+
+        The objects of a session that is busy (somebody holds its lock
+        exclusively) can not be inspected safely, so we only report
+        its other usage, and mark it as busy.
+    '''
+    if not admin_enabled(request):
+        raise cors_exception(request, HTTPNotFound)
+
+    settings = request.registry.settings
+    session_locks = settings['session_locks']
+
+    session_ids = set(settings['objects'].keys())
+    session_ids.update(session_locks.session_ids())
+
+    sessions = {}
+    for session_id in session_ids:
+        session_lock = session_locks.get_lock(session_id)
+
+        if session_lock.acquire_shared(blocking=False):
+            try:
+                usage = session_memory_usage(settings, session_id)
+                usage['busy'] = False
+            finally:
+                session_lock.release_shared()
+        else:
+            usage = session_memory_usage(settings, session_id,
+                                         with_objects=False)
+            usage['busy'] = True
+
+        sessions[short_session_id(session_id)] = usage
+
+    session_cap, total_cap = memory_caps(settings)
+
+    return {'process_rss': process_rss(),
+            'session_cap': session_cap,
+            'total_cap': total_cap,
+            'total': sum([u['total'] for u in sessions.values()]),
+            'sessions': sessions}
+
+
+@location_cache_api.get()
+def get_location_cache(request):
+    '''
+        Returns the load time of each location in the startup warm up
+        of our location cache, or None if there hasn't been one.
+    '''
+    if not admin_enabled(request):
+        raise cors_exception(request, HTTPNotFound)
+
+    location_models = request.registry.settings['location_models']
+
+    if location_models is None:
+        return {'enabled': False, 'warm_up': None}
+
+    return {'enabled': True, 'warm_up': location_models.warm_up_report}
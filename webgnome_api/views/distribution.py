@@ -4,6 +4,7 @@ Views for the Distribution objects.
 from webgnome_api.common.views import (get_object,
                                        create_object,
                                        update_object,
+                                       patch_object,
                                        cors_policy)
 
 from cornice import Service
@@ -33,3 +34,9 @@ def create_distribution(request):
 def update_distribution(request):
     '''Updates a Gnome Distribution object.'''
     return update_object(request, implemented_types)
+
+
+@distribution.patch()
+def patch_distribution(request):
+    '''Updates some fields of a Gnome Distribution object.'''
+    return patch_object(request, implemented_types)
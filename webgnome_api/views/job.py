@@ -0,0 +1,88 @@
+"""
+Views for the background model run jobs.
+"""
+import logging
+
+from pyramid.httpexceptions import (HTTPConflict,
+                                    HTTPNotFound,
+                                    HTTPPreconditionFailed)
+from cornice import Service
+
+from webgnome_api.common.jobs import ModelRunJob
+from webgnome_api.common.model_run import iter_full_run_steps
+from webgnome_api.common.common_object import obj_id_from_url
+from webgnome_api.common.session_management import (get_active_model,
+                                                    get_run_job,
+                                                    set_run_job)
+
+from webgnome_api.common.views import cors_exception, cors_policy
+
+job_api = Service(name='job', path='/job*obj_id',
+                  description="Model Run Job API", cors_policy=cors_policy)
+
+log = logging.getLogger(__name__)
+
+
+@job_api.post()
+def create_job(request):
+    '''
+        Starts a full run of the current active Model in the background,
+        turning off any response options like /full_run_without_response.
+        Returns the status of the job tracking the run, which includes
+        the job id.
+    '''
+    active_model = get_active_model(request)
+    if active_model:
+        job = ModelRunJob(iter_full_run_steps(request, active_model),
+                          active_model.num_time_steps)
+        set_run_job(request, job)
+
+        log.info('starting model run job {0}'.format(job.id))
+        job.start()
+
+        return job.to_dict()
+    else:
+        raise cors_exception(request, HTTPPreconditionFailed)
+
+
+@job_api.get()
+def get_job(request):
+    '''
+        Returns the status of a job, or the final step output of a
+        finished job if the URL ends with '/result'.
+        If no job id is specified, we return the session's current job.
+    '''
+    job = get_job_from_url(request)
+    obj_ids = request.matchdict.get('obj_id')
+
+    if len(obj_ids) >= 2 and obj_ids[1] == 'result':
+        if job.status != 'done':
+            raise cors_exception(request, HTTPConflict)
+
+        return job.result
+    else:
+        return job.to_dict()
+
+
+@job_api.delete()
+def cancel_job(request):
+    '''
+        Cancels a job.  The run stops after its current step, and the
+        copy of the model that ran it is dropped.
+    '''
+    job = get_job_from_url(request)
+
+    log.info('cancelling model run job {0}'.format(job.id))
+    job.cancel()
+
+    return job.to_dict()
+
+
+def get_job_from_url(request):
+    job = get_run_job(request)
+    job_id = obj_id_from_url(request)
+
+    if job is None or (job_id and job.id != job_id):
+        raise cors_exception(request, HTTPNotFound)
+
+    return job
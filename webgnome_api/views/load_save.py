@@ -15,7 +15,9 @@ from gnome.persist import load, is_savezip_valid
 from webgnome_api.common.common_object import RegisterObject, clean_session_dir
 from webgnome_api.common.session_management import (init_session_objects,
                                                     set_active_model,
-                                                    get_active_model)
+                                                    get_active_model,
+                                                    get_session_lock,
+                                                    model_changed)
 from webgnome_api.common.views import (cors_response,
                                        cors_exception,
                                        process_upload)
@@ -42,7 +44,7 @@ def upload_model(request):
         some extra work to prevent symlink attacks.
     '''
     clean_session_dir(request)
-    file_path = process_upload(request, 'new_model')
+    file_path = process_upload(request, 'new_model', replacing=True)
     # Now that we have our file, we will now try to load the model into
     # memory.
     # Now that we have our file, is it a zipfile?
@@ -51,14 +53,20 @@ def upload_model(request):
                                                     'valid zipfile!'))
 
     # now we try to load our model from the zipfile.
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('semaphore acquired.')
+    session_lock = get_session_lock(request)
+    session_lock.acquire()
+    log.info('session lock acquired.')
     try:
         log.info('loading our model from zip...')
         new_model = load(file_path)
         new_model._cache.enabled = False
+    except:
+        session_lock.release()
+        log.info('session lock released.')
+
+        raise cors_exception(request, HTTPBadRequest, with_stacktrace=True)
 
+    try:
         init_session_objects(request, force=True)
 
         RegisterObject(new_model, request)
@@ -68,8 +76,12 @@ def upload_model(request):
     except:
         raise cors_exception(request, HTTPBadRequest, with_stacktrace=True)
     finally:
-        gnome_sema.release()
-        log.info('semaphore released.')
+        # our pool has been started over, even if the load has failed.
+        try:
+            model_changed(request)
+        finally:
+            session_lock.release()
+            log.info('session lock released.')
 
     # We will want to clean up our tempfile when we are done.
     os.remove(file_path)
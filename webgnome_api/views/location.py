@@ -1,26 +1,25 @@
 """
 Views for the Location objects.
 """
-from os import walk
-from os.path import sep, join, isdir, split, basename
+from os.path import isdir, split
 from logging import getLogger
 
-from geojson import FeatureCollection, Feature, Point
-
-import ujson
-import slugify
-
 from pyramid.httpexceptions import HTTPNotFound, HTTPInternalServerError
+from pyramid.response import Response
 from cornice import Service
 
-from gnome.persist import load
-
 from webgnome_api.common.common_object import obj_id_from_url, RegisterObject
+from webgnome_api.common.location_snapshot import load_location
 from webgnome_api.common.session_management import (init_session_objects,
                                                     set_active_model,
-                                                    get_active_model)
+                                                    get_active_model,
+                                                    get_session_lock,
+                                                    model_changed)
 
-from webgnome_api.common.views import cors_exception, cors_policy
+from webgnome_api.common.views import (cors_exception,
+                                       cors_response,
+                                       cors_policy,
+                                       check_memory_caps)
 
 location_api = Service(name='location', path='/location*obj_id',
                        description="Location API", cors_policy=cors_policy)
@@ -36,51 +35,57 @@ def get_location(request):
     log.info('location_api.cors_origins_for("get") = {0}'
              .format(location_api.cors_origins_for('get')))
 
-    # first, lets just query that we can get to the data
-    locations_dir = request.registry.settings['locations_dir']
-    base_len = len(locations_dir.split(sep))
-    location_content = []
-    location_file_dirs = []
-
-    for (path, _dirnames, filenames) in walk(locations_dir):
-        if len(path.split(sep)) == base_len + 1:
-            [location_content.append(ujson.load(open(join(path, f), 'r')))
-             for f in filenames
-             if f == 'compiled.json']
-
-            [location_file_dirs.append(path + "/" + basename(path) + '_save')
-             for f in filenames
-             if f == 'compiled.json']
+    location_index = request.registry.settings['location_index']
 
     slug = obj_id_from_url(request)
     if slug:
-        matching = [(i, c) for i, c in enumerate(location_content)
-                    if slugify.slugify_url(c['name']) == slug]
-        if matching:
-            gnome_sema = request.registry.settings['py_gnome_semaphore']
-            gnome_sema.acquire()
+        location = location_index.get(slug)
+        if location:
+            location_content, location_file = location
+
+            check_memory_caps(request)
+
+            session_lock = get_session_lock(request)
+            session_lock.acquire()
             try:
-                location_file = location_file_dirs[matching[0][0]]
                 log.info('load location: {0}'.format(location_file))
                 load_location_file(location_file, request)
             except:
                 raise cors_exception(request, HTTPInternalServerError,
                                      with_stacktrace=True)
             finally:
-                gnome_sema.release()
+                session_lock.release()
 
-            return matching[0][1]
+            return location_content
         else:
             raise cors_exception(request, HTTPNotFound)
     else:
-        features = [Feature(geometry=Point(c['geometry']['coordinates']),
-                            properties={'title': c['name'],
-                                        'slug': slugify.slugify_url(c['name']),
-                                        'content': c['steps']
-                                        }
-                            )
-                    for c in location_content]
-        return FeatureCollection(features)
+        return catalog_response(request, location_index.get_catalog())
+
+
+def catalog_response(request, catalog):
+    '''
+        Serves the precomputed catalog of all locations.  Clients that
+        accept it get the gzipped copy, and clients that already have the
+        current catalog get a 304 without any body.
+    '''
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    if (catalog.etag in request.if_none_match or
+            catalog.gzip_etag in request.if_none_match):
+        response = Response(status=304)
+    elif use_gzip:
+        response = Response(body=catalog.gzip_body,
+                            content_type='application/json')
+        response.content_encoding = 'gzip'
+    else:
+        response = Response(body=catalog.body,
+                            content_type='application/json')
+
+    response.etag = catalog.gzip_etag if use_gzip else catalog.etag
+    response.vary = ('Accept-Encoding',)
+
+    return cors_response(request, response)
 
 
 def load_location_file(location_file, request):
@@ -91,24 +96,34 @@ def load_location_file(location_file, request):
     if isdir(location_file):
         active_model = get_active_model(request)
 
-        new_model = load(location_file)
-        new_model._cache.enabled = False
+        location_models = request.registry.settings['location_models']
 
-        if active_model is not None:
-            active_model._map = new_model._map
-            active_model._time_step = new_model._time_step
-            active_model._num_time_steps = new_model._num_time_steps
-            active_model.merge(new_model)
+        if location_models is not None:
+            new_model = location_models.get_model(location_file)
         else:
-            active_model = new_model
+            new_model = load_location(location_file)
+
+        new_model._cache.enabled = False
+
+        try:
+            if active_model is not None:
+                active_model._map = new_model._map
+                active_model._time_step = new_model._time_step
+                active_model._num_time_steps = new_model._num_time_steps
+                active_model.merge(new_model)
+            else:
+                active_model = new_model
 
-        name = split(location_file)[1]
-        if name != '':
-            active_model.name = name
+            name = split(location_file)[1]
+            if name != '':
+                active_model.name = name
 
-        init_session_objects(request, force=True)
+            init_session_objects(request, force=True)
 
-        log.debug("model loaded - begin registering objects")
-        RegisterObject(active_model, request)
+            log.debug("model loaded - begin registering objects")
+            RegisterObject(active_model, request)
 
-        set_active_model(request, active_model.id)
+            set_active_model(request, active_model.id)
+        finally:
+            # a load that failed part way may still have changed our model
+            model_changed(request)
@@ -16,8 +16,10 @@ from pyramid.httpexceptions import (HTTPBadRequest,
 from webgnome_api.common.views import (cors_exception,
                                        cors_response,
                                        get_object,
+                                       patch_object,
                                        cors_policy,
-                                       process_upload)
+                                       process_upload,
+                                       report_model_changed)
 
 from webgnome_api.common.common_object import (CreateObject,
                                                UpdateObject,
@@ -29,7 +31,9 @@ from webgnome_api.common.common_object import (CreateObject,
 from webgnome_api.common.session_management import (init_session_objects,
                                                     get_session_objects,
                                                     get_session_object,
-                                                    set_session_object)
+                                                    set_session_object,
+                                                    get_session_lock,
+                                                    objects_changed)
 
 from webgnome_api.common.helpers import JSONImplementsOneOf
 
@@ -78,9 +82,9 @@ def create_map(request):
         json_request['filename'] = get_file_path(request,
                                                  json_request=json_request)
 
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('  ' + log_prefix + 'semaphore acquired...')
+    session_lock = get_session_lock(request)
+    session_lock.acquire()
+    log.info('  ' + log_prefix + 'session lock acquired...')
 
     try:
         obj = CreateObject(json_request, get_session_objects(request))
@@ -88,13 +92,23 @@ def create_map(request):
         raise cors_exception(request, HTTPUnsupportedMediaType,
                              with_stacktrace=True)
     finally:
-        gnome_sema.release()
-        log.info('  ' + log_prefix + 'semaphore released...')
+        # a create that failed part way may still have added objects.
+        try:
+            objects_changed(request)
+        finally:
+            session_lock.release()
+            log.info('  ' + log_prefix + 'session lock released...')
 
     set_session_object(obj, request)
     return obj.serialize()
 
 
+@map_api.patch()
+def patch_map(request):
+    '''Updates some fields of a Gnome Map object.'''
+    return patch_object(request, implemented_types)
+
+
 @map_api.put()
 def update_map(request):
     '''Updates a Gnome Map object.'''
@@ -109,11 +123,21 @@ def update_map(request):
     obj = get_session_object(obj_id_from_req_payload(json_request),
                              request)
     if obj:
+        session_lock = get_session_lock(request)
+        session_lock.acquire()
+
         try:
             UpdateObject(obj, json_request, get_session_objects(request))
         except:
             raise cors_exception(request, HTTPUnsupportedMediaType,
                                  with_stacktrace=True)
+        finally:
+            # an update that failed part way may still have changed
+            # some of our objects.
+            try:
+                report_model_changed(request)
+            finally:
+                session_lock.release()
     else:
         raise cors_exception(request, HTTPNotFound)
 
@@ -146,7 +170,8 @@ def get_geojson(request, implemented_types):
 
     if obj:
         if ObjectImplementsOneOf(obj, implemented_types):
-            return obj.to_geojson()
+            with get_session_lock(request).shared():
+                return obj.to_geojson()
         else:
             raise cors_exception(request, HTTPNotImplemented)
     else:
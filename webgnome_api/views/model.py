@@ -11,7 +11,11 @@ from cornice import Service
 
 from webgnome_api.common.views import (cors_exception,
                                        cors_policy,
-                                       get_specifications)
+                                       get_specifications,
+                                       patch_object,
+                                       object_response,
+                                       check_memory_caps,
+                                       report_model_changed)
 from webgnome_api.common.common_object import (CreateObject,
                                                UpdateObject,
                                                ObjectImplementsOneOf,
@@ -23,7 +27,9 @@ from webgnome_api.common.session_management import (init_session_objects,
                                                     get_session_object,
                                                     set_session_object,
                                                     get_active_model,
-                                                    set_active_model)
+                                                    set_active_model,
+                                                    get_session_lock,
+                                                    model_changed)
 
 from webgnome_api.common.helpers import JSONImplementsOneOf
 
@@ -48,33 +54,30 @@ def get_model(request):
           - return the current active model if it exists or...
           - return the specification.
     '''
-    ret = None
     obj_id = obj_id_from_url(request)
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
 
-    try:
-        if not obj_id:
-            my_model = get_active_model(request)
-            if my_model:
-                ret = my_model.serialize()
-            else:
-                ret = get_specifications(request, implemented_types)
-        else:
-            obj = get_session_object(obj_id, request)
-            if obj:
-                if ObjectImplementsOneOf(obj, implemented_types):
-                    set_active_model(request, obj.id)
-                    ret = obj.serialize()
-                else:
-                    # we refer to an object, but it is not a Model
-                    raise cors_exception(request, HTTPBadRequest)
-            else:
-                raise cors_exception(request, HTTPNotFound)
-    finally:
-        gnome_sema.release()
+    # Looking up the model can reload the session's objects, and asking
+    # for a model makes it the active one, so we do it before taking the
+    # shared lock, which is only for reading.
+    if not obj_id:
+        my_model = get_active_model(request)
 
-    return ret
+        if not my_model:
+            return get_specifications(request, implemented_types)
+    else:
+        my_model = get_session_object(obj_id, request)
+
+        if not my_model:
+            raise cors_exception(request, HTTPNotFound)
+
+        if not ObjectImplementsOneOf(my_model, implemented_types):
+            # we refer to an object, but it is not a Model
+            raise cors_exception(request, HTTPBadRequest)
+
+        set_active_model(request, my_model.id)
+
+    with get_session_lock(request).shared():
+        return object_response(request, my_model)
 
 
 @model.post()
@@ -94,9 +97,11 @@ def create_model(request):
                                                 implemented_types):
         raise cors_exception(request, HTTPNotImplemented)
 
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('  ' + log_prefix + 'semaphore acquired...')
+    check_memory_caps(request, replacing=True)
+
+    session_lock = get_session_lock(request)
+    session_lock.acquire()
+    log.info('  ' + log_prefix + 'session lock acquired...')
 
     try:
         init_session_objects(request, force=True)
@@ -115,8 +120,12 @@ def create_model(request):
         raise cors_exception(request, HTTPUnsupportedMediaType,
                              with_stacktrace=True)
     finally:
-        gnome_sema.release()
-        log.info('  ' + log_prefix + 'semaphore released...')
+        # our pool has been started over, even if the create has failed.
+        try:
+            model_changed(request)
+        finally:
+            session_lock.release()
+            log.info('  ' + log_prefix + 'session lock released...')
 
     log.info('<<' + log_prefix)
     return new_model.serialize()
@@ -143,9 +152,11 @@ def update_model(request):
     if not JSONImplementsOneOf(json_request, implemented_types):
         raise cors_exception(request, HTTPNotImplemented)
 
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('  ' + log_prefix + 'semaphore acquired...')
+    check_memory_caps(request)
+
+    session_lock = get_session_lock(request)
+    session_lock.acquire()
+    log.info('  ' + log_prefix + 'session lock acquired...')
 
     obj_id = obj_id_from_req_payload(json_request)
     if obj_id:
@@ -163,11 +174,16 @@ def update_model(request):
             raise cors_exception(request, HTTPUnsupportedMediaType,
                                  with_stacktrace=True)
         finally:
-            gnome_sema.release()
-            log.info('  ' + log_prefix + 'semaphore released...')
+            # an update that failed part way may still have changed
+            # some of our objects.
+            try:
+                report_model_changed(request)
+            finally:
+                session_lock.release()
+                log.info('  ' + log_prefix + 'session lock released...')
     else:
-        gnome_sema.release()
-        log.info('  ' + log_prefix + 'semaphore released...')
+        session_lock.release()
+        log.info('  ' + log_prefix + 'session lock released...')
 
         msg = ("raising cors_exception() in update_model. "
                "Updating model before it exists.")
@@ -177,3 +193,15 @@ def update_model(request):
 
     log.info('<<' + log_prefix)
     return ret
+
+
+@model.patch()
+def patch_model(request):
+    '''
+        Updates some fields of a Model object, and returns only those
+        fields.
+        - If we don't specify a model ID, we update the current
+          active model if it exists, or generate a 'Not Found' exception.
+    '''
+    return patch_object(request, implemented_types,
+                        get_default=get_active_model)
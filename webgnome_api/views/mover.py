@@ -20,12 +20,14 @@ from gnome.movers.current_movers import CurrentMoversBase
 from webgnome_api.common.views import (get_object,
                                        create_object,
                                        update_object,
+                                       patch_object,
                                        cors_policy,
                                        cors_response,
                                        cors_exception,
                                        process_upload)
 
-from webgnome_api.common.session_management import get_session_object
+from webgnome_api.common.session_management import (get_session_object,
+                                                    get_session_lock)
 
 log = logging.getLogger(__name__)
 
@@ -70,6 +72,12 @@ def update_mover(request):
     '''Updates a Mover object.'''
     return update_object(request, implemented_types)
 
+
+@mover.patch()
+def patch_mover(request):
+    '''Updates some fields of a Mover object.'''
+    return patch_object(request, implemented_types)
+
 @view_config(route_name='mover_upload', request_method='OPTIONS')
 def mover_upload_options(request):
     return cors_response(request, request.response)
@@ -91,9 +99,9 @@ def get_current_info(request):
     log_prefix = 'req({0}): get_current_info():'.format(id(request))
     log.info('>>' + log_prefix)
 
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('  {0} {1}'.format(log_prefix, 'semaphore acquired...'))
+    session_lock = get_session_lock(request)
+    session_lock.acquire_shared()
+    log.info('  {0} {1}'.format(log_prefix, 'shared lock acquired...'))
 
     try:
         obj_id = request.matchdict.get('obj_id')[0]
@@ -116,8 +124,8 @@ def get_current_info(request):
             exc = cors_exception(request, HTTPNotFound)
             raise exc
     finally:
-        gnome_sema.release()
-        log.info('  ' + log_prefix + 'semaphore released...')
+        session_lock.release_shared()
+        log.info('  ' + log_prefix + 'shared lock released...')
 
     log.info('<<' + log_prefix)
 
@@ -128,9 +136,9 @@ def get_grid_centers(request):
     log_prefix = 'req({0}): get_current_info():'.format(id(request))
     log.info('>>' + log_prefix)
 
-    gnome_sema = request.registry.settings['py_gnome_semaphore']
-    gnome_sema.acquire()
-    log.info('  {0} {1}'.format(log_prefix, 'semaphore acquired...'))
+    session_lock = get_session_lock(request)
+    session_lock.acquire_shared()
+    log.info('  {0} {1}'.format(log_prefix, 'shared lock acquired...'))
 
     try:
         obj_id = request.matchdict.get('obj_id')[0]
@@ -147,8 +155,8 @@ def get_grid_centers(request):
             exc = cors_exception(request, HTTPNotFound)
             raise exc
     finally:
-        gnome_sema.release()
-        log.info('  ' + log_prefix + 'semaphore released...')
+        session_lock.release_shared()
+        log.info('  ' + log_prefix + 'shared lock released...')
 
     log.info('<<' + log_prefix)
 
@@ -4,6 +4,7 @@ Views for the Outputter objects.
 from webgnome_api.common.views import (get_object,
                                        create_object,
                                        update_object,
+                                       patch_object,
                                        cors_policy)
 
 from cornice import Service
@@ -38,3 +39,9 @@ def create_outputter(request):
 def update_outputter(request):
     '''Updates a Gnome Outputter object.'''
     return update_object(request, implemented_types)
+
+
+@outputter.patch()
+def patch_outputter(request):
+    '''Updates some fields of a Gnome Outputter object.'''
+    return patch_object(request, implemented_types)
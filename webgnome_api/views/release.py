@@ -4,6 +4,7 @@ Views for the Release objects.
 from webgnome_api.common.views import (get_object,
                                        create_object,
                                        update_object,
+                                       patch_object,
                                        cors_policy)
 
 from cornice import Service
@@ -34,3 +35,9 @@ def create_release(request):
 def update_release(request):
     '''Updates a Gnome Release object.'''
     return update_object(request, implemented_types)
+
+
+@release.patch()
+def patch_release(request):
+    '''Updates some fields of a Gnome Release object.'''
+    return patch_object(request, implemented_types)
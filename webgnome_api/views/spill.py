@@ -4,6 +4,7 @@ Views for the Spill objects.
 from webgnome_api.common.views import (get_object,
                                        create_object,
                                        update_object,
+                                       patch_object,
                                        cors_policy)
 
 from cornice import Service
@@ -31,3 +32,9 @@ def create_spill(request):
 def update_spill(request):
     '''Updates a Gnome Spill object.'''
     return update_object(request, implemented_types)
+
+
+@spill.patch()
+def patch_spill(request):
+    '''Updates some fields of a Gnome Spill object.'''
+    return patch_object(request, implemented_types)
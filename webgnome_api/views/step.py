@@ -1,23 +1,49 @@
 """
 Views for the Location objects.
 """
+import sys
+import math
 import time
-from collections import defaultdict
+import traceback
 import logging
 
-from pyramid.httpexceptions import (HTTPNotFound,
+import ujson
+import dateutil.parser
+
+from pyramid.response import Response
+from pyramid.httpexceptions import (HTTPBadRequest,
+                                    HTTPNotFound,
                                     HTTPPreconditionFailed,
                                     HTTPUnprocessableEntity)
 from cornice import Service
 
-from gnome.weatherers import Skimmer, Burn, ChemicalDispersion
-
 from webgnome_api.common.session_management import (get_active_model,
                                                     get_uncertain_models,
                                                     drop_uncertain_models,
-                                                    set_uncertain_models)
-
-from webgnome_api.common.views import cors_exception, cors_policy
+                                                    set_uncertain_models,
+                                                    get_session_lock,
+                                                    get_step_lock,
+                                                    get_model_runner,
+                                                    objects_changed,
+                                                    get_model_host,
+                                                    drop_model_host,
+                                                    stop_model_host,
+                                                    step_prefetch_depth,
+                                                    get_step_prefetcher,
+                                                    set_step_prefetcher,
+                                                    drop_step_prefetcher,
+                                                    uncertainty_percentiles)
+from webgnome_api.common.model_host import ModelHostError
+from webgnome_api.common.model_run import (get_uncertain_steps,
+                                           step_model,
+                                           add_weathering_uncertainty,
+                                           start_full_run,
+                                           end_full_run,
+                                           iter_full_run_steps)
+
+from webgnome_api.common.views import (cors_exception,
+                                       cors_response,
+                                       cors_policy)
 
 
 step_api = Service(name='step', path='/step',
@@ -27,6 +53,10 @@ rewind_api = Service(name='rewind', path='/rewind',
 full_run_api = Service(name='full_run', path='/full_run_without_response',
                        description="Model Full Run API",
                        cors_policy=cors_policy)
+full_run_stream_api = Service(name='full_run_stream',
+                              path='/full_run_without_response/stream',
+                              description="Model Full Run Streaming API",
+                              cors_policy=cors_policy)
 
 log = logging.getLogger(__name__)
 
@@ -35,88 +65,165 @@ log = logging.getLogger(__name__)
 def get_step(request):
     '''
         Generates and returns an image corresponding to the step.
+
+        Multiple consecutive steps can be requested in one round trip,
+        either with a 'count' parameter, or an 'until' parameter with
+        the model time of the last step we want.  In that case, a list
+        of step outputs is returned, which is cut short at the end of
+        the model run.
     '''
     log_prefix = 'req({0}): get_step():'.format(id(request))
     log.info('>>' + log_prefix)
 
+    count, until = get_step_batch_params(request)
+
     active_model = get_active_model(request)
     if active_model:
         # generate the next step in the sequence.
-        gnome_sema = request.registry.settings['py_gnome_semaphore']
-        gnome_sema.acquire()
-        log.info('  ' + log_prefix + 'semaphore acquired...')
+        session_lock = get_session_lock(request)
+        session_lock.acquire()
+        log.info('  ' + log_prefix + 'session lock acquired...')
 
         try:
-            if active_model.current_time_step == -1:
-                # our first step, establish uncertain models
-                drop_uncertain_models(request)
-
-                log.info('\thas_weathering_uncertainty {0}'.
-                         format(active_model.has_weathering_uncertainty))
-                if active_model.has_weathering_uncertainty:
-                    set_uncertain_models(request)
-                else:
-                    log.info('Model does not have weathering uncertainty')
-
-            begin = time.time()
-            output = active_model.step()
-
-            begin_uncertain = time.time()
-            steps = get_uncertain_steps(request)
-            end = time.time()
-
-            if steps and 'WeatheringOutput' in output:
-                nominal = output['WeatheringOutput']
-                aggregate = defaultdict(list)
-                low = {}
-                high = {}
-                full_output = {}
-
-                for idx, step_output in enumerate(steps):
-                    for k, v in step_output['WeatheringOutput'].iteritems():
-                        aggregate[k].append(v)
-
-                for k, v in aggregate.iteritems():
-                    low[k] = min(v)
-                    high[k] = max(v)
-
-                full_output = {'time_stamp': nominal['time_stamp'],
-                               'nominal': nominal,
-                               'low': low,
-                               'high': high}
-                for idx, step_output in enumerate(steps):
-                    full_output[idx] = step_output['WeatheringOutput']
-
-                output['WeatheringOutput'] = full_output
-                output['uncertain_response_time'] = end - begin_uncertain
-                output['total_response_time'] = end - begin
-            elif 'WeatheringOutput' in output:
-                nominal = output['WeatheringOutput']
-                full_output = {'time_stamp': nominal['time_stamp'],
-                               'nominal': nominal,
-                               'low': None,
-                               'high': None}
-                output['WeatheringOutput'] = full_output
-                output['uncertain_response_time'] = end - begin_uncertain
-                output['total_response_time'] = end - begin
-
+            model_runner = get_model_runner(request)
+
+            # keeps the prefetcher from stepping a hosted model while
+            # we count and take our steps.
+            with get_step_lock(request, model_runner):
+                if until is not None:
+                    count = num_steps_until(request, active_model,
+                                            model_runner, until)
+
+                # an 'until' we have already reached takes no steps
+                num_steps = 1 if count is None else count
+
+                outputs = []
+                try:
+                    while len(outputs) < num_steps:
+                        outputs.append(next_step(request,
+                                                 active_model, model_runner))
+                except StopIteration:
+                    if not outputs:
+                        raise
+
+            if outputs:
+                objects_changed(request)
+
+            # the steps of a batch are aggregated as one series
+            add_weathering_uncertainty(outputs,
+                                       uncertainty_percentiles(request))
+
+            prefetch_steps(request, model_runner)
         except StopIteration:
             log.info('  ' + log_prefix + 'stop iteration exception...')
-            drop_uncertain_models(request)
+            drop_step_prefetcher(request)
             raise cors_exception(request, HTTPNotFound)
+        except ModelHostError:
+            log.info('  ' + log_prefix + 'model host exception...')
+            drop_step_prefetcher(request)
+            stop_model_host(request)
+            raise cors_exception(request, HTTPUnprocessableEntity,
+                                 with_stacktrace=True)
         except:
             log.info('  ' + log_prefix + 'unknown exception...')
+            drop_step_prefetcher(request)
             raise cors_exception(request, HTTPUnprocessableEntity,
                                  with_stacktrace=True)
         finally:
-            gnome_sema.release()
-            log.info('  ' + log_prefix + 'semaphore released...')
+            session_lock.release()
+            log.info('  ' + log_prefix + 'session lock released...')
 
-        return output
+        if count is None and until is None:
+            return outputs[0]
+        else:
+            return outputs
     else:
         raise cors_exception(request, HTTPPreconditionFailed)
 
 
+def get_step_batch_params(request):
+    count = request.GET.get('count')
+    until = request.GET.get('until')
+
+    try:
+        if count is not None:
+            count = int(count)
+
+            if count < 1:
+                raise ValueError('step count must be at least 1')
+
+        if until is not None:
+            until = dateutil.parser.parse(until)
+
+            if until.tzinfo is not None:
+                # our model times don't have a time zone
+                raise ValueError('until must not have a time zone')
+    except ValueError:
+        raise cors_exception(request, HTTPBadRequest, with_stacktrace=True)
+
+    return count, until
+
+
+def num_steps_until(request, active_model, model_runner, until):
+    '''
+        The number of steps we need to take to reach the first step at
+        or after the model time 'until'.
+        We count from the last step the client has seen, which is behind
+        the model run if steps have been prefetched.
+    '''
+    last_step = model_runner.current_time_step
+
+    prefetcher = get_step_prefetcher(request)
+    if prefetcher is not None:
+        last_step -= prefetcher.num_steps_ahead()
+
+    elapsed = (until - active_model.start_time).total_seconds()
+    until_step = int(math.ceil(elapsed / active_model.time_step))
+
+    return max(until_step - last_step, 0)
+
+
+def next_step(request, active_model, model_runner):
+    '''
+        Returns the output of the next step in the session's model run,
+        using a prefetched step if there is one ready.
+    '''
+    prefetcher = get_step_prefetcher(request)
+    if prefetcher is not None:
+        output = prefetcher.next_step()
+
+        if output is not None:
+            log.info('using prefetched step...')
+            return output
+
+    if model_runner.current_time_step == -1:
+        # our first step, establish uncertain models
+        log.info('\thas_weathering_uncertainty {0}'.
+                 format(active_model.has_weathering_uncertainty))
+        if active_model.has_weathering_uncertainty:
+            set_uncertain_models(request)
+        else:
+            log.info('Model does not have weathering uncertainty')
+            drop_uncertain_models(request)
+
+    return step_model(model_runner, get_uncertain_models(request))
+
+
+def prefetch_steps(request, model_runner):
+    if step_prefetch_depth(request) > 0:
+        prefetcher = get_step_prefetcher(request)
+
+        if prefetcher is None:
+            uncertain_models = get_uncertain_models(request)
+
+            prefetcher = set_step_prefetcher(
+                request, model_runner,
+                lambda: step_model(model_runner, uncertain_models)
+            )
+
+        prefetcher.fill()
+
+
 @rewind_api.get()
 def get_rewind(request):
     '''
@@ -124,16 +231,31 @@ def get_rewind(request):
     '''
     active_model = get_active_model(request)
     if active_model:
-        gnome_sema = request.registry.settings['py_gnome_semaphore']
-        gnome_sema.acquire()
+        session_lock = get_session_lock(request)
+        session_lock.acquire()
 
         try:
+            drop_step_prefetcher(request)
             active_model.rewind()
+            objects_changed(request)
+
+            model_host = get_model_host(request)
+            if model_host is not None:
+                if model_host.is_alive():
+                    model_host.rewind()
+                else:
+                    # the next step starts a new host with our rewound
+                    # copy of the model.
+                    drop_model_host(request)
+        except ModelHostError:
+            drop_model_host(request)
+            raise cors_exception(request, HTTPUnprocessableEntity,
+                                 with_stacktrace=True)
         except:
             raise cors_exception(request, HTTPUnprocessableEntity,
                                  with_stacktrace=True)
         finally:
-            gnome_sema.release()
+            session_lock.release()
     else:
         raise cors_exception(request, HTTPPreconditionFailed)
 
@@ -147,82 +269,68 @@ def get_full_run(request):
     '''
     active_model = get_active_model(request)
     if active_model:
-        gnome_sema = request.registry.settings['py_gnome_semaphore']
-        gnome_sema.acquire()
+        session_lock = get_session_lock(request)
+        session_lock.acquire()
+        drop_step_prefetcher(request)
+        weatherer_enabled_flags = [w.on for w in active_model.weatherers]
 
         try:
-            weatherer_enabled_flags = [w.on for w in active_model.weatherers]
-
-            for w in active_model.weatherers:
-                if isinstance(w, (Skimmer, Burn, ChemicalDispersion)):
-                    w.on = False
-
-            active_model.rewind()
-
-            drop_uncertain_models(request)
-
-            if active_model.has_weathering_uncertainty:
-                log.info('Model has weathering uncertainty')
-                set_uncertain_models(request)
-            else:
-                log.info('Model does not have weathering uncertainty')
+            model_runner = start_full_run(request, active_model)
 
             begin = time.time()
 
-            for step in active_model:
+            for step in model_runner:
                 output = step
-                steps = get_uncertain_steps(request)
+                steps = get_uncertain_steps(get_uncertain_models(request))
 
             end = time.time()
 
-            if steps and 'WeatheringOutput' in output:
-                nominal = output['WeatheringOutput']
-                aggregate = defaultdict(list)
-                low = {}
-                high = {}
-                full_output = {}
-
-                for idx, step_output in enumerate(steps):
-                    for k, v in step_output['WeatheringOutput'].iteritems():
-                        aggregate[k].append(v)
-
-                for k, v in aggregate.iteritems():
-                    low[k] = min(v)
-                    high[k] = max(v)
-
-                full_output = {'time_stamp': nominal['time_stamp'],
-                               'nominal': nominal,
-                               'low': low,
-                               'high': high}
-                for idx, step_output in enumerate(steps):
-                    full_output[idx] = step_output['WeatheringOutput']
-
-                output['WeatheringOutput'] = full_output
-                output['total_response_time'] = end - begin
-            elif 'WeatheringOutput' in output:
-                nominal = output['WeatheringOutput']
-                full_output = {'time_stamp': nominal['time_stamp'],
-                               'nominal': nominal,
-                               'low': None,
-                               'high': None}
-                output['WeatheringOutput'] = full_output
+            if 'WeatheringOutput' in output:
+                output['_uncertain_steps'] = steps
+                add_weathering_uncertainty([output],
+                                           uncertainty_percentiles(request))
                 output['total_response_time'] = end - begin
         except:
             raise cors_exception(request, HTTPUnprocessableEntity,
                                  with_stacktrace=True)
         finally:
-            for a, w in zip(weatherer_enabled_flags, active_model.weatherers):
-                w.on = a
-            gnome_sema.release()
+            end_full_run(request, active_model, weatherer_enabled_flags)
+            session_lock.release()
 
         return output
     else:
         raise cors_exception(request, HTTPPreconditionFailed)
 
 
-def get_uncertain_steps(request):
-    uncertain_models = get_uncertain_models(request)
-    if uncertain_models:
-        return uncertain_models.cmd('step', {})
+@full_run_stream_api.get()
+def get_full_run_stream(request):
+    '''
+        Performs a full run of the current active Model, turning off any
+        response options, just like get_full_run().
+        But instead of only the final step, every step's output is sent
+        as a line of JSON as soon as it has been computed.
+    '''
+    active_model = get_active_model(request)
+    if active_model:
+        response = Response(content_type='application/x-ndjson')
+        response.app_iter = iter_full_run(request, active_model)
+
+        return cors_response(request, response)
     else:
-        return None
+        raise cors_exception(request, HTTPPreconditionFailed)
+
+
+def iter_full_run(request, active_model):
+    '''
+        Generates the step outputs of a full run as lines of JSON.
+        The response has already started by the time a step fails, so
+        a failure is reported as a final line containing an 'error' key.
+    '''
+    try:
+        for output in iter_full_run_steps(request, active_model):
+            yield ujson.dumps(output) + '\n'
+    except Exception:
+        log.exception('full run failed...')
+        fmt = traceback.format_exception(*sys.exc_info())
+
+        yield ujson.dumps({'error': [l.strip() for l in fmt][-2:]}) + '\n'